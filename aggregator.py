@@ -0,0 +1,354 @@
+""" Packing many small application records into few LoRa uplinks.
+
+Aggregator buffers records and sends them as one payload when the next one
+would no longer fit the maximum payload of the current data rate, or when
+the oldest buffered record waited max_delay seconds. decode_payload() is
+the matching decoder for the server side.
+
+Payload layout, the header byte carries format version and encoding:
+- RAW: records are bytes, each preceded by its length as varint
+- DELTA: records are tuples of integers with the same number of fields,
+  given once after the header. The first record of a payload holds the
+  values, the following ones the differences to their predecessor, all
+  zigzag varints. Every payload decodes on its own, a lost uplink takes
+  only its own records with it.
+
+usage:
+    packer = aggregator.Aggregator(lambda payload: mipot.tx_msg(payload, 1, False) == 0, data_rate=5,
+                                   payload_limit=Mipot32001353.max_tx_payload, encoding=aggregator.DELTA, max_delay=300)
+    packer.add((timestamp, temperature, humidity))
+    ...
+    packer.poll()                       # periodically, sends what waited max_delay
+
+    packer = aggregator.Aggregator(lambda payload: mac_tx(lora, budget, 1, payload.hex()), data_rate=budget.data_rate)
+
+    records = aggregator.decode_payload(payload)
+"""
+
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+import airtime
+
+VERSION = 1
+# Record encodings
+RAW = 0
+DELTA = 1
+
+Record = Union[bytes, Tuple[int, ...]]
+
+
+def put_varint(buffer: bytearray, value: int) -> None:
+    """ Append an unsigned integer, 7 bits per byte, least significant first """
+    if value < 0:
+        raise ValueError('Negative varint')
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def get_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """ Returns the value and the offset behind it """
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError('Truncated varint')
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value, offset)
+        shift += 7
+
+
+def zigzag(value: int) -> int:
+    """ Signed to unsigned, small magnitudes stay small """
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def varint_size(value: int) -> int:
+    size = 1
+    while value > 0x7F:
+        value >>= 7
+        size += 1
+    return size
+
+
+class Aggregator:
+    """ Buffer of records which are sent packed into as few uplinks as possible.
+
+    send(payload) is called with each packed payload and returns something
+    true when the payload was accepted, e.g. for Mipot
+    lambda payload: mipot.tx_msg(payload, 1, False) == 0. When it returns
+    something false or raises, the records of that payload and the ones
+    after it go back to the front of the buffer and are tried again with
+    the next payload sent, an exception is passed on.
+
+    Records are never split across payloads. A data rate change takes effect
+    with the next payload, records buffered for a larger one are spread over
+    several payloads. A buffered record which doesn't fit into a payload of
+    its own any more is dropped. failures counts it like a payload that
+    wasn't accepted. send() is called without holding the buffer lock, so
+    other threads may add records while it waits, e.g. for the duty cycle.
+    """
+
+    def __init__(self, send: Callable[[bytes], object], data_rate: int = 0, payload_limit: int = 222,
+                 encoding: int = RAW, max_delay: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        """ args:
+        - send: called with each payload, returns true if it was accepted
+        - data_rate (int): data rate of the uplinks, update it when it changes
+        - payload_limit (int): largest payload the module accepts, regardless of data rate
+        - encoding (int): RAW for bytes records, DELTA for tuples of integers
+        - max_delay (float): seconds a record may wait for company, None to send only when full
+        - clock: time source in seconds
+        """
+        if data_rate not in airtime.MAX_PAYLOAD:
+            raise ValueError('Bad data rate %d' % (data_rate))
+        if encoding not in (RAW, DELTA):
+            raise ValueError('Unknown encoding %d' % (encoding))
+        self._send = send
+        self.data_rate = data_rate
+        self.payload_limit = payload_limit
+        self.encoding = encoding
+        self.max_delay = max_delay
+        self._clock = clock
+        # _lock guards the buffer, _send_lock keeps payloads of concurrent senders in order
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._records: List[Record] = []
+        self._times: List[float] = []
+        # Size of the last, still growing payload
+        self._size = 0
+        self._fields: Optional[int] = None
+        self.records = 0
+        self.payloads = 0
+        self.bytes_sent = 0
+        self.failures = 0
+
+    @property
+    def max_payload(self) -> int:
+        """ Largest payload at the current data rate """
+        return min(airtime.MAX_PAYLOAD[self.data_rate], self.payload_limit)
+
+    def __len__(self) -> int:
+        """ Records buffered """
+        return len(self._records)
+
+    def _header_size(self) -> int:
+        return 1 if self.encoding == RAW else 2
+
+    def _record_size(self, record: Record, previous: Optional[Record]) -> int:
+        if self.encoding == RAW:
+            return varint_size(len(record)) + len(record)
+        if previous is None:
+            return sum(varint_size(zigzag(value)) for value in record)
+        return sum(varint_size(zigzag(value - last)) for (value, last) in zip(record, previous))
+
+    def _check(self, record: Record) -> Record:
+        if self.encoding == RAW:
+            return bytes(record)
+        record = tuple(int(value) for value in record)
+        if not record or len(record) > 255:
+            raise ValueError('Records need 1-255 fields')
+        if self._fields is None:
+            self._fields = len(record)
+        elif len(record) != self._fields:
+            raise ValueError('Record with %d fields, expected %d' % (len(record), self._fields))
+        return record
+
+    def add(self, record: Record) -> int:
+        """ Buffer a record and send the payloads it completed
+        returns:
+        - number of payloads sent
+        raises:
+        - ValueError if the record doesn't fit into an empty payload
+        - what send() raised, the records stay buffered
+        """
+        record = self._check(record)
+        with self._lock:
+            if self._header_size() + self._record_size(record, None) > self.max_payload:
+                raise ValueError('Record too big for a payload at data rate %d' % (self.data_rate))
+            previous = self._records[-1] if self._records else None
+            complete = False
+            if previous is not None and self._size + self._record_size(record, previous) > self.max_payload:
+                complete = True
+                previous = None
+            if previous is None:
+                self._size = self._header_size()
+            self._size += self._record_size(record, previous)
+            self._records.append(record)
+            self._times.append(self._clock())
+            self.records += 1
+            if self._size == self.max_payload:
+                complete = True
+        if not complete:
+            return 0
+        return self._send_pending(False)
+
+    def deadline(self) -> Optional[float]:
+        """ Clock time by which poll() must be called, None without buffered records or max_delay """
+        times = self._times
+        if not times or self.max_delay is None:
+            return None
+        return times[0] + self.max_delay
+
+    def poll(self) -> int:
+        """ Send the buffered records if the oldest waited max_delay, returns the number of payloads sent """
+        deadline = self.deadline()
+        if deadline is None or self._clock() < deadline:
+            return 0
+        return self._send_pending(True)
+
+    def flush(self) -> int:
+        """ Send the buffered records now, returns the number of payloads sent """
+        return self._send_pending(True)
+
+    def _send_pending(self, everything: bool) -> int:
+        """ Send the complete payloads, with everything also the last growing one """
+        with self._send_lock:
+            with self._lock:
+                self._drop_oversized()
+                packed = _pack(self._records, self.max_payload, self.encoding)
+                if not everything and packed and len(packed[-1][0]) < self.max_payload:
+                    # The last payload keeps growing
+                    self._size = len(packed.pop()[0])
+                count = sum(records for (_, records) in packed)
+                records = self._records[:count]
+                times = self._times[:count]
+                del self._records[:count]
+                del self._times[:count]
+
+            sent = 0
+            try:
+                for (payload, payload_records) in packed:
+                    if not self._send(payload):
+                        self.failures += 1
+                        break
+                    sent += 1
+                    self.payloads += 1
+                    self.bytes_sent += len(payload)
+                    del records[:payload_records]
+                    del times[:payload_records]
+            except BaseException:
+                self.failures += 1
+                raise
+            finally:
+                if records:
+                    self._requeue(records, times)
+            return sent
+
+    def _requeue(self, records: List[Record], times: List[float]) -> None:
+        """ Put unsent records back in front of the ones added meanwhile """
+        with self._lock:
+            self._records[:0] = records
+            self._times[:0] = times
+            self._drop_oversized()
+            packed = _pack(self._records, self.max_payload, self.encoding)
+            self._size = len(packed[-1][0]) if packed else 0
+
+    def _drop_oversized(self) -> None:
+        """ Drop the records too big for a payload at the current data rate, lock held """
+        limit = self.max_payload - self._header_size()
+        if all(self._record_size(record, None) <= limit for record in self._records):
+            return
+        kept = [(record, added) for (record, added) in zip(self._records, self._times)
+                if self._record_size(record, None) <= limit]
+        self.failures += len(self._records) - len(kept)
+        self._records[:] = [record for (record, _) in kept]
+        self._times[:] = [added for (_, added) in kept]
+
+
+def _encode_record(buffer: bytearray, record: Record, previous: Optional[Record], encoding: int) -> None:
+    if encoding == RAW:
+        put_varint(buffer, len(record))
+        buffer += record
+    elif previous is None:
+        for value in record:
+            put_varint(buffer, zigzag(value))
+    else:
+        for (value, last) in zip(record, previous):
+            put_varint(buffer, zigzag(value - last))
+
+
+def _pack(records: Sequence[Record], max_payload: int, encoding: int) -> List[Tuple[bytes, int]]:
+    """ Payloads with the number of records in each """
+    payloads = []
+    buffer = bytearray()
+    count = 0
+    previous = None
+    for record in records:
+        encoded = bytearray()
+        _encode_record(encoded, record, previous, encoding)
+        if buffer and len(buffer) + len(encoded) > max_payload:
+            payloads.append((bytes(buffer), count))
+            del buffer[:]
+            count = 0
+        if not buffer:
+            buffer.append((VERSION << 4) | encoding)
+            if encoding == DELTA:
+                buffer.append(len(record))
+            del encoded[:]
+            _encode_record(encoded, record, None, encoding)
+            if len(buffer) + len(encoded) > max_payload:
+                raise ValueError('Record of %d bytes too big for a payload of %d' % (len(encoded), max_payload))
+        buffer += encoded
+        count += 1
+        previous = record
+    if buffer:
+        payloads.append((bytes(buffer), count))
+    return payloads
+
+
+def pack(records: Sequence[Record], max_payload: int, encoding: int = RAW) -> List[bytes]:
+    """ Pack records in order into payloads of at most max_payload bytes
+    raises:
+    - ValueError if a record doesn't fit into an empty payload
+    """
+    return [payload for (payload, _) in _pack(records, max_payload, encoding)]
+
+
+def decode_payload(payload: bytes) -> List[Record]:
+    """ Records of one uplink, bytes for RAW and tuples of integers for DELTA
+    raises:
+    - ValueError for a malformed payload or an unknown version
+    """
+    if not payload:
+        raise ValueError('Empty payload')
+    version = payload[0] >> 4
+    encoding = payload[0] & 0x0F
+    if version != VERSION:
+        raise ValueError('Unknown payload version %d' % (version))
+    records: List[Record] = []
+    if encoding == RAW:
+        offset = 1
+        while offset < len(payload):
+            (length, offset) = get_varint(payload, offset)
+            if offset + length > len(payload):
+                raise ValueError('Truncated record')
+            records.append(bytes(payload[offset:offset + length]))
+            offset += length
+    elif encoding == DELTA:
+        if len(payload) < 2 or payload[1] == 0:
+            raise ValueError('Missing field count')
+        fields = payload[1]
+        offset = 2
+        previous = None
+        while offset < len(payload):
+            values = []
+            for _ in range(fields):
+                (value, offset) = get_varint(payload, offset)
+                values.append(unzigzag(value))
+            if previous is not None:
+                values = [value + last for (value, last) in zip(values, previous)]
+            previous = tuple(values)
+            records.append(previous)
+    else:
+        raise ValueError('Unknown encoding %d' % (encoding))
+    return records
@@ -0,0 +1,238 @@
+""" LoRa time on air and the EU868 duty cycle, computed on the host.
+
+The modules refuse a transmission while the sub-band of every usable
+channel is still blocked by the duty cycle (Mipot tx_msg status 3, RN2483
+no_free_ch). DutyCycleBudget tracks the time on air spent per sub-band, so
+a transmission can wait for the earliest instant it is allowed instead of
+being tried and refused.
+
+Data rates are numbered like in Mipot32001353.set_ch_parameters() and
+RN2483 mac set dr: 0=SF12/125kHz ... 5=SF7/125kHz, 6=SF7/250kHz, 7=FSK/50kbps.
+
+usage:
+    budget = airtime.DutyCycleBudget(data_rate=5)
+    budget.wait()                               # earliest legal instant
+    status = mipot.tx_msg(data, 1, False)
+    budget.charge(budget.airtime(len(data)))    # tx_msg does both with airtime_budget set
+"""
+
+import math
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Spreading factor (0 for FSK) and bandwidth in Hz per data rate
+FSK = 0
+DATA_RATES = {
+    0: (12, 125000),
+    1: (11, 125000),
+    2: (10, 125000),
+    3: (9, 125000),
+    4: (8, 125000),
+    5: (7, 125000),
+    6: (7, 250000),
+    7: (FSK, 50000),
+}
+# Largest application payload per data rate in EU868
+MAX_PAYLOAD = {0: 51, 1: 51, 2: 51, 3: 115, 4: 222, 5: 222, 6: 222, 7: 222}
+# MHDR, FHDR without options, FPort and MIC around the application payload
+LORAWAN_OVERHEAD = 13
+
+
+def time_on_air(phy_length: int, data_rate: int, preamble: int = 8, coding_rate: int = 1,
+                explicit_header: bool = True, crc: bool = True) -> float:
+    """ Seconds a frame of phy_length bytes occupies the channel (Semtech AN1200.13)
+    args:
+    - phy_length (int): PHY payload in bytes, application payload plus LORAWAN_OVERHEAD
+    - data_rate (int): 0-7, see DATA_RATES
+    - preamble (int): programmed preamble symbols, 8 for LoRaWAN
+    - coding_rate (int): 1-4 for 4/5-4/8
+    raises:
+    - ValueError for an unknown data rate
+    """
+    if data_rate not in DATA_RATES:
+        raise ValueError('Bad data rate %d' % (data_rate))
+    (sf, bandwidth) = DATA_RATES[data_rate]
+    if sf == FSK:
+        # 5 bytes preamble, 3 bytes sync word, length byte, payload and CRC
+        return (5 + 3 + 1 + phy_length + (2 if crc else 0)) * 8 / bandwidth
+
+    symbol = (1 << sf) / bandwidth
+    # Low data rate optimization is mandated above 16 ms per symbol
+    low_data_rate = 1 if symbol > 0.016 else 0
+    numerator = 8 * phy_length - 4 * sf + 28 + (16 if crc else 0) - (0 if explicit_header else 20)
+    payload_symbols = 8 + max(math.ceil(numerator / (4 * (sf - 2 * low_data_rate))) * (coding_rate + 4), 0)
+    return (preamble + 4.25 + payload_symbols) * symbol
+
+
+def uplink_airtime(length: int, data_rate: int) -> float:
+    """ Seconds on air of an uplink with length bytes of application payload """
+    return time_on_air(length + LORAWAN_OVERHEAD, data_rate)
+
+
+class SubBand:
+    """ Frequency range sharing one duty cycle limit """
+
+    def __init__(self, name: str, low: int, high: int, duty_cycle: float):
+        self.name = name
+        self.low = low
+        self.high = high
+        self.duty_cycle = duty_cycle
+
+    def __contains__(self, frequency: int) -> bool:
+        return self.low <= frequency < self.high
+
+    def __repr__(self) -> str:
+        return 'SubBand(%r, %.1f-%.1f MHz, %g%%)' % (self.name, self.low / 1e6, self.high / 1e6, self.duty_cycle * 100)
+
+
+# ETSI EN 300 220 sub-bands as used by LoRaWAN EU868
+EU868_SUB_BANDS = (
+    SubBand('g-863', 863000000, 865000000, 0.001),
+    SubBand('g-865', 865000000, 868000000, 0.01),
+    SubBand('g1', 868000000, 868600000, 0.01),
+    SubBand('g2', 868700000, 869200000, 0.001),
+    SubBand('g3', 869400000, 869650000, 0.1),
+    SubBand('g4', 869700000, 870000000, 0.01),
+)
+# Join channels every EU868 device has enabled
+EU868_DEFAULT_CHANNELS = {0: 868100000, 1: 868300000, 2: 868500000}
+
+
+class _Bucket:
+    """ Time on air available in one sub-band, refilled at its duty cycle """
+
+    def __init__(self, band: SubBand, capacity: float, now: float):
+        self.band = band
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.band.duty_cycle)
+            self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        """ Earliest time the bucket is out of debt """
+        self.refill(now)
+        if self.tokens >= 0:
+            return now
+        return now - self.tokens / self.band.duty_cycle
+
+
+class DutyCycleBudget:
+    """ Duty cycle token bucket per sub-band of the enabled channels.
+
+    Each sub-band holds time on air, refilled at its duty cycle up to burst
+    seconds. A transmission may start when the bucket of a usable sub-band
+    is not in debt and its time on air is then taken from it. With the
+    default burst of 0 this is the off-time rule of the LoRaWAN stacks in
+    the modules: a frame of T seconds blocks its sub-band for T / duty cycle.
+    A larger burst only makes sense when the module enforces the duty cycle
+    over a longer window, too.
+
+    The module picks the channel, so a charge without frequency goes to the
+    sub-band which was ready first, the one the module can use. A channel
+    outside all sub-bands, e.g. in the gap at 868.6-868.7 MHz, counts
+    against the most restrictive one.
+    """
+
+    def __init__(self, data_rate: int = 0, channels: Optional[Dict[int, int]] = None,
+                 sub_bands: Iterable[SubBand] = EU868_SUB_BANDS, burst: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """ args:
+        - data_rate (int): data rate of the uplinks, update it when it changes
+        - channels (Dict[int, int]): enabled channel -> frequency in Hz, default EU868_DEFAULT_CHANNELS
+        - sub_bands: duty cycle limits
+        - burst (float): seconds on air a sub-band may save up
+        - clock: time source in seconds
+        """
+        if data_rate not in DATA_RATES:
+            raise ValueError('Bad data rate %d' % (data_rate))
+        if burst < 0:
+            raise ValueError('Negative burst')
+        self.data_rate = data_rate
+        self.channels = dict(EU868_DEFAULT_CHANNELS if channels is None else channels)
+        self.sub_bands = tuple(sub_bands)
+        if not self.sub_bands:
+            raise ValueError('No sub-band')
+        # Stands in for the sub-band of a frequency which is in none of them
+        self._strictest = min(range(len(self.sub_bands)), key=lambda index: self.sub_bands[index].duty_cycle)
+        self.burst = burst
+        self._clock = clock
+        self._buckets: Dict[int, _Bucket] = dict()
+        self.transmissions = 0
+        self.airtime_total = 0.0
+        self.waited = 0.0
+
+    def set_channel(self, channel: int, frequency: int, enabled: bool = True) -> None:
+        """ Track a channel configured on the module """
+        if enabled:
+            self.channels[channel] = frequency
+        else:
+            self.channels.pop(channel, None)
+
+    def airtime(self, length: int) -> float:
+        """ Seconds on air of an uplink of length payload bytes at the current data rate """
+        return uplink_airtime(length, self.data_rate)
+
+    def _band_index(self, frequency: int) -> int:
+        for (index, band) in enumerate(self.sub_bands):
+            if frequency in band:
+                return index
+        return self._strictest
+
+    def _bucket(self, index: int, now: float) -> _Bucket:
+        bucket = self._buckets.get(index)
+        if bucket is None:
+            bucket = _Bucket(self.sub_bands[index], self.burst, now)
+            self._buckets[index] = bucket
+        return bucket
+
+    def _next_bucket(self, now: float) -> Tuple[float, _Bucket]:
+        """ Ready time and bucket of the usable sub-band ready first, ties go to the one with more time saved """
+        if not self.channels:
+            raise ValueError('No channel enabled')
+        best = None
+        for index in sorted(set(self._band_index(frequency) for frequency in self.channels.values())):
+            bucket = self._bucket(index, now)
+            key = (bucket.ready_at(now), -bucket.tokens)
+            if best is None or key < best[0]:
+                best = (key, bucket)
+        return (best[0][0], best[1])
+
+    def earliest(self) -> float:
+        """ Clock time from which the next transmission is allowed """
+        return self._next_bucket(self._clock())[0]
+
+    def delay(self) -> float:
+        """ Seconds until the next transmission is allowed, 0 if it is now """
+        now = self._clock()
+        return max(0.0, self._next_bucket(now)[0] - now)
+
+    def wait(self) -> float:
+        """ Sleep until the next transmission is allowed, returns the seconds waited """
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+            self.waited += delay
+        return delay
+
+    def charge(self, seconds: float, frequency: Optional[int] = None) -> SubBand:
+        """ Take seconds on air of a transmission just started
+        args:
+        - seconds (float): time on air, see airtime()
+        - frequency (int): channel used, None if the module chose it
+        returns:
+        - the sub-band charged
+        """
+        now = self._clock()
+        if frequency is None:
+            bucket = self._next_bucket(now)[1]
+        else:
+            bucket = self._bucket(self._band_index(frequency), now)
+            bucket.refill(now)
+        bucket.tokens -= seconds
+        self.transmissions += 1
+        self.airtime_total += seconds
+        return bucket.band
@@ -0,0 +1,476 @@
+""" Simulated AT/ASCII command modems for the cSer based drivers.
+
+Bc66Simulator speaks the Quectel BC66 NB-IoT AT dialect as used by
+bc66/test_bc66.py, Rn2483Simulator the Microchip RN2483 LoRaWAN ASCII
+dialect as used by rn2483a/test_rn2483a.py. Both serve the slave side of a
+pty pair, so cSer opens AtModemSimulator.port like a real serial port.
+
+Responses are paced at the configured baud rate and delayed by a
+configurable response time. Network related timings (attach, socket open,
+join, transmission) are configurable as well.
+
+usage:
+    with Bc66Simulator(attach_time=1.0) as sim:
+        fakegpio.add_listener(31, sim.on_wakeup_pin)
+        nbiot = cSer(sim.port, 9600, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE)
+"""
+
+from abc import ABC, abstractmethod
+import heapq
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tty
+from typing import Callable, List, Optional, Tuple
+
+
+class AtModemSimulator(ABC):
+    """ Line based pty modem, subclasses implement handle_line() """
+
+    def __init__(self, baudrate: int = 9600, response_delay: float = 0.005, seed: Optional[int] = None):
+        """ args:
+        - baudrate (int): wire speed used to pace output, 0 to send instantly
+        - response_delay (float): seconds from a command line to its first response
+        - seed (int): seed for reproducible runs
+        """
+        self.response_delay = response_delay
+        self._byte_time = 10 / baudrate if baudrate > 0 else 0.0
+        self._random = random.Random(seed)
+        self._master = -1
+        self._slave = -1
+        self.port = ''
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake_read, self._wake_write = (-1, -1)
+        self._lock = threading.Lock()
+        self._events: List[Tuple[float, int, Callable[[], None]]] = []
+        self._sequence = 0
+        # Time the simulated UART transmitter is busy until
+        self._tx_free = 0.0
+        self.lines_received = 0
+        self.lines_sent = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        (self._master, self._slave) = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        (self._wake_read, self._wake_write) = os.pipe()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        os.write(self._wake_write, b'\x00')
+        self._thread.join()
+        self._thread = None
+        for fd in (self._master, self._slave, self._wake_read, self._wake_write):
+            os.close(fd)
+        (self._wake_read, self._wake_write) = (-1, -1)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    @abstractmethod
+    def handle_line(self, line: str) -> None:
+        """ Answer a line received from the driver, without its line end """
+        pass
+
+    def handle_bytes(self, data: bytes) -> bytes:
+        """ Hook to consume raw input before line splitting, returns what is left """
+        return data
+
+    def send_line(self, text: str, delay: Optional[float] = None) -> None:
+        """ Send text followed by CR LF after delay seconds (default response_delay) """
+        if delay is None:
+            delay = self.response_delay
+        self.schedule(delay, lambda: self._write((text + '\r\n').encode('utf-8')))
+
+    def schedule(self, delay: float, action: Callable[[], None]) -> None:
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._events, (time.monotonic() + delay, self._sequence, action))
+        # Interrupt the select() unless called from the simulator thread itself
+        if self._wake_write >= 0 and threading.current_thread() is not self._thread:
+            os.write(self._wake_write, b'\x00')
+
+    def _write(self, data: bytes) -> None:
+        # Lines leave one after another at wire speed
+        now = time.monotonic()
+        start = max(now, self._tx_free)
+        self._tx_free = start + len(data) * self._byte_time
+        if self._tx_free > now + 0.0005:
+            self.schedule(self._tx_free - now, lambda: os.write(self._master, data))
+        else:
+            os.write(self._master, data)
+        self.lines_sent += 1
+
+    def _run(self) -> None:
+        pending = b''
+        while not self._stop.is_set():
+            with self._lock:
+                timeout = None
+                if self._events:
+                    timeout = max(self._events[0][0] - time.monotonic(), 0.0)
+            (readable, _, _) = select.select([self._master, self._wake_read], [], [], timeout)
+
+            if self._wake_read in readable:
+                os.read(self._wake_read, 64)
+            if self._master in readable:
+                pending = self.handle_bytes(pending + os.read(self._master, 4096))
+                while True:
+                    end = pending.find(b'\n')
+                    if end < 0:
+                        break
+                    line = pending[:end].rstrip(b'\r')
+                    pending = pending[end + 1:]
+                    self.lines_received += 1
+                    self.handle_line(line.decode('utf-8', 'replace'))
+
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._events or self._events[0][0] > now:
+                        break
+                    (_, _, action) = heapq.heappop(self._events)
+                action()
+
+
+class Bc66Simulator(AtModemSimulator):
+    """ Quectel BC66 subset: ATE, CFUN, CPSMS, QCGDEFCONT, QNBIOTEVENT,
+    QATWAKEUP, QICLOSE, QIOPEN and QISENDEX including their URCs. Several
+    commands may share a line separated by ';'.
+
+    The modem starts in power saving mode. A pulse on the wakeup pin (see
+    on_wakeup_pin) wakes it, it goes back to sleep psm_delay seconds after
+    CFUN=0 with PSM enabled. While asleep, input is ignored.
+    """
+
+    def __init__(self, attach_time: float = 5.0, open_delay: float = 0.3, send_delay: float = 0.5,
+                 wake_delay: float = 0.05, psm_delay: float = 2.0, echo: bool = False,
+                 udp_target: Optional[Tuple[str, int]] = None, **kwargs):
+        """ args:
+        - attach_time (float): seconds from CFUN=1 to +IP
+        - open_delay (float): seconds from QIOPEN to +QIOPEN
+        - send_delay (float): seconds from QISENDEX to SEND OK
+        - wake_delay (float): seconds from wakeup pulse to +QATWAKEUP
+        - psm_delay (float): seconds from CFUN=0 to entering PSM
+        - echo (bool): initial echo setting
+        - udp_target ((str, int)): forward QISENDEX data as UDP datagrams to this address
+        further arguments see AtModemSimulator
+        """
+        super().__init__(**kwargs)
+        self.attach_time = attach_time
+        self.open_delay = open_delay
+        self.send_delay = send_delay
+        self.wake_delay = wake_delay
+        self.psm_delay = psm_delay
+        self.echo = echo
+        self.udp_target = udp_target
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if udp_target is not None else None
+        self.asleep = True
+        self.wakeup_indication = True
+        self.psm_enabled = True
+        self.nbiot_events = False
+        self.cfun = 0
+        self.attached = False
+        self.sockets = set()
+        self.datagrams_sent = 0
+        self._generation = 0
+
+    def on_wakeup_pin(self, pin: int, level: int) -> None:
+        """ fakegpio listener for the wakeup pin, wakes the modem on a falling edge """
+        if level == 0:
+            self.schedule(0.0, self._wake)
+
+    def _wake(self) -> None:
+        if not self.asleep:
+            return
+        self.asleep = False
+        if self.wakeup_indication:
+            self.send_line('+QATWAKEUP', self.wake_delay)
+
+    def _enter_psm(self, generation: int) -> None:
+        if generation != self._generation or self.cfun != 0 or not self.psm_enabled:
+            return
+        if self.nbiot_events:
+            self.send_line('+QNBIOTEVENT: "ENTER PSM"', 0.0)
+        self.asleep = True
+
+    def _attach(self, generation: int) -> None:
+        if generation != self._generation or self.cfun != 1:
+            return
+        self.attached = True
+        self.send_line('+IP: 10.%d.%d.%d' % (self._random.randint(0, 255), self._random.randint(0, 255), self._random.randint(1, 254)), 0.0)
+
+    def handle_line(self, line: str) -> None:
+        if self.asleep:
+            return
+        if self.echo:
+            self.send_line(line, 0.0)
+        command = line.strip()
+        if command == '':
+            return
+        # AT+A;+B runs both commands with one final result, stopping at the first error
+        result = 'OK'
+        for (index, part) in enumerate(command.split(';')):
+            if index > 0:
+                part = 'AT' + part.strip()
+            result = self._execute(part)
+            if result != 'OK':
+                break
+        self.send_line(result)
+
+    def _execute(self, command: str) -> str:
+        """ Run one command, returns its final result code """
+        upper = command.upper()
+        if upper in ('AT', 'ATE0', 'ATE1'):
+            if upper != 'AT':
+                self.echo = (upper == 'ATE1')
+        elif upper.startswith('AT+CFUN='):
+            self._generation += 1
+            self.cfun = int(command[8:9] or '0')
+            if self.cfun == 1:
+                self.send_line('+CPIN: READY', self.response_delay + 0.1)
+                self.schedule(self.attach_time, lambda generation=self._generation: self._attach(generation))
+            else:
+                self.attached = False
+                self.sockets.clear()
+                self.schedule(self.psm_delay, lambda generation=self._generation: self._enter_psm(generation))
+        elif upper.startswith('AT+CPSMS='):
+            self.psm_enabled = command[9:10] == '1'
+        elif upper.startswith('AT+QNBIOTEVENT='):
+            self.nbiot_events = command.endswith(',1')
+        elif upper.startswith('AT+QATWAKEUP='):
+            self.wakeup_indication = command.endswith('1')
+        elif upper.startswith('AT+QCGDEFCONT='):
+            pass
+        elif upper.startswith('AT+QICLOSE='):
+            self.sockets.discard(command[11:])
+            self.send_line('CLOSE OK', self.response_delay + 0.05)
+        elif upper.startswith('AT+QIOPEN='):
+            connect_id = command[10:].split(',')[1]
+            if self.attached:
+                self.sockets.add(connect_id)
+                self.send_line('+QIOPEN: %s,0' % (connect_id), self.open_delay)
+            else:
+                self.send_line('+QIOPEN: %s,565' % (connect_id), self.open_delay)
+        elif upper.startswith('AT+QISENDEX='):
+            return self._send_ex(command[12:])
+        else:
+            return 'ERROR'
+        return 'OK'
+
+    def _send_ex(self, arguments: str) -> str:
+        parts = arguments.split(',')
+        if len(parts) != 3 or parts[0] not in self.sockets:
+            return 'ERROR'
+        try:
+            data = bytes.fromhex(parts[2])
+        except ValueError:
+            return 'ERROR'
+        if len(data) != int(parts[1]):
+            return 'ERROR'
+        self.schedule(self.send_delay, lambda: self._send_datagram(data))
+        return 'OK'
+
+    def _send_datagram(self, data: bytes) -> None:
+        if self._udp is not None:
+            self._udp.sendto(data, self.udp_target)
+        self.datagrams_sent += 1
+        self.send_line('SEND OK', 0.0)
+
+
+class Rn2483Simulator(AtModemSimulator):
+    """ Microchip RN2483 subset: sys, radio set, mac set/get, join, tx,
+    save, pause/resume, sleep with break/autobaud wake.
+
+    A transmission occupies the radio for tx_time seconds and the channel it
+    used until the per-channel duty cycle allows the next one. With all
+    channels blocked, mac tx is refused with no_free_ch.
+    """
+
+    VERSION = 'RN2483 1.0.5 Oct 31 2018 15:06:52'
+
+    def __init__(self, join_delay: float = 5.0, tx_time: float = 0.4, save_delay: float = 0.1,
+                 duty_cycle: float = 0.0033, channels: int = 3, downlink_probability: float = 0.0, **kwargs):
+        """ args:
+        - join_delay (float): seconds from mac join otaa to accepted
+        - tx_time (float): seconds from mac tx to mac_tx_ok, time on air plus receive windows
+        - save_delay (float): seconds mac save takes
+        - duty_cycle (float): allowed fraction of time on air per channel, 0 disables the check
+        - channels (int): number of enabled channels
+        - downlink_probability (float): chance of mac_rx instead of mac_tx_ok
+        further arguments see AtModemSimulator (default baudrate 57600)
+        """
+        kwargs.setdefault('baudrate', 57600)
+        super().__init__(**kwargs)
+        self.join_delay = join_delay
+        self.tx_time = tx_time
+        self.save_delay = save_delay
+        self.duty_cycle = duty_cycle
+        self.downlink_probability = downlink_probability
+        self.hweui = '0004A30B01063D73'
+        self.joined = False
+        self.paused = False
+        self.busy = False
+        self.asleep = False
+        self.data_rate = 5
+        self.settings = dict()
+        self._channel_free = [0.0] * channels
+        self._sleep_generation = 0
+        self.frames_sent = 0
+
+    def handle_bytes(self, data: bytes) -> bytes:
+        if not self.asleep:
+            return data
+        # Break followed by 0x55 for autobaud wakes the module early
+        if b'\x55' in data:
+            self._wake()
+            data = data[data.index(b'\x55') + 1:]
+            return data[data.find(b'\n') + 1:] if b'\n' in data else b''
+        return b''
+
+    def _wake(self) -> None:
+        if not self.asleep:
+            return
+        self.asleep = False
+        self._sleep_generation += 1
+        self.send_line('ok')
+
+    def _sleep_done(self, generation: int) -> None:
+        if generation == self._sleep_generation:
+            self._wake()
+
+    def handle_line(self, line: str) -> None:
+        if self.asleep:
+            return
+        words = line.strip().split(' ')
+        if words == ['']:
+            return
+        command = words[0]
+        if command == 'sys':
+            self._sys(words[1:])
+        elif command == 'mac':
+            self._mac(words[1:])
+        elif command == 'radio':
+            self.send_line('ok' if len(words) >= 4 and words[1] == 'set' else 'invalid_param')
+        else:
+            self.send_line('invalid_param')
+
+    def _sys(self, words: List[str]) -> None:
+        if words in (['reset'], ['factoryRESET']):
+            self.joined = False
+            self.paused = False
+            self.busy = False
+            self.send_line(self.VERSION, self.response_delay + 0.1)
+        elif words == ['get', 'ver']:
+            self.send_line(self.VERSION)
+        elif words == ['get', 'hweui']:
+            self.send_line(self.hweui)
+        elif len(words) == 2 and words[0] == 'sleep' and words[1].isdigit():
+            self.asleep = True
+            self._sleep_generation += 1
+            self.schedule(int(words[1]) / 1000, lambda generation=self._sleep_generation: self._sleep_done(generation))
+        else:
+            self.send_line('invalid_param')
+
+    def _mac(self, words: List[str]) -> None:
+        if not words:
+            self.send_line('invalid_param')
+        elif words[0] == 'reset':
+            self.joined = False
+            self.send_line('ok')
+        elif words[0] == 'set' and len(words) >= 3:
+            if words[1] == 'dr':
+                if not words[2].isdigit() or int(words[2]) > 7:
+                    self.send_line('invalid_param')
+                    return
+                self.data_rate = int(words[2])
+            self.settings[words[1]] = words[2]
+            self.send_line('ok')
+        elif words[0] == 'get' and len(words) == 2:
+            if words[1] == 'dr':
+                self.send_line(str(self.data_rate))
+            else:
+                self.send_line(self.settings.get(words[1], 'invalid_param'))
+        elif words[0] == 'save':
+            self.send_line('ok', self.save_delay)
+        elif words[0] == 'pause':
+            self.paused = True
+            self.send_line('4294967245')
+        elif words[0] == 'resume':
+            self.paused = False
+            self.send_line('ok')
+        elif words[0] == 'join' and len(words) == 2 and words[1] in ('otaa', 'abp'):
+            self._join(words[1])
+        elif words[0] == 'tx' and len(words) == 4 and words[1] in ('cnf', 'uncnf'):
+            self._tx(words[1] == 'cnf', words[2], words[3])
+        else:
+            self.send_line('invalid_param')
+
+    def _join(self, mode: str) -> None:
+        if self.paused:
+            self.send_line('mac_paused')
+            return
+        if self.busy:
+            self.send_line('busy')
+            return
+        self.send_line('ok')
+        self.busy = True
+        delay = self.join_delay if mode == 'otaa' else self.response_delay + 0.01
+        self.schedule(delay, self._join_done)
+
+    def _join_done(self) -> None:
+        self.busy = False
+        self.joined = True
+        self.send_line('accepted', 0.0)
+
+    def _tx(self, confirmed: bool, port: str, data: str) -> None:
+        if not port.isdigit() or not 1 <= int(port) <= 223 or len(data) % 2 != 0:
+            self.send_line('invalid_param')
+            return
+        try:
+            bytes.fromhex(data)
+        except ValueError:
+            self.send_line('invalid_param')
+            return
+        if self.paused:
+            self.send_line('mac_paused')
+            return
+        if not self.joined:
+            self.send_line('not_joined')
+            return
+        if self.busy:
+            self.send_line('busy')
+            return
+        now = time.monotonic()
+        channel = min(range(len(self._channel_free)), key=lambda index: self._channel_free[index])
+        if self._channel_free[channel] > now:
+            self.send_line('no_free_ch')
+            return
+        self.send_line('ok')
+        self.busy = True
+        if self.duty_cycle > 0:
+            self._channel_free[channel] = now + self.tx_time / self.duty_cycle
+        self.schedule(self.tx_time, self._tx_done)
+
+    def _tx_done(self) -> None:
+        self.busy = False
+        self.frames_sent += 1
+        if self._random.random() < self.downlink_probability:
+            self.send_line('mac_rx 1 %02X' % (self._random.getrandbits(8)), 0.0)
+        else:
+            self.send_line('mac_tx_ok', 0.0)
@@ -0,0 +1,81 @@
+""" Run the cycles of test_bc66.py against the simulated BC66.
+
+No modem, network or Raspberry Pi needed: RPi.GPIO is replaced by fakegpio
+and the modem by Bc66Simulator. The pause between cycles is skipped.
+Prints cycle time and the measured connection period per cycle, and the
+uplink statistics of the probe datagrams the simulator forwards to a local
+socket.
+
+With combine, the default settings are sent as one AT command line.
+
+usage: python bench_cycle.py [num_cycles] [attach_time] [metrics_csv] [combine]
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fakegpio
+fakegpio.install()
+
+import serial
+import RPi.GPIO as GPIO
+from atsimulator import Bc66Simulator
+from uplinkstats import DeviceTable
+import metrics as m
+from cSer import cSer
+import test_bc66
+
+
+def _receive(receiver: socket.socket, table: DeviceTable) -> None:
+    while True:
+        try:
+            payload = receiver.recv(1024)
+        except OSError:
+            return
+        table.record(time.time_ns(), payload)
+
+
+def run(num_cycles: int, attach_time: float, metrics_path: str, combine: bool = False) -> None:
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    table = DeviceTable()
+    threading.Thread(target=_receive, args=(receiver, table), daemon=True).start()
+    with Bc66Simulator(attach_time=attach_time, psm_delay=0.2, seed=1, udp_target=receiver.getsockname()) as sim:
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(31, GPIO.OUT)
+        fakegpio.add_listener(31, sim.on_wakeup_pin)
+        nbiot = cSer(sim.port, 9600, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE)
+        test_bc66.register_urcs(nbiot)
+
+        metrics = m.MetricsRecorder(metrics_path, fsync=False)
+        cycle_times = []
+        for x in range(1, num_cycles + 1):
+            start = time.perf_counter()
+            metrics.start_cycle()
+            with metrics.phase(m.WAKEUP):
+                test_bc66.wakeup(nbiot)
+            connection_period = test_bc66.run_cycle(nbiot, 1, x, metrics, combine)
+            test_bc66.make_default_settings(nbiot)
+            cycle_times.append(time.perf_counter() - start)
+            print('cycle %3d: %7.1f ms, connection period %d ms' % (x, cycle_times[-1] * 1e3, connection_period))
+            # Let the simulated modem enter PSM again
+            test_bc66.wait_psm(nbiot, sim.psm_delay + 1.0)
+
+        receiver.close()
+        nbiot.close()
+        print('mean cycle time %.1f ms' % (sum(cycle_times) / len(cycle_times) * 1e3))
+        metrics.close()
+        m.main(metrics_path)
+        for (device_id, received, duplicates, reordered, lost, mean_ms, p50_ms, p99_ms) in table.rows():
+            print('device %d: %d received, %d lost, %d reordered, %d duplicates, latency mean %.1f ms, p99 <= %s ms'
+                  % (device_id, received, lost, reordered, duplicates, mean_ms, p99_ms))
+        GPIO.cleanup()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5, float(sys.argv[2]) if len(sys.argv) > 2 else 1.0,
+        sys.argv[3] if len(sys.argv) > 3 else 'bench_metrics.csv', len(sys.argv) > 4 and sys.argv[4] == 'combine')
@@ -0,0 +1,84 @@
+""" Compare the buffered cSer line reader with the former readline() based one.
+
+A writer thread feeds URC-like lines, blank lines and '*' lines into a pty
+at the given baud rate (0: as fast as possible) and cSer reads them back.
+Reported are lines/s and CPU time per line (writer thread included).
+
+usage: python bench_ser_read.py [num_lines]
+"""
+
+import os
+import sys
+import threading
+import time
+import tty
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cSer import cSer
+
+
+def legacy_ser_read(self):
+    """ _ser_read as it was before the receive buffer was introduced """
+    received_bytes = self._ser.port.readline()
+    if received_bytes is None or len(received_bytes) == 0:
+        raise TimeoutError("Timeout occurred during reception.")
+    try:
+        received_bytes = received_bytes.decode('utf-8')
+        if received_bytes == "\r\n" or received_bytes[0:1] == "*":
+            return legacy_ser_read(self)
+        return received_bytes
+    except:
+        pass
+
+
+def make_lines(num_lines: int) -> bytes:
+    lines = []
+    for i in range(num_lines):
+        lines.append('+QNBIOTEVENT: "ENTER PSM"\r\n' if i % 3 else '+IP: 10.0.%d.%d\r\n' % (i // 256 % 256, i % 256))
+        if i % 4 == 0:
+            lines.append('\r\n')
+        if i % 16 == 0:
+            lines.append('*MATREADY: 1\r\n')
+    return ''.join(lines).encode('utf-8')
+
+
+def feed(master: int, data: bytes, baudrate: int) -> None:
+    chunk = 64
+    start = time.monotonic()
+    for offset in range(0, len(data), chunk):
+        if baudrate > 0:
+            delay = start + offset * 10 / baudrate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        os.write(master, data[offset:offset + chunk])
+
+
+def run(read, num_lines: int, baudrate: int):
+    (master, slave) = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    device = cSer(os.ttyname(slave), baudrate or 115200, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE)
+    writer = threading.Thread(target=feed, args=(master, make_lines(num_lines), baudrate))
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    writer.start()
+    for _ in range(num_lines):
+        read(device)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    writer.join()
+    device.close()
+    os.close(master)
+    os.close(slave)
+    return (num_lines / elapsed, cpu / num_lines * 1e6)
+
+
+if __name__ == '__main__':
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for baudrate in (9600, 57600, 0):
+        for (name, read) in (('readline', legacy_ser_read), ('buffered', cSer._ser_read)):
+            (rate, cpu) = run(read, num_lines if baudrate else num_lines * 10, baudrate)
+            print('%6s baud %-9s %9.0f lines/s %8.1f us CPU/line' % (baudrate or 'max', name, rate, cpu))
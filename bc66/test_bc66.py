@@ -1,28 +1,46 @@
-from cSer import cSer
 import RPi.GPIO as GPIO
+import os
 import time
 import serial
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cSer import cSer
+import metrics as m
+
+# unsolicited result codes, never returned as command response
+URC_PREFIXES = ("+QATWAKEUP", "+CPIN:", "+IP:", "+QIOPEN:", "+QIURC:",
+                "+QNBIOTEVENT:", "+CEREG:")
+
+# uplink probe: device id, sequence number, send time in ns (wall clock),
+# evaluated by udpserver.py, see uplinkstats.py
+PROBE = struct.Struct(">HIQ")
+
+
+def register_urcs(device):
+    for prefix in URC_PREFIXES:
+        device.register_urc(prefix)
 
 
 def wakeup(device):
+    # replies to make_default_settings() are still pending
+    device.flush()
     GPIO.output(31, True)
     time.sleep(0.1)
     GPIO.output(31, False)
-    ret = ""
-    while str(ret).strip() != "+QATWAKEUP":
-        # print(ret)
-        ret = device._ser_read()
-
-
-def wait(seconds):
-    print("wait for " + str(seconds) + "s:\t", end="", flush=True)
-    for i in range(seconds):
-        if i % 30 != 0 and i % 5 == 0:
-            print(".", end="", flush=True)
-        elif i % 30 == 0:
-            print(i, end="", flush=True)
-        time.sleep(1)
-    print(seconds)
+    device.wait_urc("+QATWAKEUP")
+
+
+def wait_psm(device, timeout=120):
+    '''Wait until the modem reports entering PSM (needs AT+QNBIOTEVENT=0,1),
+    at most timeout seconds. Returns True if it did'''
+    try:
+        device.wait_urc("+QNBIOTEVENT: \"ENTER PSM\"", timeout)
+        return True
+    except TimeoutError:
+        return False
+
 
 def make_default_settings(device):
     GPIO.output(31, True)
@@ -31,81 +49,118 @@ def make_default_settings(device):
     device._ser_write("AT+CFUN=0")
     device._ser_write("AT+QATWAKEUP=1")
 
-try:
-    GPIO.setmode(GPIO.BOARD)
-    GPIO.setup(31, GPIO.OUT)
-
-    nbiot = cSer('/dev/ttyS0', 9600, serial.EIGHTBITS,
-                 serial.PARITY_NONE, serial.STOPBITS_ONE, 1)
-
-    for x in range(1, 100+1):
-        try:
-            wakeup(nbiot)
-            print("########## Cycle " + str(x) + " started ##########")
 
-            # --------------------- start default settings ---------------------
-
-            nbiot._ser_write_read_verify("ATE0", "OK")  # deactivate serial echo
-            # set to minimal functionality "turn off antenna"
-            nbiot._ser_write_read_verify("AT+CFUN=0", "OK")
-            # enable power save mode; TAU set to max; sleep after 2 seconds
-            nbiot._ser_write_read_verify(
-                "AT+CPSMS=1,,,\"11011111\",\"00000001\"", "OK")  # AT+CPSMS=1,,,"11011111","00000011"
-
-            nbiot._ser_write_read_verify(
-                "AT+QCGDEFCONT=\"IP\",\"iot.1nce.net\"", "OK")  # PSD connection settings
-
-            # enable nb-iot related event report
-            nbiot._ser_write_read_verify("AT+QNBIOTEVENT=0,1", "OK")
-            # enable wakeup indication
-            nbiot._ser_write_read_verify("AT+QATWAKEUP=1", "OK")
-            # --------------------- end default settings ---------------------
-
-            # ------------------------ start sending -------------------------
-            # delete old socket no 1 config
-            nbiot._ser_write_read_verify("AT+QICLOSE=1", "OK")
-            nbiot._ser_read_verify("CLOSE OK")
-
-            # set to full functionality "turn on antenna"
-            start = int(time.time() * 1000)
-            nbiot._ser_write_read_verify("AT+CFUN=1", "OK")
-            ret = ""
-            while str(ret).strip() != "+CPIN: READY":
-                ret = nbiot._ser_read()
-            while str(ret).strip()[0:4] != "+IP:":
-                ret = nbiot._ser_read()
-            connection_period = int(time.time() * 1000) - start
-            
+DEFAULT_SETTINGS = (
+    "ATE0",  # deactivate serial echo
+    # set to minimal functionality "turn off antenna"
+    "AT+CFUN=0",
+    # enable power save mode; TAU set to max; sleep after 2 seconds
+    "AT+CPSMS=1,,,\"11011111\",\"00000001\"",  # AT+CPSMS=1,,,"11011111","00000011"
+    "AT+QCGDEFCONT=\"IP\",\"iot.1nce.net\"",  # PSD connection settings
+    # enable nb-iot related event report
+    "AT+QNBIOTEVENT=0,1",
+    # enable wakeup indication
+    "AT+QATWAKEUP=1",
+)
+
+
+def default_settings(nbiot, metrics=None, combine=False):
+    '''Send DEFAULT_SETTINGS as one batch, the latency of each command line is recorded'''
+    if metrics is None:
+        metrics = m.NullRecorder()
+
+    for line, response, seconds in nbiot.batch(DEFAULT_SETTINGS, "OK", combine):
+        # phase named after the (first) command, e.g. AT+CPSMS
+        metrics.record(line.split("=")[0].split(";")[0], int(seconds * 1e9), ok=response[-1] == "OK")
+
+
+def run_cycle(nbiot, device_id=1, seq=0, metrics=None, combine=False):
+    '''Attach, send one probe datagram and detach. Returns the attach time in ms.
+    With combine, the default settings are sent as one command line'''
+    if metrics is None:
+        metrics = m.NullRecorder()
+
+    # --------------------- start default settings ---------------------
+    with metrics.phase(m.DEFAULT_SETTINGS):
+        default_settings(nbiot, metrics, combine)
+    # --------------------- end default settings ---------------------
+
+    # ------------------------ start sending -------------------------
+    # delete old socket no 1 config
+    nbiot._ser_write_read_verify("AT+QICLOSE=1", "OK")
+    nbiot._ser_read_verify("CLOSE OK")
+
+    # set to full functionality "turn on antenna"
+    nbiot.discard_urcs()
+    start = int(time.time() * 1000)
+    with metrics.phase(m.ATTACH):
+        nbiot._ser_write_read_verify("AT+CFUN=1", "OK")
+        nbiot.wait_urc("+CPIN: READY")
+        nbiot.wait_urc("+IP:", 180)
+    connection_period = int(time.time() * 1000) - start
+
+    with metrics.phase(m.SOCKET_OPEN):
+        nbiot._ser_write_read_verify(
+            "AT+QIOPEN=1,1,\"UDP\",\"92.248.32.107\",5005,1001,0,0", "OK")  # declare socket no 1
+        ret = nbiot.wait_urc("+QIOPEN:")  # open socket no 1
+    if ret != "+QIOPEN: 1,0":
+        print("Fail, expected: +QIOPEN: 1,0, actual: " + ret)
+
+    for i in range(1):
+        payload = PROBE.pack(device_id, seq & 0xFFFFFFFF, time.time_ns())
+        with metrics.phase(m.SEND):
             nbiot._ser_write_read_verify(
-                "AT+QIOPEN=1,1,\"UDP\",\"92.248.32.107\",5005,1001,0,0", "OK")  # declare socket no 1
-            nbiot._ser_read_verify("+QIOPEN: 1,0")  # open socket no 1
-
-            for i in range(1):
-                
-                nbiot._ser_write_read_verify(
-                    "AT+QISENDEX=1,1,AA", "OK")  # send data over socket 1
-                nbiot._ser_read_verify("SEND OK")
-                
-            # set to minimal functionality "turn off antenna"
-            nbiot._ser_write_read_verify("AT+CFUN=0", "OK")
-            nbiot._ser_write("AT+QATWAKEUP=1")
-            # -------------------------- end sending -------------------------
-
-            f = open("log.txt", "a")
-            f.write(str(connection_period) + "\n")
-            f.close()
-        
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-        except:
-            pass
-        finally:
+                "AT+QISENDEX=1," + str(len(payload)) + "," + payload.hex().upper(), "OK")  # send data over socket 1
+            nbiot._ser_read_verify("SEND OK")
+
+    # set to minimal functionality "turn off antenna"
+    nbiot._ser_write_read_verify("AT+CFUN=0", "OK")
+    nbiot._ser_write("AT+QATWAKEUP=1")
+    # -------------------------- end sending -------------------------
+
+    return connection_period
+
+
+def main(port, device_id):
+    nbiot = None
+    metrics = m.MetricsRecorder("metrics.csv", batch_size=16)
+    try:
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(31, GPIO.OUT)
+
+        nbiot = cSer(port, 9600, serial.EIGHTBITS,
+                     serial.PARITY_NONE, serial.STOPBITS_ONE, 1)
+        register_urcs(nbiot)
+
+        for x in range(1, 100+1):
+            try:
+                metrics.start_cycle()
+                with metrics.phase(m.WAKEUP):
+                    wakeup(nbiot)
+                print("########## Cycle " + str(x) + " started ##########")
+
+                run_cycle(nbiot, device_id, x, metrics)
+
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except:
+                pass
+            finally:
+                make_default_settings(nbiot)
+                if not wait_psm(nbiot, 120):
+                    print("no PSM indication within 120s")
+
+
+    except KeyboardInterrupt:
+        print("\n\radios amigos")
+    finally:
+        if nbiot is not None:
             make_default_settings(nbiot)
-            wait(120)
+            nbiot.close()
+        metrics.close()
+        GPIO.cleanup()
 
 
-except KeyboardInterrupt:
-    print("\n\radios amigos")
-finally:
-    make_default_settings(nbiot)
-    GPIO.cleanup()
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyS0',
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1)
@@ -0,0 +1,133 @@
+""" Parser throughput on replayed traffic.
+
+Records the traffic of the Mipot and BC66 drivers against their simulators
+into capture files, then replays the received bytes unthrottled into
+Mipot32001353.receive() and cSer._ser_read() and reports frames/sec. The
+same captures can be replayed into another driver version to compare
+parser throughput on identical input. Finally a short replay at 1x and 10x
+speed shows that the original timing is kept.
+
+usage: python bench_replay.py [mipot_rounds] [bc66_cycles]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, 'mipot32001353'))
+sys.path.insert(0, os.path.join(here, 'bc66'))
+import fakegpio
+fakegpio.install()
+
+import serial
+import RPi.GPIO as GPIO
+import capture
+from atsimulator import Bc66Simulator
+from capture import CaptureReader, ReplaySerial
+from cSer import cSer
+from mipotSimulator import MipotSimulator
+from wirelessModule import Mipot32001353
+import test_bc66
+
+
+def record_mipot(path: str, rounds: int) -> Mipot32001353:
+    with MipotSimulator(indication_interval=0.05, seed=1) as sim:
+        mipot = Mipot32001353({'wakeup': 8, 'reset': 5}, sim.port)
+        capture.tap(mipot, path)
+        for _ in range(rounds):
+            mipot.get_fw_version()
+            mipot.get_deveui()
+            mipot.eeprom_read(0x00, 0x40)
+        capture.untap(mipot)
+    return mipot
+
+
+def record_bc66(path: str, cycles: int) -> cSer:
+    with Bc66Simulator(attach_time=0.2, psm_delay=0.2, seed=1) as sim:
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(31, GPIO.OUT)
+        fakegpio.add_listener(31, sim.on_wakeup_pin)
+        nbiot = cSer(sim.port, 9600, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE)
+        test_bc66.register_urcs(nbiot)
+        capture.tap(nbiot, path)
+        for x in range(cycles):
+            test_bc66.wakeup(nbiot)
+            test_bc66.run_cycle(nbiot, 1, x)
+            test_bc66.make_default_settings(nbiot)
+            time.sleep(sim.psm_delay + 0.1)
+        capture.untap(nbiot)
+        fakegpio.remove_listener(31, sim.on_wakeup_pin)
+    return nbiot
+
+
+def replay(read, replay_port: ReplaySerial):
+    """ Call read until the capture is exhausted, returns (items, seconds) """
+    items = 0
+    start = time.perf_counter()
+    while True:
+        try:
+            read()
+        except TimeoutError:
+            if replay_port.exhausted:
+                break
+            continue
+        items += 1
+    return (items, time.perf_counter() - start)
+
+
+def run(mipot_rounds: int, bc66_cycles: int) -> None:
+    directory = tempfile.mkdtemp()
+    mipot_path = os.path.join(directory, 'mipot.scap')
+    bc66_path = os.path.join(directory, 'bc66.scap')
+    mipot = record_mipot(mipot_path, mipot_rounds)
+    nbiot = record_bc66(bc66_path, bc66_cycles)
+
+    with CaptureReader(mipot_path) as reader:
+        mipot_bytes = len(reader.data())
+    with CaptureReader(bc66_path) as reader:
+        bc66_bytes = len(reader.data())
+
+    # Replay many times to get measurable durations
+    repeat = 50
+    frames = 0
+    elapsed = 0.0
+    for _ in range(repeat):
+        port = ReplaySerial(mipot_path, speed=0)
+        capture.attach(mipot, port)
+        (n, seconds) = replay(lambda: mipot.receive(0.001, None), port)
+        frames += n
+        elapsed += seconds
+    print('Mipot receive()  %6d bytes captured, %8.0f frames/s %10.0f bytes/s' % (
+            mipot_bytes, frames / elapsed, mipot_bytes * repeat / elapsed))
+
+    lines = 0
+    elapsed = 0.0
+    for _ in range(repeat):
+        port = ReplaySerial(bc66_path, speed=0)
+        capture.attach(nbiot, port)
+        nbiot._ser.timeout = 0.001
+        (n, seconds) = replay(nbiot._ser_read, port)
+        lines += n
+        elapsed += seconds
+    print('cSer _ser_read() %6d bytes captured, %8.0f lines/s  %10.0f bytes/s' % (
+            bc66_bytes, lines / elapsed, bc66_bytes * repeat / elapsed))
+
+    with CaptureReader(mipot_path) as reader:
+        records = list(reader.records(capture.RX))
+        duration = (records[-1][0] - records[0][0]) / 1e9
+        del records
+    for speed in (1.0, 10.0):
+        port = ReplaySerial(mipot_path, speed=speed)
+        capture.attach(mipot, port)
+        (_, seconds) = replay(lambda: mipot.receive(0.2, None), port)
+        print('Mipot replay at %4.0fx: %.2f s for %.2f s of capture' % (speed, seconds, duration))
+
+    for path in (mipot_path, bc66_path):
+        os.remove(path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
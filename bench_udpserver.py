@@ -0,0 +1,45 @@
+""" Throughput of udpserver.py over the number of SO_REUSEPORT workers.
+
+For each worker count a server is spawned on localhost and flooded by
+several sender processes. Prints received packets/sec and the share lost
+in socket buffers.
+
+usage: python bench_udpserver.py [count] [worker counts, e.g. 1,2,4]
+"""
+
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import udpload
+
+PORT = 5099
+SENDERS = max(2, os.cpu_count() or 1)
+
+
+def _send(count: int) -> float:
+    return udpload.send('127.0.0.1', PORT, count, 0, 16, 16)
+
+
+def run(count: int, worker_counts) -> None:
+    print('%d CPUs, %d sender processes, %d datagrams per run' % (os.cpu_count() or 1, SENDERS, count))
+    print('workers   received   recv pkt/s   socket drops')
+    for workers in worker_counts:
+        (server, output) = udpload.spawn_server(PORT, ['--workers', str(workers)])
+        start = time.perf_counter()
+        with multiprocessing.Pool(SENDERS) as pool:
+            pool.map(_send, [count // SENDERS] * SENDERS)
+        # Let the workers empty their socket buffers
+        time.sleep(0.5)
+        elapsed = time.perf_counter() - start
+        summary = [line for line in udpload.stop_server(server, output) if line.startswith('total')][-1]
+        received = int(re.search(r'total (\d+) packets', summary).group(1))
+        drops = int(re.search(r'socket drops (\d+)', summary).group(1))
+        print('%7d %10d %12.0f %14d' % (workers, received, received / elapsed, drops))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+        [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4])
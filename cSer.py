@@ -0,0 +1,290 @@
+import serial
+from collections import deque
+from time import time, monotonic, perf_counter, perf_counter_ns
+
+import transport
+
+# final result codes of the 3GPP AT dialect (BC66), ending a response
+AT_FINAL_RESULTS = ("OK", "ERROR", "+CME ERROR", "+CMS ERROR")
+
+
+class cSer():
+    # serial read timeout in seconds
+    _timeout = 60
+    # unclaimed URCs kept for wait_urc()
+    _urc_backlog = 64
+    # longest command line batch() builds when combining commands
+    _max_line_length = 256
+    # tracer(event, ts_ns, **fields), see tracing.py
+    tracer = None
+
+    def __init__(self, port, baudrate, size, parity, stopbits, debug=0, final_results=AT_FINAL_RESULTS, echo=True):
+        '''final_results: prefixes of the lines ending the response to a
+        command in batch(), None if each command is answered by a single
+        line (RN2483: ok, invalid_param, a value, ...)
+        echo: whether the module echoes commands, updated by ATE0/ATE1'''
+        self._debug = debug
+        self.final_results = final_results
+        self.echo = echo
+        try:
+            ser = transport.open(port,
+                                 baudrate=baudrate,
+                                 bytesize=size,
+                                 parity=parity,
+                                 stopbits=stopbits,
+                                 timeout=self._timeout,
+                                 write_timeout=60)
+        except serial.SerialException:
+            raise Exception("No module at given port.")
+        except ValueError:
+            raise Exception("Wrong configuration parameter given.")
+
+        # transport buffering the received bytes, see transport/
+        self._ser = ser
+        self._ser.add_hook(self._on_transfer)
+        self.decode_errors = 0
+        self._last_written = None
+        # the next line may be the echo of the command last written
+        self._echo_pending = False
+        # URC prefix -> handlers, URCs not claimed yet and command responses
+        # read while waiting for an URC
+        self._urc_handlers = {}
+        self._urcs = deque(maxlen=self._urc_backlog)
+        self._responses = deque()
+
+    def close(self):
+        '''Close the port, closing twice is harmless'''
+        self._ser.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _ser_write(self, strIn):
+        '''Write via serial connection to module'''
+        # reset error handling flags
+        transmit_failed = False
+        transmit_incomplete = False
+
+        if self._debug > 0:
+            print(str(int(time() * 1000)) + ":\tUART:\t", strIn)
+
+        self._last_written = str(strIn).strip()
+        # the module echoes a line before executing it, ATE0 included
+        self._echo_pending = self.echo
+        echo = self._echo_setting(self._last_written)
+        if echo is not None:
+            self.echo = echo
+
+        # format input string
+        data = "{}\r\n".format(strIn)
+        data = data.encode('utf-8')
+
+        # send data (blocking)
+        tracer = self.tracer
+        if tracer is not None:
+            tracer("write_start", perf_counter_ns(), command=self._last_written, bytes=len(data))
+        transmitted_bytes = self._ser.write(data)
+        if tracer is not None:
+            tracer("write_end", perf_counter_ns(), bytes=transmitted_bytes)
+
+        # verify transmit
+        if transmitted_bytes == 0:
+            transmit_failed = True
+        elif transmitted_bytes < len(data):
+            transmit_incomplete = True
+
+        # error handling
+        if transmit_failed:
+            raise Exception("Write failed due to timeout.")
+        if transmit_incomplete:
+            raise Exception("Write was incomplete.")
+
+    def _ser_read(self):
+        '''Read via serial connection from module, URCs are routed aside'''
+        # responses read while waiting for an URC come first
+        if self._responses:
+            return self._responses.popleft()
+
+        while True:
+            received = self._ser_read_filtered()
+            if not self._route_urc(received):
+                return received
+
+    def _ser_read_filtered(self, deadline=None):
+        '''Read the next line which is not blank, an asterisk or an echo'''
+        while True:
+            received_bytes = self._ser_read_line(deadline)
+
+            # format output string
+            try:
+                received_bytes = received_bytes.decode('utf-8')
+            except UnicodeDecodeError:
+                self.decode_errors += 1
+                received_bytes = received_bytes.decode('utf-8', 'replace')
+                if self._debug > 0:
+                    print("undecodable line: " + received_bytes)
+
+            # read again if only "empty" lines, an asterisk or the echo of
+            # the last command has been returned. Only the first line after
+            # a write can be the echo, a response may equal the command.
+            if received_bytes.strip() == "" or received_bytes[0:1] == "*":
+                if self._debug > 1:
+                    print("wrong return: " + received_bytes)
+                continue
+            if self._echo_pending:
+                self._echo_pending = False
+                if received_bytes.strip() == self._last_written:
+                    if self._debug > 1:
+                        print("echo: " + received_bytes)
+                    continue
+            elif self._debug > 1:
+                print(received_bytes)
+
+            if self.tracer is not None:
+                self.tracer("frame_complete", perf_counter_ns(), line=received_bytes.strip(),
+                            bytes=len(received_bytes))
+            return received_bytes
+
+    @staticmethod
+    def _echo_setting(line):
+        '''True for a line with ATE1, False for ATE0, else None'''
+        if not line[:2].upper() == "AT":
+            return None
+        echo = None
+        for command in line[2:].split(";"):
+            command = command.strip().upper()
+            if command in ("E", "E0"):
+                echo = False
+            elif command == "E1":
+                echo = True
+        return echo
+
+    def _ser_read_line(self, deadline=None):
+        '''Return the next line including its line end from the receive buffer'''
+        try:
+            return self._ser.read_line(deadline)
+        except TimeoutError:
+            if self.tracer is not None:
+                self.tracer("timeout", perf_counter_ns(), command=self._last_written)
+            raise
+
+    def _on_transfer(self, direction, data):
+        '''Transport hook, traces the first byte of a line'''
+        if direction == transport.RX and self.tracer is not None and not len(self._ser):
+            self.tracer("first_byte", perf_counter_ns(), bytes=len(data))
+
+    def _route_urc(self, line):
+        '''Dispatch line if it is an URC, returns True if it was one'''
+        if not self._urc_handlers:
+            return False
+
+        stripped = line.strip()
+        for prefix, handlers in self._urc_handlers.items():
+            if stripped.startswith(prefix):
+                if self._debug > 1:
+                    print("URC: " + stripped)
+                self._urcs.append(stripped)
+                for handler in handlers:
+                    handler(stripped)
+                return True
+        return False
+
+    def register_urc(self, prefix, handler=None):
+        '''Treat lines starting with prefix as URC and call handler(line) for each'''
+        handlers = self._urc_handlers.setdefault(prefix, [])
+        if handler is not None:
+            handlers.append(handler)
+
+    def discard_urcs(self, prefix=""):
+        '''Forget unclaimed URCs starting with prefix'''
+        for urc in [urc for urc in self._urcs if urc.startswith(prefix)]:
+            self._urcs.remove(urc)
+
+    def flush(self):
+        '''Drop everything received so far, including unclaimed URCs'''
+        self._ser.reset_input_buffer()
+        self._urcs.clear()
+        self._responses.clear()
+
+    def wait_urc(self, prefix, timeout=_timeout):
+        '''Return the next URC starting with prefix, waiting at most timeout seconds'''
+        for urc in self._urcs:
+            if urc.startswith(prefix):
+                self._urcs.remove(urc)
+                return urc
+
+        if not any(prefix.startswith(registered) for registered in self._urc_handlers):
+            self.register_urc(prefix)
+
+        deadline = monotonic() + timeout
+        while True:
+            received = self._ser_read_filtered(deadline)
+            if not self._route_urc(received):
+                # command response, keep it for _ser_read
+                self._responses.append(received)
+            elif received.strip().startswith(prefix):
+                return self._urcs.pop()
+
+    def _ser_write_read_verify(self, strIn, strOut=0):
+        '''Perform serial write and read and verify the read output'''
+        # transmit data
+        self._ser_write(strIn)
+
+        return self._ser_read_verify(strOut)
+
+    def _ser_read_verify(self, strOut=0):
+        # wait for answer
+        answer = self._ser_read()
+
+        # verify return
+        if strOut != 0:
+            try:
+                assert str(answer).strip() == strOut
+            except AssertionError:
+                print("got wrong reply. should be: \"" +
+                      strOut + "\" but was: \"" + str(answer).strip() + "\".")
+
+        return answer
+
+    def batch(self, commands, expected="OK", combine=False):
+        '''Run commands back to back, each written as soon as the response
+        to the previous one is complete (see final_results). Returns (command
+        line, response lines, seconds) per line written, the last response
+        line is the final result.
+        With combine, commands are joined with ";" into as few lines as the
+        line length allows (AT+A;+B), the dialect must support it.'''
+        lines = self._combine(commands) if combine else list(commands)
+        results = []
+        for line in lines:
+            start = perf_counter()
+            self._ser_write(line)
+            response = []
+            while True:
+                answer = self._ser_read().strip()
+                response.append(answer)
+                if self.final_results is None or answer.startswith(self.final_results):
+                    break
+            results.append((line, response, perf_counter() - start))
+
+        # verify after the batch, so no time is lost between the commands
+        if expected is not None:
+            for line, response, _ in results:
+                if response[-1] != expected:
+                    print("got wrong reply to \"" + line + "\". should be: \"" +
+                          expected + "\" but was: \"" + response[-1] + "\".")
+        return results
+
+    def _combine(self, commands):
+        '''Join AT commands into command lines of at most _max_line_length'''
+        lines = []
+        for command in commands:
+            if not command[:2].upper() == "AT":
+                raise ValueError("Cannot combine " + command)
+            if lines and len(lines[-1]) + len(command) - 1 <= self._max_line_length:
+                lines[-1] += ";" + command[2:]
+            else:
+                lines.append(command)
+        return lines
@@ -0,0 +1,267 @@
+""" Capture and replay of the serial traffic of the drivers.
+
+tap() hooks into the transport of a driver (or wraps a plain serial port
+in a CaptureTap) and appends every chunk read or written to a capture
+file, with a perf_counter_ns() timestamp and its direction. ReplaySerial plays the received bytes of a capture back to a
+driver at the original speed, N times faster or unthrottled, so the parsers
+can be benchmarked on field traffic without the radios.
+
+File format: header b'SCAP' + version byte, then records of
+<ts_ns:u64><direction:u8><length:u16><data>, little endian. Records are
+only appended, a capture cut short by a crash is readable up to its last
+complete record.
+
+usage:
+    capture.tap(mipot, 'field.scap')         # record
+    ...
+    capture.untap(mipot)
+
+    replay = ReplaySerial('field.scap', speed=10.0)
+    capture.attach(mipot, replay)           # replay at 10x speed
+    mipot.receive(1.0, None)
+"""
+
+import mmap
+import struct
+import threading
+import time
+import weakref
+from typing import Iterator, Optional, Tuple
+
+import transport
+
+MAGIC = b'SCAP\x01'
+RECORD_HEADER = struct.Struct('<QBH')
+# Direction of a record, as passed to transport hooks
+TX = transport.TX
+RX = transport.RX
+
+# Serial port attributes of the drivers
+_PORT_ATTRIBUTES = ('_ser', '_uart')
+# Transport -> writer of a running capture
+_writers = weakref.WeakKeyDictionary()
+
+
+class CaptureWriter:
+    """ Appends records to a capture file """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def write(self, direction: int, data: bytes, ts_ns: Optional[int] = None) -> None:
+        if ts_ns is None:
+            ts_ns = time.perf_counter_ns()
+        with self._lock:
+            # Longer chunks are split, the length field has 16 bits
+            for offset in range(0, len(data), 0xFFFF):
+                chunk = data[offset:offset + 0xFFFF]
+                self._file.write(RECORD_HEADER.pack(ts_ns, direction, len(chunk)))
+                self._file.write(chunk)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self) -> 'CaptureWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class CaptureReader:
+    """ Memory-mapped read access to a capture file """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError('%s is no capture file' % (path))
+
+    def records(self, direction: Optional[int] = None) -> Iterator[Tuple[int, int, memoryview]]:
+        """ Yield (ts_ns, direction, data) of all complete records, optionally of one direction only """
+        view = memoryview(self._map)
+        size = len(self._map)
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= size:
+            (ts_ns, record_direction, length) = RECORD_HEADER.unpack_from(self._map, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > size:
+                break
+            if direction is None or record_direction == direction:
+                yield (ts_ns, record_direction, view[offset:offset + length])
+            offset += length
+
+    def data(self, direction: int = RX) -> bytes:
+        """ All bytes of one direction concatenated """
+        return b''.join(data for (_, _, data) in self.records(direction))
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> 'CaptureReader':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class CaptureTap:
+    """ Serial port proxy recording all reads and writes """
+
+    def __init__(self, port, writer: CaptureWriter):
+        object.__setattr__(self, '_port', port)
+        object.__setattr__(self, 'writer', writer)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._port.read(size)
+        if data:
+            self.writer.write(RX, data)
+        return data
+
+    def write(self, data) -> int:
+        self.writer.write(TX, bytes(data))
+        return self._port.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._port, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        # e.g. timeout, set by the drivers before blocking reads
+        setattr(self._port, name, value)
+
+
+class ReplaySerial:
+    """ Serial port stand-in returning the received bytes of a capture.
+
+    Bytes become readable at their recorded time divided by speed, counted
+    from the first access. With speed 0 everything is readable at once.
+    Written bytes are counted and dropped. Once the capture is exhausted,
+    reads return what is left and then nothing, which the drivers report
+    as timeout.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.speed = speed
+        self.bytes_written = 0
+        self._reader = CaptureReader(path)
+        self._records = self._reader.records(RX)
+        self._next: Optional[Tuple[int, int, memoryview]] = next(self._records, None)
+        self._first_ts = self._next[0] if self._next is not None else 0
+        self._start: Optional[float] = None
+        self._pending = bytearray()
+        self.is_open = True
+
+    @property
+    def exhausted(self) -> bool:
+        return self._next is None and not self._pending
+
+    @property
+    def in_waiting(self) -> int:
+        self._release()
+        return len(self._pending)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(self._pending) < size:
+            self._release()
+            if len(self._pending) >= size or self._next is None:
+                break
+            now = time.monotonic()
+            due = self._due(self._next[0])
+            if deadline is not None and due > deadline:
+                if deadline > now:
+                    time.sleep(deadline - now)
+                self._release()
+                break
+            if due > now:
+                time.sleep(due - now)
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def write(self, data) -> int:
+        self.bytes_written += len(data)
+        return len(data)
+
+    def reset_input_buffer(self) -> None:
+        self._release()
+        self._pending.clear()
+
+    def close(self) -> None:
+        self.is_open = False
+        self._records = iter(())
+        self._next = None
+        self._reader.close()
+
+    def _due(self, ts_ns: int) -> float:
+        if self.speed <= 0:
+            return 0.0
+        return self._start + (ts_ns - self._first_ts) / 1e9 / self.speed
+
+    def _release(self) -> None:
+        """ Move the records due by now to the pending bytes """
+        if self._start is None:
+            self._start = time.monotonic()
+        now = time.monotonic()
+        while self._next is not None and self._due(self._next[0]) <= now:
+            self._pending += self._next[2]
+            self._next = next(self._records, None)
+
+
+def _port_attribute(driver) -> str:
+    for name in _PORT_ATTRIBUTES:
+        if getattr(driver, name, None) is not None:
+            return name
+    raise ValueError('%s has no serial port' % (type(driver).__name__))
+
+
+def tap(driver, path: str) -> CaptureWriter:
+    """ Record the serial traffic of a cSer or Mipot driver to path """
+    name = _port_attribute(driver)
+    port = getattr(driver, name)
+    writer = CaptureWriter(path)
+    if isinstance(port, transport.Transport):
+        untap(driver)
+        port.add_hook(writer.write)
+        _writers[port] = writer
+    else:
+        setattr(driver, name, CaptureTap(port, writer))
+    return writer
+
+
+def untap(driver) -> None:
+    """ Stop recording, the driver uses its port directly again """
+    name = _port_attribute(driver)
+    port = getattr(driver, name)
+    if isinstance(port, transport.Transport):
+        writer = _writers.pop(port, None)
+        if writer is not None:
+            port.remove_hook(writer.write)
+            writer.close()
+    elif isinstance(port, CaptureTap):
+        port.writer.close()
+        setattr(driver, name, port._port)
+
+
+def attach(driver, replay: ReplaySerial):
+    """ Let a driver read from replay instead of its port, returns the previous port """
+    name = _port_attribute(driver)
+    previous = getattr(driver, name)
+    replay.timeout = getattr(previous, 'timeout', replay.timeout)
+    if isinstance(previous, transport.Transport):
+        return previous.replace_port(replay)
+    setattr(driver, name, replay)
+    return previous
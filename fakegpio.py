@@ -0,0 +1,104 @@
+""" Stand-in for RPi.GPIO to run the drivers without a Raspberry Pi.
+
+install() registers this module as RPi.GPIO, it must be called before a
+driver module imports RPi.GPIO. Pin levels are recorded and listeners can
+follow them, e.g. to let a simulated module react to its reset pin.
+
+usage:
+    import fakegpio
+    fakegpio.install()
+    from wirelessModule import Mipot32001353
+"""
+
+import sys
+import types
+from typing import Callable, Dict, List, Optional
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+
+_mode: Optional[int] = None
+_directions: Dict[int, int] = dict()
+_levels: Dict[int, int] = dict()
+_listeners: Dict[int, List[Callable[[int, int], None]]] = dict()
+# Number of level changes per pin
+toggles: Dict[int, int] = dict()
+
+
+def install() -> None:
+    """ Make 'import RPi.GPIO' return this module """
+    package = sys.modules.get('RPi')
+    if package is None:
+        package = types.ModuleType('RPi')
+        sys.modules['RPi'] = package
+    package.GPIO = sys.modules[__name__]
+    sys.modules['RPi.GPIO'] = sys.modules[__name__]
+
+
+def add_listener(pin: int, callback: Callable[[int, int], None]) -> None:
+    """ Call callback(pin, level) whenever the output level of pin changes """
+    _listeners.setdefault(pin, []).append(callback)
+
+
+def remove_listener(pin: int, callback: Callable[[int, int], None]) -> None:
+    _listeners.get(pin, []).remove(callback)
+
+
+def level(pin: int) -> Optional[int]:
+    """ Current output level of pin, None if never set """
+    return _levels.get(pin)
+
+
+def setmode(mode: int) -> None:
+    global _mode
+    _mode = mode
+
+
+def getmode() -> Optional[int]:
+    return _mode
+
+
+def setwarnings(flag: bool) -> None:
+    pass
+
+
+def setup(channel, direction: int, pull_up_down: int = PUD_OFF, initial: Optional[int] = None) -> None:
+    for pin in _channels(channel):
+        _directions[pin] = direction
+        if initial is not None:
+            output(pin, initial)
+
+
+def output(channel, value) -> None:
+    for pin in _channels(channel):
+        new_level = HIGH if value else LOW
+        if _levels.get(pin) == new_level:
+            continue
+        _levels[pin] = new_level
+        toggles[pin] = toggles.get(pin, 0) + 1
+        for callback in list(_listeners.get(pin, [])):
+            callback(pin, new_level)
+
+
+def input(channel: int) -> int:
+    return _levels.get(channel, LOW)
+
+
+def cleanup(channel=None) -> None:
+    pins = list(_directions) if channel is None else _channels(channel)
+    for pin in pins:
+        _directions.pop(pin, None)
+        _levels.pop(pin, None)
+
+
+def _channels(channel) -> List[int]:
+    if isinstance(channel, (list, tuple)):
+        return list(channel)
+    return [channel]
@@ -0,0 +1,253 @@
+""" Drive many radio modules from one host in parallel.
+
+Each device gets its own job queue and worker thread, so a slow command on
+one radio never holds up the others. Jobs are plain callables taking the
+device as first argument, which fits Mipot32001353 as well as the cSer
+based BC66 and RN2483 drivers.
+
+usage:
+    scheduler = GatewayScheduler()
+    scheduler.add_device('mipot-1', mipot, min_tx_interval=36.0)
+    scheduler.start()
+    scheduler.tx('mipot-1', bytes([1, 2]), 1)
+    scheduler.submit('mipot-1', lambda device: device.eeprom_read(0x20, 1))
+    ...
+    print(scheduler.stats())
+    scheduler.stop()
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class Job:
+    __slots__ = ('function', 'args', 'is_tx', 'payload_len', 'retry_status', 'retries', 'not_before', 'future')
+
+    def __init__(self, function: Callable, args: tuple, is_tx: bool, payload_len: int, retry_status: Iterable[int]):
+        self.function = function
+        self.args = args
+        self.is_tx = is_tx
+        self.payload_len = payload_len
+        self.retry_status = tuple(retry_status)
+        self.retries = 0
+        self.not_before = 0.0
+        self.future: Future = Future()
+
+
+class DeviceWorker:
+    """ Job queue and bookkeeping of a single device """
+
+    def __init__(self, name: str, device: Any, min_tx_interval: float):
+        self.name = name
+        self.device = device
+        self.min_tx_interval = min_tx_interval
+        self.jobs: deque = deque()
+        self.condition = threading.Condition()
+        self.next_tx_time = 0.0
+        self.busy = False
+        self.max_queue_depth = 0
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.retries = 0
+        self.tx_frames = 0
+        self.tx_bytes = 0
+        self.busy_time = 0.0
+
+    def next_job(self, now: float) -> Optional[Job]:
+        """ Take the first job that may run now, tx jobs only after the duty-cycle pause """
+        for job in self.jobs:
+            if job.not_before > now:
+                continue
+            if job.is_tx and self.next_tx_time > now:
+                continue
+            self.jobs.remove(job)
+            return job
+        return None
+
+    def wakeup_time(self, now: float) -> float:
+        """ Earliest time one of the queued jobs becomes runnable """
+        earliest = now + 1.0
+        for job in self.jobs:
+            ready = job.not_before
+            if job.is_tx:
+                ready = max(ready, self.next_tx_time)
+            earliest = min(earliest, ready)
+        return earliest
+
+
+class GatewayScheduler:
+    """ Runs the job queues of all added devices concurrently """
+
+    def __init__(self, busy_retry_interval: float = 1.0, max_busy_retries: int = 10):
+        """ args:
+        - busy_retry_interval (float): seconds before a job is retried which returned a busy status
+        - max_busy_retries (int): give up after this many retries and return the last status
+        """
+        self._busy_retry_interval = busy_retry_interval
+        self._max_busy_retries = max_busy_retries
+        self._workers: Dict[str, DeviceWorker] = dict()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._started = 0.0
+
+    def add_device(self, name: str, device: Any, min_tx_interval: float = 0.0) -> None:
+        """ Add a device
+        args:
+        - name (str): unique name used to submit jobs
+        - device: driver instance passed to every job
+        - min_tx_interval (float): minimum seconds between the start of two tx jobs (duty cycle)
+        """
+        if name in self._workers:
+            raise ValueError('Device %s already added' % (name))
+        worker = DeviceWorker(name, device, min_tx_interval)
+        self._workers[name] = worker
+        if self._running:
+            self._start_worker(worker)
+
+    def submit(self, name: str, function: Callable, *args, tx: bool = False, payload_len: int = 0, retry_status: Iterable[int] = ()) -> Future:
+        """ Queue a job for a device
+        args:
+        - name (str): device name
+        - function (Callable): called as function(device, *args)
+        - tx (bool): job occupies the radio and is subject to the device's duty cycle
+        - payload_len (int): bytes transmitted by the job, for the throughput statistics
+        - retry_status (Iterable[int]): results meaning "busy, try again later"
+        returns:
+        - Future resolving to the result of function
+        """
+        worker = self._workers[name]
+        job = Job(function, args, tx, payload_len, retry_status)
+        with worker.condition:
+            worker.jobs.append(job)
+            worker.max_queue_depth = max(worker.max_queue_depth, len(worker.jobs))
+            worker.condition.notify()
+        return job.future
+
+    def tx(self, name: str, data: bytes, fport: int, confirmed: bool = False) -> Future:
+        """ Queue tx_msg on a Mipot32001353, retried while the device is busy or duty-cycle blocked """
+        return self.submit(name, lambda device: device.tx_msg(data, fport, confirmed), tx=True, payload_len=len(data), retry_status=(1, 3))
+
+    def join(self, name: str, mode: int) -> Future:
+        """ Queue join on a Mipot32001353, retried while the device is busy """
+        return self.submit(name, lambda device: device.join(mode), tx=True, retry_status=(2,))
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._started = time.monotonic()
+        for worker in self._workers.values():
+            self._start_worker(worker)
+
+    def stop(self, drain: bool = True) -> None:
+        """ Stop all workers
+        args:
+        - drain (bool): finish the queued jobs first, otherwise cancel them
+        """
+        if drain:
+            for worker in self._workers.values():
+                with worker.condition:
+                    while worker.jobs or worker.busy:
+                        worker.condition.wait(0.1)
+        self._running = False
+        for worker in self._workers.values():
+            with worker.condition:
+                for job in worker.jobs:
+                    # Retried jobs are already running and cannot be cancelled
+                    if not job.future.cancel():
+                        job.future.set_exception(RuntimeError('Scheduler stopped'))
+                worker.jobs.clear()
+                worker.condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """ Per-device counters, throughput and queue depth """
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        result = dict()
+        for (name, worker) in self._workers.items():
+            with worker.condition:
+                result[name] = {
+                        'queue_depth': len(worker.jobs),
+                        'max_queue_depth': worker.max_queue_depth,
+                        'jobs_done': worker.jobs_done,
+                        'jobs_failed': worker.jobs_failed,
+                        'retries': worker.retries,
+                        'tx_frames': worker.tx_frames,
+                        'tx_bytes_per_sec': worker.tx_bytes / elapsed,
+                        'jobs_per_sec': worker.jobs_done / elapsed,
+                        'utilization': worker.busy_time / elapsed,
+                        }
+        return result
+
+    def _start_worker(self, worker: DeviceWorker) -> None:
+        thread = threading.Thread(target=self._run_worker, args=(worker,), name='gateway-%s' % (worker.name), daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _run_worker(self, worker: DeviceWorker) -> None:
+        while True:
+            with worker.condition:
+                job = None
+                while self._running:
+                    now = time.monotonic()
+                    job = worker.next_job(now)
+                    if job is not None:
+                        break
+                    if worker.jobs:
+                        worker.condition.wait(worker.wakeup_time(now) - now)
+                    else:
+                        worker.condition.wait()
+                if job is None:
+                    return
+                worker.busy = True
+                if job.is_tx:
+                    worker.next_tx_time = now + worker.min_tx_interval
+
+            if job.retries == 0 and not job.future.set_running_or_notify_cancel():
+                with worker.condition:
+                    worker.busy = False
+                    worker.condition.notify_all()
+                continue
+
+            start = time.monotonic()
+            try:
+                result = job.function(worker.device, *job.args)
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+            end = time.monotonic()
+
+            with worker.condition:
+                worker.busy = False
+                worker.busy_time += end - start
+                if error is None and result in job.retry_status and job.retries < self._max_busy_retries:
+                    if self._running:
+                        # Device busy, queue again in front of later jobs
+                        job.retries += 1
+                        worker.retries += 1
+                        job.not_before = end + self._busy_retry_interval
+                        worker.jobs.appendleft(job)
+                        worker.condition.notify_all()
+                        continue
+                    # stop() already failed the queued jobs and nobody would run it again
+                    error = RuntimeError('Scheduler stopped')
+                if error is None:
+                    worker.jobs_done += 1
+                    if job.is_tx and job.payload_len > 0:
+                        worker.tx_frames += 1
+                        worker.tx_bytes += job.payload_len
+                else:
+                    worker.jobs_failed += 1
+                worker.condition.notify_all()
+
+            # Resolve outside the lock, callbacks may submit new jobs
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
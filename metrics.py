@@ -0,0 +1,187 @@
+""" Per-phase timings of the test cycles, shared by all drivers.
+
+A MetricsRecorder keeps the measurements in column arrays and appends them
+to a CSV file in batches, each batch followed by fsync. A crash loses at most
+the rows of the current batch. summarize() reads such a file back and
+returns percentiles per phase.
+
+usage:
+    metrics = MetricsRecorder('metrics.csv')
+    metrics.start_cycle()
+    with metrics.phase(ATTACH):
+        ...
+    metrics.close()
+
+    python metrics.py metrics.csv    # print the summary
+"""
+
+import math
+import os
+import sys
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# Phase names used by the test scripts
+WAKEUP = 'wakeup'
+DEFAULT_SETTINGS = 'default_settings'
+ATTACH = 'cfun_attach'
+SOCKET_OPEN = 'qiopen'
+SEND = 'qisendex_send_ok'
+JOIN = 'join_accepted'
+MAC_TX = 'mac_tx_ok'
+MIPOT_TX = 'mipot_tx_indication'
+
+HEADER = 'cycle,phase,start_ns,duration_ns,ok\n'
+
+
+class MetricsRecorder:
+    """ Columnar buffer of phase timings, written to a CSV file in batches """
+
+    def __init__(self, path: str, batch_size: int = 64, fsync: bool = True):
+        """ args:
+        - path (str): CSV file, appended to
+        - batch_size (int): rows buffered before they are written
+        - fsync (bool): sync the file after each batch
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._fsync = fsync
+        self.cycle = 0
+        self._phases: List[str] = []
+        self._phase_ids: Dict[str, int] = dict()
+        self._cycles = array('I')
+        self._phase_column = array('H')
+        self._starts = array('q')
+        self._durations = array('q')
+        self._ok = array('b')
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a')
+        if new_file:
+            self._file.write(HEADER)
+
+    def start_cycle(self) -> int:
+        self.cycle += 1
+        return self.cycle
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """ Time the block as phase name, a block left by an exception is recorded as failed """
+        start_ns = time.time_ns()
+        start = time.perf_counter_ns()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(name, time.perf_counter_ns() - start, start_ns, ok)
+
+    def record(self, name: str, duration_ns: int, start_ns: Optional[int] = None, ok: bool = True) -> None:
+        """ Add a measurement taken by other means """
+        phase_id = self._phase_ids.get(name)
+        if phase_id is None:
+            phase_id = len(self._phases)
+            self._phases.append(name)
+            self._phase_ids[name] = phase_id
+        self._cycles.append(self.cycle)
+        self._phase_column.append(phase_id)
+        self._starts.append(time.time_ns() - duration_ns if start_ns is None else start_ns)
+        self._durations.append(duration_ns)
+        self._ok.append(1 if ok else 0)
+        if len(self._durations) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Write the buffered rows """
+        if not len(self._durations):
+            return
+        phases = self._phases
+        self._file.write(''.join('%d,%s,%d,%d,%d\n' % row for row in zip(
+                self._cycles, (phases[i] for i in self._phase_column), self._starts, self._durations, self._ok)))
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        for column in (self._cycles, self._phase_column, self._starts, self._durations, self._ok):
+            del column[:]
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self) -> 'MetricsRecorder':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class NullRecorder:
+    """ MetricsRecorder interface doing nothing """
+
+    cycle = 0
+
+    def start_cycle(self) -> int:
+        return 0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        yield
+
+    def record(self, name: str, duration_ns: int, start_ns: Optional[int] = None, ok: bool = True) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def percentile(ordered: List[int], p: float) -> int:
+    """ Nearest-rank percentile of an ascending list """
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(path: str, percentiles=(50, 90, 99)) -> Dict[str, Dict[str, float]]:
+    """ Count, failures, percentiles and max per phase in ms, over the successful rows """
+    durations: Dict[str, array] = dict()
+    failures: Dict[str, int] = dict()
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split(',')
+            if len(fields) != 5 or fields[0] == 'cycle':
+                continue
+            phase = fields[1]
+            if phase not in durations:
+                durations[phase] = array('q')
+                failures[phase] = 0
+            if fields[4] == '1':
+                durations[phase].append(int(fields[3]))
+            else:
+                failures[phase] += 1
+
+    result = dict()
+    for (phase, values) in durations.items():
+        ordered = sorted(values)
+        summary = {'count': len(ordered), 'failures': failures[phase]}
+        for p in percentiles:
+            summary['p%g' % (p)] = percentile(ordered, p) / 1e6 if ordered else float('nan')
+        summary['max'] = ordered[-1] / 1e6 if ordered else float('nan')
+        result[phase] = summary
+    return result
+
+
+def main(path: str) -> None:
+    summary = summarize(path)
+    print('%-22s %7s %6s %10s %10s %10s %10s' % ('phase [ms]', 'count', 'fail', 'p50', 'p90', 'p99', 'max'))
+    for (phase, values) in summary.items():
+        print('%-22s %7d %6d %10.1f %10.1f %10.1f %10.1f' % (
+                phase, values['count'], values['failures'], values['p50'], values['p90'], values['p99'], values['max']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'metrics.csv')
@@ -0,0 +1,348 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple, Union
+import serial
+import RPi.GPIO as GPIO
+from framing import FrameBuilder, FrameDecoder
+from indicationBuffer import BLOCK, IndicationBuffer
+from indications import Indication, decode_indication, decode_indications
+from replyTiming import LatencyTracker, LateReplies, ReplyTimeoutError, RetryPolicy
+from wirelessModule import Mipot32001353
+import airtime
+import readiness
+import transport
+
+
+class AsyncMipot32001353:
+    """ asyncio variant of Mipot32001353.
+
+    The UART is opened non-blocking and read from a reader callback on the
+    event loop, so many modules can be driven from a single thread. Command
+    frames and reply lengths are the same as for Mipot32001353.
+
+    usage:
+        async with AsyncMipot32001353({'wakeup': 8, 'reset': 5}, '/dev/ttyS0') as mipot:
+            version = await mipot.get_fw_version()
+    """
+
+    _valid_indications = Mipot32001353._valid_indications
+    _valid_commands = Mipot32001353._valid_commands
+    _indication_codes = Mipot32001353._indication_codes
+    _any_reply_codes = Mipot32001353._any_reply_codes
+    _read_chunk_size = Mipot32001353._read_chunk_size
+    _idempotent_commands = Mipot32001353._idempotent_commands
+    _reset_timeout = Mipot32001353._reset_timeout
+    _probe_timeout = Mipot32001353._probe_timeout
+    # tracer(event, ts_ns, **fields), see tracing.py
+    tracer = None
+
+    def __init__(self, pins: Dict[str, int], port: str, indication_queue_size: int = 32,
+                 airtime_budget: Optional[airtime.DutyCycleBudget] = None, indication_buffer: Optional[IndicationBuffer] = None):
+        """ args:
+        - pins (Dict[str, int]): GPIO pins, keys 'wakeup' and 'reset'
+        - port (str): serial port the module is connected to
+        - indication_queue_size (int): capacity of the default indication buffer, which drops the newest frame
+        - airtime_budget (DutyCycleBudget): see Mipot32001353
+        - indication_buffer (IndicationBuffer): buffer for received indications with its overflow policy,
+          any but BLOCK, which would stall the event loop
+        """
+        if indication_buffer is None:
+            indication_buffer = IndicationBuffer(indication_queue_size)
+        elif indication_buffer.policy == BLOCK:
+            raise ValueError('Policy %s would block the event loop' % (BLOCK))
+        self._pin_configuration = dict(pins)
+        self._port = port
+        self.indication_buffer = indication_buffer
+        # Duty cycle budget, see Mipot32001353.tx_msg()
+        self.airtime_budget = airtime_budget
+        self._uart: Optional[transport.Transport] = None
+        self._decoder = FrameDecoder()
+        self._frame_builder = FrameBuilder()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._indication_available: Optional[asyncio.Event] = None
+        self._command_lock: Optional[asyncio.Lock] = None
+        self._pending_replies: Dict[int, Tuple[asyncio.Future, Optional[int]]] = dict()
+        # Adaptive timeouts and retries, see Mipot32001353._command()
+        self.reply_timing = LatencyTracker()
+        self.retry_policy = RetryPolicy()
+        self.retry_policies: Dict[int, RetryPolicy] = dict((command, RetryPolicy(attempts=3)) for command in self._idempotent_commands)
+        self.late_replies = LateReplies()
+        self._late_reply_seen: Optional[asyncio.Event] = None
+        GPIO.setup(self._pin_configuration['wakeup'], GPIO.OUT)
+        GPIO.setup(self._pin_configuration['reset'], GPIO.OUT)
+
+    async def open(self) -> None:
+        """ Open the UART and start reading on the running event loop """
+        if self._uart is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._indication_available = asyncio.Event()
+        self._command_lock = asyncio.Lock()
+        self._late_reply_seen = asyncio.Event()
+        self._uart = transport.open(self._port, baudrate=115200, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, rtscts=False, dsrdtr=False, timeout=0)
+        self._loop.add_reader(self._uart.fileno(), self._on_readable)
+
+    def close(self) -> None:
+        if self._uart is None:
+            return
+        self._loop.remove_reader(self._uart.fileno())
+        self._uart.close()
+        self._uart = None
+        for (pending, _) in self._pending_replies.values():
+            pending.cancel()
+        self._pending_replies.clear()
+
+    async def __aenter__(self) -> 'AsyncMipot32001353':
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.sleep()
+        self.close()
+
+    def _on_readable(self) -> None:
+        try:
+            data = self._uart.read_chunk(0, self._read_chunk_size)
+        except serial.SerialException:
+            # Device gone, stop polling a dead fd
+            self._loop.remove_reader(self._uart.fileno())
+            return
+        if not data:
+            return
+        tracer = self.tracer
+        if tracer is not None and len(self._decoder) == 0:
+            tracer('first_byte', time.perf_counter_ns(), bytes=len(data))
+        checksum_errors = self._decoder.checksum_errors
+        self._decoder.feed(data)
+
+        frame = self._decoder.next_frame(self._any_reply_codes)
+        while frame is not None:
+            if tracer is not None:
+                tracer('frame_complete', time.perf_counter_ns(), code=frame[0], bytes=len(frame))
+            if frame[0] in self._indication_codes:
+                dropped = self.indication_buffer.dropped
+                self.indication_buffer.put(frame)
+                self._indication_available.set()
+                if tracer is not None and self.indication_buffer.dropped != dropped:
+                    tracer('indication_dropped', time.perf_counter_ns(), dropped=self.indication_buffer.dropped)
+            elif self.late_replies and self.late_replies.take(frame[0]):
+                # Reply to an attempt given up on, see Mipot32001353._wait_late_replies()
+                self._late_reply_seen.set()
+                if tracer is not None:
+                    tracer('retry', time.perf_counter_ns(), code=frame[0])
+            else:
+                pending = self._pending_replies.get(frame[0])
+                # Replies with an unexpected length are skipped like in _get_reply()
+                if pending is not None and (pending[1] is None or frame[1] == pending[1]):
+                    del self._pending_replies[frame[0]]
+                    if not pending[0].done():
+                        pending[0].set_result(frame)
+                elif pending is not None and tracer is not None:
+                    tracer('retry', time.perf_counter_ns(), code=frame[0])
+            frame = self._decoder.next_frame(self._any_reply_codes)
+
+        if tracer is not None and self._decoder.checksum_errors != checksum_errors:
+            tracer('checksum_error', time.perf_counter_ns(), count=self._decoder.checksum_errors - checksum_errors)
+
+    def sleep(self) -> None:
+        GPIO.output(self._pin_configuration['wakeup'], GPIO.HIGH)
+
+    def wakeup(self) -> None:
+        GPIO.output(self._pin_configuration['wakeup'], GPIO.LOW)
+
+    async def reset(self) -> None:
+        """ Reset the module by its reset pin and wait until it answers again, see Mipot32001353.reset()
+        raises:
+        - readiness.NotReadyError if it doesn't within _reset_timeout seconds
+        """
+        GPIO.output(self._pin_configuration['reset'], GPIO.LOW)
+        await asyncio.sleep(0.1)
+        GPIO.output(self._pin_configuration['reset'], GPIO.HIGH)
+        self._decoder.clear()
+        self.late_replies.clear()
+        await self.wait_ready(self._reset_timeout)
+
+    async def wait_ready(self, timeout_seconds: float) -> int:
+        """ Poll the firmware version (0x34) until the module answers, see Mipot32001353.wait_ready() """
+        try:
+            response = await readiness.wait_until_async(self._probe, timeout_seconds, initial=0.02, maximum=0.5,
+                                                        what='AsyncMipot32001353')
+        finally:
+            self.sleep()
+        return int.from_bytes(response[2:6], 'little', signed=False)
+
+    async def _probe(self, remaining: float) -> bytes:
+        """ Send 0x34 once, without the retries of _command() """
+        async with self._command_lock:
+            pending = self._loop.create_future()
+            self._pending_replies[0xB4] = (pending, 4)
+            try:
+                await self.transmit(b'\x34\x00')
+                return await asyncio.wait_for(pending, min(remaining, self._probe_timeout))
+            finally:
+                if self._pending_replies.get(0xB4, (None,))[0] is pending:
+                    del self._pending_replies[0xB4]
+
+    async def transmit(self, command: bytes) -> None:
+        self.wakeup()
+
+        # command reference says we should wait 1ms
+        await asyncio.sleep(0.001)
+
+        # add 0xAA to the beginning of the command and append checksum
+        to_transmit = self._frame_builder.build(command)
+
+        tracer = self.tracer
+        if tracer is not None:
+            tracer('write_start', time.perf_counter_ns(), code=command[0], bytes=len(to_transmit))
+        self._uart.write(to_transmit)
+        if tracer is not None:
+            tracer('write_end', time.perf_counter_ns(), bytes=len(to_transmit))
+
+    async def _command(self, command: bytes, expected_len: Optional[int], timeout_seconds: float) -> bytes:
+        """ Transmit a command and wait for its reply, one command at a time.
+        Retries and timeouts as in Mipot32001353._command()
+        """
+        code = command[0]
+        reply = code | 0x80
+        policy = self.retry_policies.get(code, self.retry_policy)
+        # Until when the replies to the attempts given up on may arrive
+        late = []
+        async with self._command_lock:
+            try:
+                if self.late_replies:
+                    await self._wait_late_replies(reply)
+                for attempt in range(1, policy.attempts + 1):
+                    if attempt == policy.attempts:
+                        timeout = timeout_seconds
+                    else:
+                        timeout = min(timeout_seconds, self.reply_timing.timeout(code, timeout_seconds) * 2 ** (attempt - 1))
+                    pending = self._loop.create_future()
+                    self._pending_replies[reply] = (pending, expected_len)
+                    start = time.monotonic()
+                    try:
+                        await self.transmit(command)
+                        response = await asyncio.wait_for(pending, timeout)
+                    except asyncio.TimeoutError:
+                        self.reply_timing.record_timeout(code)
+                        late.append(start + timeout_seconds)
+                        if self.tracer is not None:
+                            self.tracer('timeout' if attempt == policy.attempts else 'retry', time.perf_counter_ns(), code=reply)
+                        if attempt == policy.attempts:
+                            # Late replies are dropped by _on_readable()
+                            self.late_replies.expect(reply, late)
+                            raise ReplyTimeoutError(code, timeout, attempt) from None
+                        await asyncio.sleep(policy.pause(attempt))
+                        continue
+                    finally:
+                        if self._pending_replies.get(reply, (None,))[0] is pending:
+                            del self._pending_replies[reply]
+                    self.reply_timing.record(code, time.monotonic() - start)
+                    if late:
+                        # Replies to the attempts given up on may still arrive, _on_readable() drops them
+                        self.late_replies.expect(reply, late)
+                    return response
+            finally:
+                self.sleep()
+
+    async def _wait_late_replies(self, reply: int) -> None:
+        """ Wait until the late replies to a retried command arrived or expired, see Mipot32001353._wait_late_replies() """
+        deadline = self.late_replies.deadline(reply)
+        while deadline is not None:
+            self._late_reply_seen.clear()
+            try:
+                await asyncio.wait_for(self._late_reply_seen.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+            deadline = self.late_replies.deadline(reply)
+
+    async def tx_msg(self, data: bytes, fport: int, confirmed: bool) -> int:
+        """ Transmit a message, see Mipot32001353.tx_msg() """
+        cmd = Mipot32001353._tx_msg_cmd(data, fport, confirmed)
+        budget = self.airtime_budget
+        if budget is not None:
+            delay = budget.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                budget.waited += delay
+        response = await self._command(cmd, 1, 0.25)
+        if budget is not None and response[2] == 0:
+            budget.charge(budget.airtime(len(data)))
+        return response[2]
+
+    async def get_fw_version(self) -> int:
+        response = await self._command(b'\x34\x00', 4, 0.25)
+        return int.from_bytes(response[2:6], 'little', signed=False)
+
+    async def get_serial_no(self) -> int:
+        response = await self._command(b'\x35\x00', 4, 0.25)
+        return int.from_bytes(response[2:6], 'little', signed=False)
+
+    async def get_deveui(self) -> bytes:
+        response = await self._command(b'\x36\x00', 8, 0.25)
+        return response[2:10][::-1]
+
+    async def set_app_key(self, app_key: bytes) -> None:
+        """ Write the application key needed for OTAA to eeprom, see Mipot32001353.set_app_key() """
+        await self._command(Mipot32001353._set_app_key_cmd(app_key), 0, 2)
+
+    async def set_ch_parameters(self, channel: int, frequency: int, min_data_rate: int, max_data_rate: int, enabled: bool) -> int:
+        """ Set channel parameters, see Mipot32001353.set_ch_parameters() """
+        cmd = Mipot32001353._set_ch_parameters_cmd(channel, frequency, min_data_rate, max_data_rate, enabled)
+        response = await self._command(cmd, 1, 0.55)
+        if self.airtime_budget is not None and response[2] == 0:
+            self.airtime_budget.set_channel(channel, frequency, enabled)
+        return response[2]
+
+    async def join(self, mode: int) -> int:
+        """ Join the LoRaWAN network, see Mipot32001353.join() """
+        response = await self._command(Mipot32001353._join_cmd(mode), 1, 0.25)
+        return response[2]
+
+    async def get_activation_status(self) -> int:
+        response = await self._command(b'\x42\x00', 1, 0.25)
+        return response[2]
+
+    async def eeprom_write(self, start_address: int, data: bytes) -> bool:
+        response = await self._command(Mipot32001353._eeprom_write_cmd(start_address, data), 1, 1)
+        return response[2] == 0x00
+
+    async def eeprom_read(self, start_address: int, num_bytes: int) -> Optional[bytes]:
+        response = await self._command(Mipot32001353._eeprom_read_cmd(start_address, num_bytes), None, 1)
+        if response[1] != num_bytes + 1 or response[2] != 0x00:
+            return None
+        return response[3:]
+
+    async def get_indication(self, timeout_seconds: Optional[float]) -> Optional[bytes]:
+        deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+        while True:
+            frame = self.indication_buffer.get_nowait()
+            if frame is not None:
+                return frame
+            self._indication_available.clear()
+            try:
+                await asyncio.wait_for(self._indication_available.wait(), None if deadline is None else deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                return self.indication_buffer.get_nowait()
+
+    async def get_parsed_indication(self, timeout_seconds: Optional[float]) -> Optional[Dict[str, Union[str, int, bool]]]:
+        """ Get a indication as dictionary, see Mipot32001353.get_parsed_indication() """
+        indication = await self.get_indication(timeout_seconds)
+
+        if indication is None:
+            return None
+
+        return Mipot32001353.parse_indication(indication)
+
+    async def get_decoded_indication(self, timeout_seconds: Optional[float]) -> Optional[Indication]:
+        """ Get a indication as record, see Mipot32001353.get_decoded_indication() """
+        indication = await self.get_indication(timeout_seconds)
+
+        if indication is None:
+            return None
+
+        return decode_indication(indication)
+
+    def drain_indications(self, max_count: Optional[int] = None) -> List[Indication]:
+        """ Decode the queued indications without waiting, see Mipot32001353.drain_indications() """
+        return decode_indications(self.indication_buffer.drain(max_count))
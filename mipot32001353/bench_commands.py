@@ -0,0 +1,67 @@
+""" Round-trip latency of driver commands against the simulated module.
+
+Runs without hardware: RPi.GPIO is replaced by fakegpio and the module by
+MipotSimulator. Prints commands/sec and latency percentiles per command,
+optionally with faults injected. With a trace path, the serial events are
+written as Chrome trace for chrome://tracing or Perfetto.
+
+usage: python bench_commands.py [num_rounds] [fault_rate] [trace.json]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fakegpio
+fakegpio.install()
+
+from mipotSimulator import MipotSimulator, FAULTS
+from wirelessModule import Mipot32001353
+from tracing import ChromeTraceSink
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run(num_rounds: int, fault_rate: float, trace_path: str = '') -> None:
+    fault_rates = dict((kind, fault_rate / len(FAULTS)) for kind in FAULTS)
+    with MipotSimulator(fault_rates=fault_rates, seed=1) as sim:
+        mipot = Mipot32001353({'wakeup': 8, 'reset': 5}, sim.port)
+        if trace_path:
+            mipot.tracer = ChromeTraceSink(trace_path, name='mipot')
+        commands = {
+                'get_fw_version': mipot.get_fw_version,
+                'get_deveui': mipot.get_deveui,
+                'eeprom_read': lambda: mipot.eeprom_read(0x00, 0xFE),
+                'eeprom_write': lambda: mipot.eeprom_write(0x20, b'\x00'),
+                }
+        latencies = dict((name, []) for name in commands)
+        failures = 0
+
+        start = time.perf_counter()
+        for _ in range(num_rounds):
+            for (name, command) in commands.items():
+                t = time.perf_counter()
+                try:
+                    command()
+                except TimeoutError:
+                    failures += 1
+                    continue
+                latencies[name].append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+
+        done = sum(len(values) for values in latencies.values())
+        print('%d commands in %.2f s: %.0f commands/s, %d timeouts, faults %s' % (done, elapsed, done / elapsed, failures, sim.faults_injected))
+        for (name, values) in latencies.items():
+            if values:
+                print('%-15s p50 %6.2f ms  p99 %6.2f ms  max %6.2f ms' % (name, percentile(values, 0.5) * 1e3, percentile(values, 0.99) * 1e3, max(values) * 1e3))
+        if trace_path:
+            mipot.tracer.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200, float(sys.argv[2]) if len(sys.argv) > 2 else 0.0,
+        sys.argv[3] if len(sys.argv) > 3 else '')
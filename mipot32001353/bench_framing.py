@@ -0,0 +1,74 @@
+""" Frame building and checksum validation, old code against framing.py.
+
+Builds frames of a mix of command sizes one by one (as transmit() does) and
+in one buffer (build_frames), then validates all checksums of the resulting
+capture-like buffer frame by frame with the old byte loop and in one pass
+with validate_frames(), with and without NumPy.
+
+usage: python bench_framing.py [num_frames]
+"""
+
+import random
+import sys
+import time
+
+import framing
+from framing import FrameBuilder, build_frames, validate_frames
+
+
+def legacy_frame(command: bytes) -> bytes:
+    """ Mipot32001353.transmit() before framing.py """
+    to_transmit = b'\xaa' + command
+    checksum = 0
+    for value in to_transmit:
+        checksum += value
+    checksum = ((checksum ^ 0xFF) + 1) & 0xFF
+    to_transmit += bytes([checksum])
+    return to_transmit
+
+
+def legacy_validate(buffer: bytes):
+    """ Byte loop checksum per frame, as the old receive() did """
+    results = []
+    pos = 0
+    while pos + 4 <= len(buffer):
+        length = buffer[pos + 2]
+        checksum_sum = 0xAA + buffer[pos + 1] + length
+        for value in buffer[pos + 3:pos + 3 + length + 1]:
+            checksum_sum += value
+        results.append((checksum_sum & 0xFF) == 0)
+        pos += length + 4
+    return results
+
+
+def measure(label: str, num_frames: int, function) -> None:
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print('%-32s %8.3f s %10.0f frames/s' % (label, elapsed, num_frames / elapsed))
+
+
+def run(num_frames: int) -> None:
+    rng = random.Random(1)
+    # Mostly short commands, some long EEPROM writes and tx_msg
+    lengths = [rng.choice((0, 0, 1, 2, 5, 11, 16, 32, 211, 253)) for _ in range(num_frames)]
+    commands = [bytes([0x46, length]) + bytes(rng.randrange(256) for _ in range(length)) for length in lengths]
+
+    builder = FrameBuilder()
+    measure('build, old concatenation', num_frames, lambda: [legacy_frame(command) for command in commands])
+    measure('build, FrameBuilder', num_frames, lambda: [builder.build(command) for command in commands])
+    measure('build, build_frames', num_frames, lambda: build_frames(commands))
+
+    buffer = bytes(build_frames(commands))
+    assert buffer == b''.join(legacy_frame(command) for command in commands)
+    measure('validate, old byte loop', num_frames, lambda: legacy_validate(buffer))
+    measure('validate, sum() per frame', num_frames, lambda: validate_frames(buffer, use_numpy=False))
+    if framing.numpy is not None:
+        measure('validate, NumPy one pass', num_frames, lambda: validate_frames(buffer, use_numpy=True))
+    else:
+        print('NumPy not installed, vectorized validation skipped')
+    assert all(validate_frames(buffer)[2])
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
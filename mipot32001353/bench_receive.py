@@ -0,0 +1,154 @@
+""" Compare the buffered frame parser with the former byte-wise parser.
+
+Frames are written to a pyserial loop:// port and read back with both
+implementations. Reported are bytes/sec and UART calls per frame, where every
+read, in_waiting query and timeout change is counted (each is at least one
+system call on a real port).
+
+usage: python bench_receive.py [num_frames]
+"""
+
+import os
+import sys
+import time
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fakegpio
+fakegpio.install()
+
+from framing import FrameDecoder, checksum
+from wirelessModule import Mipot32001353
+
+
+class CountingSerial:
+    """ Proxy counting the calls made on a serial port """
+
+    def __init__(self, uart):
+        self._uart = uart
+        self.calls = 0
+
+    @property
+    def in_waiting(self):
+        self.calls += 1
+        return self._uart.in_waiting
+
+    @property
+    def timeout(self):
+        return self._uart.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.calls += 1
+        self._uart.timeout = value
+
+    def read(self, size=1):
+        self.calls += 1
+        return self._uart.read(size)
+
+    def write(self, data):
+        return self._uart.write(data)
+
+    def close(self):
+        self._uart.close()
+
+
+def legacy_receive(self, timeout_sec, expected_cmd_reply):
+    """ Byte-wise parser as it was before the FrameDecoder was introduced """
+    now = time.clock_gettime(time.CLOCK_MONOTONIC)
+    timeout = now + timeout_sec
+    checksum_ok = False
+    while not checksum_ok:
+        got_command = False
+        while not got_command:
+            now = time.clock_gettime(time.CLOCK_MONOTONIC)
+            while timeout > now:
+                self._uart.timeout = timeout - now
+                sync_byte = self._uart.read(size=1)
+                if len(sync_byte) != 1:
+                    raise TimeoutError('Waiting for sync byte timed out')
+                if sync_byte[0] == 0xAA:
+                    break
+                now = time.clock_gettime(time.CLOCK_MONOTONIC)
+            command_byte = bytes([0xAA])
+            while command_byte[0] == 0xAA:
+                now = time.clock_gettime(time.CLOCK_MONOTONIC)
+                self._uart.timeout = timeout - now
+                command_byte = self._uart.read(size=1)
+                if len(command_byte) != 1:
+                    raise TimeoutError('Waiting for command byte timed out')
+                if expected_cmd_reply is not None:
+                    if command_byte[0] == expected_cmd_reply or command_byte[0] in self._valid_indications:
+                        got_command = True
+                        break
+                elif (command_byte[0] & 0x7F in self._valid_commands and command_byte[0] & 0x80 == 0x80) or command_byte[0] in self._valid_indications:
+                    got_command = True
+                    break
+        now = time.clock_gettime(time.CLOCK_MONOTONIC)
+        self._uart.timeout = timeout - now
+        length_byte = self._uart.read(size=1)
+        if len(length_byte) == 0:
+            raise TimeoutError('Waiting for length byte timed out')
+        now = time.clock_gettime(time.CLOCK_MONOTONIC)
+        self._uart.timeout = timeout - now
+        bytes_to_read = length_byte[0] + 1
+        further_bytes = self._uart.read(bytes_to_read)
+        if len(further_bytes) != bytes_to_read:
+            raise TimeoutError('Timeout while reading remaining bytes')
+        checksum_sum = 0xAA + command_byte[0] + length_byte[0]
+        for value in further_bytes:
+            checksum_sum += value
+        checksum_ok = ((checksum_sum & 0xFF) == 0)
+    result = command_byte + length_byte + further_bytes[0:-1]
+    return (result, command_byte[0] in self._valid_indications)
+
+
+def make_stream(num_frames: int) -> bytes:
+    """ Mix of rx indications and tx_msg replies, with a duplicate sync byte now and then """
+    stream = bytearray()
+    for i in range(num_frames):
+        if i % 4 == 0:
+            body = bytes([0xC6, 0x01, 0x00])
+        else:
+            body = bytes([0x49, 0x0C, 0x00, 0x01, 0xC4, 0x07]) + bytes(range(i % 8, i % 8 + 8))
+        frame = b'\xaa' + body
+        frame += bytes([checksum(frame)])
+        if i % 16 == 0:
+            frame = b'\xaa' + frame
+        stream += frame
+    return bytes(stream)
+
+
+def run(receive, num_frames: int):
+    # loop:// buffers at most 4096 bytes, so frames are written in batches
+    batch_frames = 200
+    stream = make_stream(batch_frames)
+    uart = CountingSerial(serial.serial_for_url('loop://', timeout=1))
+    mipot = Mipot32001353({'wakeup': 8, 'reset': 5}, 'loop://')
+    mipot._uart.replace_port(uart).close()
+    driver_uart = mipot._uart
+    if receive is legacy_receive:
+        # The byte-wise parser predates the transport and reads the port directly
+        mipot._uart = uart
+
+    elapsed = 0.0
+    try:
+        for _ in range(num_frames // batch_frames):
+            uart.write(stream)
+            start = time.perf_counter()
+            for _ in range(batch_frames):
+                receive(mipot, 1.0, None)
+            elapsed += time.perf_counter() - start
+    finally:
+        mipot._uart = driver_uart
+        mipot.close()
+
+    num_frames -= num_frames % batch_frames
+    return (len(stream) * (num_frames // batch_frames) / elapsed, uart.calls / num_frames)
+
+
+if __name__ == '__main__':
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for (name, receive) in (('byte-wise', legacy_receive), ('buffered', Mipot32001353.receive)):
+        (rate, calls) = run(receive, num_frames)
+        print('%-10s %12.0f bytes/s %8.2f UART calls/frame' % (name, rate, calls))
@@ -0,0 +1,130 @@
+from typing import List, Optional, Tuple
+
+EEPROM_SIZE = 0x100
+# The reply length byte holds the status byte plus the data
+MAX_READ_LEN = 0xFE
+# The command length byte holds the address byte plus the data
+MAX_WRITE_LEN = 0xFE
+# eeprom_write() does not accept data reaching the last address
+WRITE_END = 0xFF
+
+
+class EepromShadow:
+    """ In-memory image of the module EEPROM.
+
+    Reads are served from the image, which is filled with maximal-length
+    eeprom_read commands on first access. Writes only update the image and
+    mark the range dirty; flush() writes all dirty ranges with as few
+    eeprom_write commands as possible.
+
+    The image is dropped by invalidate(), which the module calls on reset.
+    Other commands storing settings in the EEPROM (keys, channel parameters)
+    are not tracked, call invalidate() after using them.
+    """
+
+    def __init__(self, module):
+        self._module = module
+        self._image = bytearray(EEPROM_SIZE)
+        self._valid = bytearray(EEPROM_SIZE)
+        self._dirty = bytearray(EEPROM_SIZE)
+        self.round_trips = 0
+
+    def invalidate(self) -> None:
+        """ Forget the image including writes not flushed yet """
+        self._valid[:] = bytes(EEPROM_SIZE)
+        self._dirty[:] = bytes(EEPROM_SIZE)
+
+    @property
+    def dirty(self) -> bool:
+        return any(self._dirty)
+
+    def read(self, start_address: int, num_bytes: int) -> bytes:
+        """ Read from the image, loading missing bytes from the module
+        args:
+        - start_address (int): first address
+        - num_bytes (int): number of bytes
+        returns:
+        - bytes read
+        raises:
+        - RuntimeError if the module refused an eeprom_read
+        """
+        end = self._check_range(start_address, num_bytes, EEPROM_SIZE)
+        missing = self._valid.find(0, start_address, end)
+        while missing >= 0:
+            # Read as much as one command allows, later reads benefit from it
+            length = min(MAX_READ_LEN, EEPROM_SIZE - missing)
+            self._load(missing, length)
+            missing = self._valid.find(0, missing + length, end)
+        return bytes(self._image[start_address:end])
+
+    def load(self) -> None:
+        """ Fill the whole image """
+        self.read(0, EEPROM_SIZE)
+
+    def write(self, start_address: int, data: bytes) -> None:
+        """ Write to the image, the module is written by flush() """
+        end = self._check_range(start_address, len(data), WRITE_END)
+        self._image[start_address:end] = data
+        self._valid[start_address:end] = b'\x01' * len(data)
+        self._dirty[start_address:end] = b'\x01' * len(data)
+
+    def update(self, start_address: int, data: bytes) -> None:
+        """ Record data already written to the module by other means """
+        end = start_address + len(data)
+        self._image[start_address:end] = data
+        self._valid[start_address:end] = b'\x01' * len(data)
+        self._dirty[start_address:end] = bytes(len(data))
+
+    def flush(self) -> bool:
+        """ Write all dirty ranges to the module
+        returns:
+        - bool: True if all writes succeeded, failed ranges stay dirty
+        """
+        ok = True
+        for (start, end) in self._write_ranges():
+            self.round_trips += 1
+            if self._module.eeprom_write(start, bytes(self._image[start:end])):
+                self._dirty[start:end] = bytes(end - start)
+            else:
+                ok = False
+        return ok
+
+    def _write_ranges(self) -> List[Tuple[int, int]]:
+        """ Dirty runs, merged across clean gaps whose contents are known """
+        ranges: List[Tuple[int, int]] = []
+        start = self._dirty.find(1)
+        while start >= 0:
+            end = self._dirty.find(0, start)
+            if end < 0:
+                end = EEPROM_SIZE
+            if ranges:
+                (last_start, last_end) = ranges[-1]
+                if end - last_start <= MAX_WRITE_LEN and self._valid.find(0, last_end, start) < 0:
+                    ranges[-1] = (last_start, end)
+                    start = self._dirty.find(1, end)
+                    continue
+            while end - start > MAX_WRITE_LEN:
+                ranges.append((start, start + MAX_WRITE_LEN))
+                start += MAX_WRITE_LEN
+            ranges.append((start, end))
+            start = self._dirty.find(1, end)
+        return ranges
+
+    def _load(self, start_address: int, num_bytes: int) -> None:
+        self.round_trips += 1
+        data: Optional[bytes] = self._module.eeprom_read(start_address, num_bytes)
+        if data is None:
+            raise RuntimeError('EEPROM read of %d bytes at 0x%02X failed' % (num_bytes, start_address))
+        # Keep bytes written but not flushed yet
+        for (offset, value) in enumerate(data):
+            address = start_address + offset
+            if not self._dirty[address]:
+                self._image[address] = value
+        self._valid[start_address:start_address + num_bytes] = b'\x01' * num_bytes
+
+    @staticmethod
+    def _check_range(start_address: int, num_bytes: int, limit: int) -> int:
+        end = start_address + num_bytes
+        if start_address < 0 or num_bytes < 0 or end > limit:
+            raise ValueError('Bad EEPROM range 0x%02X+%d' % (start_address, num_bytes))
+        return end
@@ -0,0 +1,184 @@
+from typing import Container, Iterable, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SYNC_BYTE = 0xAA
+# Sync byte, command, length, up to 255 payload bytes and checksum
+MAX_FRAME_SIZE = 259
+
+_SYNC = bytes([SYNC_BYTE])
+
+
+class FrameDecoder:
+    """ Streaming decoder for the 0xAA / cmd / len / payload / checksum framing.
+
+    Raw bytes are appended with feed() and complete frames are taken out with
+    next_frame(). Consumed bytes are discarded lazily so that a burst of frames
+    can be decoded without copying the buffer for every frame.
+    """
+
+    # Drop consumed bytes once this many have piled up at the buffer start
+    _compact_threshold = 4096
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._start = 0
+        # Frames dropped because of a bad checksum
+        self.checksum_errors = 0
+
+    def __len__(self) -> int:
+        return len(self._buf) - self._start
+
+    def feed(self, data: bytes) -> None:
+        if self._start >= self._compact_threshold and self._start * 2 >= len(self._buf):
+            del self._buf[:self._start]
+            self._start = 0
+        self._buf += data
+
+    def clear(self) -> None:
+        self._buf.clear()
+        self._start = 0
+
+    def next_frame(self, accept: Container[int]) -> Optional[bytes]:
+        """ Take the next complete frame from the buffer.
+        args:
+        - accept (Container[int]): command codes to accept after a sync byte
+        returns:
+        - cmd + len + payload (without sync byte and checksum) or None if no
+          complete frame is buffered yet
+
+        Mirrors the byte-wise parser: superfluous 0xAA bytes are skipped, a sync
+        byte followed by a code not in accept is dropped together with that
+        code and a frame with a bad checksum is dropped as a whole.
+        """
+
+        buf = self._buf
+        end = len(buf)
+        pos = self._start
+        while True:
+            # Wait for sync byte
+            pos = buf.find(SYNC_BYTE, pos)
+            if pos < 0:
+                self._start = end
+                return None
+
+            # Get command byte, skipping superfluous 0xAA bytes
+            cmd_pos = pos + 1
+            while cmd_pos < end and buf[cmd_pos] == SYNC_BYTE:
+                cmd_pos += 1
+            if cmd_pos + 1 >= end:
+                # Need at least command and length byte
+                self._start = cmd_pos - 1
+                return None
+            if buf[cmd_pos] not in accept:
+                pos = cmd_pos + 1
+                continue
+
+            # Command, length, payload and checksum complete?
+            frame_end = cmd_pos + buf[cmd_pos + 1] + 3
+            if frame_end > end:
+                self._start = cmd_pos - 1
+                return None
+
+            with memoryview(buf) as view:
+                checksum_ok = ((SYNC_BYTE + sum(view[cmd_pos:frame_end])) & 0xFF) == 0
+            self._start = frame_end
+            if checksum_ok:
+                return bytes(buf[cmd_pos:frame_end - 1])
+            self.checksum_errors += 1
+            pos = frame_end
+
+
+class FrameBuilder:
+    """ Builds frames in a preallocated buffer.
+
+    build() returns a view of the internal buffer which is only valid until
+    the next call, write it out before building the next frame.
+    """
+
+    def __init__(self):
+        self._buf = bytearray(MAX_FRAME_SIZE)
+        self._buf[0] = SYNC_BYTE
+        self._view = memoryview(self._buf)
+
+    def build(self, command: bytes) -> memoryview:
+        """ Frame for command (command code, length and payload) """
+        end = len(command) + 1
+        self._view[1:end] = command
+        self._buf[end] = -(SYNC_BYTE + sum(command)) & 0xFF
+        return self._view[:end + 1]
+
+
+def checksum(data: bytes) -> int:
+    """ Two's complement checksum over sync byte, command, length and payload """
+    return ((sum(data) ^ 0xFF) + 1) & 0xFF
+
+
+def frame_into(buffer: bytearray, offset: int, command: bytes) -> int:
+    """ Write the frame for command into buffer at offset, returns the end offset """
+    end = offset + len(command) + 1
+    buffer[offset] = SYNC_BYTE
+    buffer[offset + 1:end] = command
+    buffer[end] = -(SYNC_BYTE + sum(command)) & 0xFF
+    return end + 1
+
+
+def build_frames(commands: Iterable[bytes]) -> bytearray:
+    """ Frames for many commands back to back in one buffer """
+    commands = list(commands)
+    buffer = bytearray(sum(len(command) for command in commands) + 2 * len(commands))
+    offset = 0
+    for command in commands:
+        offset = frame_into(buffer, offset, command)
+    return buffer
+
+
+def frame_offsets(buffer: bytes) -> Tuple[List[int], List[int]]:
+    """ Start and end offsets of the complete frames in a buffer of back to back
+    frames (bytes, bytearray or mmap). Bytes not starting a frame are skipped
+    up to the next sync byte.
+    """
+    starts: List[int] = []
+    ends: List[int] = []
+    size = len(buffer)
+    pos = 0
+    while pos + 4 <= size:
+        if buffer[pos] != SYNC_BYTE or buffer[pos + 1] == SYNC_BYTE:
+            pos = buffer.find(_SYNC, pos + 1)
+            if pos < 0:
+                break
+            continue
+        end = pos + buffer[pos + 2] + 4
+        if end > size:
+            break
+        starts.append(pos)
+        ends.append(end)
+        pos = end
+    return (starts, ends)
+
+
+def validate_frames(buffer: bytes, use_numpy: Optional[bool] = None) -> Tuple[List[int], List[int], List[bool]]:
+    """ Check the checksums of all frames of a buffer of back to back frames
+    args:
+    - buffer (bytes): e.g. the received bytes of a capture
+    - use_numpy (bool): sum with NumPy in one pass, by default if it is installed
+    returns:
+    - start offsets, end offsets and checksum results of the frames
+    """
+    (starts, ends) = frame_offsets(buffer)
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if not starts:
+        return (starts, ends, [])
+    if use_numpy:
+        # Frame sums as differences of the running sum
+        running = numpy.zeros(len(buffer) + 1, dtype=numpy.uint64)
+        numpy.cumsum(numpy.frombuffer(buffer, dtype=numpy.uint8), out=running[1:])
+        sums = running[numpy.asarray(ends)] - running[numpy.asarray(starts)]
+        return (starts, ends, ((sums & 0xFF) == 0).tolist())
+    with memoryview(buffer) as view:
+        return (starts, ends, [(sum(view[start:end]) & 0xFF) == 0 for (start, end) in zip(starts, ends)])
+
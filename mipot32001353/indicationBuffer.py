@@ -0,0 +1,211 @@
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+# What put() does when the buffer is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+SPILL = 'spill'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL)
+
+# Length prefix of a spilled frame
+_SPILL_HEADER = struct.Struct('<H')
+
+
+class IndicationBuffer:
+    """ FIFO of received indication frames, one per module.
+
+    When capacity frames are buffered, put() follows the overflow policy:
+    - DROP_OLDEST: the oldest frame is discarded
+    - DROP_NEWEST: the new frame is discarded
+    - BLOCK: wait until the consumer took a frame, at most put_timeout
+      seconds, then discard the new frame. Don't use it when the consumer
+      waits for command replies from the same reader thread.
+    - SPILL: further frames are appended to a temporary file and read back
+      in order as the consumer makes room
+
+    With lock_free, a single producer and a single consumer share a deque
+    without lock, relying on atomic append() and popleft(). Only the drop
+    policies are possible then.
+
+    Counters: received, dropped, spilled and high_water, the maximum number
+    of frames held in memory.
+    """
+
+    def __init__(self, capacity: int = 32, policy: str = DROP_NEWEST, lock_free: bool = False,
+                 put_timeout: Optional[float] = None, spill_directory: Optional[str] = None):
+        """ args:
+        - capacity (int): frames held in memory
+        - policy (str): overflow policy, one of POLICIES
+        - lock_free (bool): single producer / single consumer without lock
+        - put_timeout (float): longest wait of put() with policy BLOCK, None for no limit
+        - spill_directory (str): directory of the spill file, default the temp directory
+        """
+        if capacity < 1:
+            raise ValueError('Capacity must be at least 1')
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy %s' % (policy))
+        if lock_free and policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('Policy %s needs a lock' % (policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.lock_free = lock_free
+        self.put_timeout = put_timeout
+        self._spill_directory = spill_directory
+        self._items: Deque[bytes] = deque(maxlen=capacity if policy == DROP_OLDEST else None)
+        self._available = threading.Event()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._spill_file = None
+        self._spill_read = 0
+        self._spill_count = 0
+        self.received = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+
+    def __len__(self) -> int:
+        return len(self._items) + self._spill_count
+
+    def empty(self) -> bool:
+        return not self._items and not self._spill_count
+
+    def put(self, frame: bytes) -> bool:
+        """ Add a frame, returns False when it was discarded """
+        self.received += 1
+        if self.lock_free:
+            return self._put_lock_free(frame)
+
+        with self._lock:
+            items = self._items
+            if self._spill_count or len(items) >= self.capacity:
+                if self.policy == DROP_OLDEST:
+                    # The deque discards the oldest frame by itself
+                    self.dropped += 1
+                elif self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.policy == SPILL:
+                    self._spill(frame)
+                    self._not_empty.notify()
+                    return True
+                elif not self._not_full.wait_for(lambda: len(items) < self.capacity, self.put_timeout):
+                    self.dropped += 1
+                    return False
+            items.append(frame)
+            if len(items) > self.high_water:
+                self.high_water = len(items)
+            self._not_empty.notify()
+        return True
+
+    def _put_lock_free(self, frame: bytes) -> bool:
+        items = self._items
+        if len(items) >= self.capacity:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return False
+        items.append(frame)
+        if len(items) > self.high_water:
+            self.high_water = len(items)
+        if not self._available.is_set():
+            self._available.set()
+        return True
+
+    def get_nowait(self) -> Optional[bytes]:
+        """ Take the oldest frame, None if there is none """
+        if self.lock_free:
+            try:
+                return self._items.popleft()
+            except IndexError:
+                return None
+
+        with self._lock:
+            return self._take()
+
+    def get(self, timeout: Optional[float]) -> Optional[bytes]:
+        """ Take the oldest frame, waiting up to timeout seconds (None: forever), None on timeout """
+        if not self.lock_free:
+            with self._lock:
+                if not self._not_empty.wait_for(lambda: self._items or self._spill_count, timeout):
+                    return None
+                return self._take()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        items = self._items
+        while True:
+            try:
+                return items.popleft()
+            except IndexError:
+                pass
+            self._available.clear()
+            # A frame may have arrived before the clear
+            if items:
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if not self._available.wait(remaining):
+                return None
+
+    def drain(self, max_count: Optional[int] = None) -> List[bytes]:
+        """ Take up to max_count (None: all) frames without waiting """
+        frames = []
+        while max_count is None or len(frames) < max_count:
+            frame = self.get_nowait()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._close_spill()
+            self._not_full.notify_all()
+
+    def close(self) -> None:
+        self.clear()
+
+    def _take(self) -> Optional[bytes]:
+        """ Pop the oldest frame and refill from the spill file, lock held """
+        if not self._items:
+            return None
+        frame = self._items.popleft()
+        if self._spill_count:
+            self._items.append(self._unspill())
+        else:
+            self._not_full.notify()
+        return frame
+
+    def _spill(self, frame: bytes) -> None:
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix='mipot-indications-', dir=self._spill_directory)
+            self._spill_read = 0
+        self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(_SPILL_HEADER.pack(len(frame)) + frame)
+        self._spill_count += 1
+        self.spilled += 1
+
+    def _unspill(self) -> bytes:
+        f = self._spill_file
+        f.seek(self._spill_read)
+        (length,) = _SPILL_HEADER.unpack(f.read(_SPILL_HEADER.size))
+        frame = f.read(length)
+        self._spill_read += _SPILL_HEADER.size + length
+        self._spill_count -= 1
+        if not self._spill_count:
+            self._close_spill()
+        return frame
+
+    def _close_spill(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._spill_read = 0
+        self._spill_count = 0
@@ -0,0 +1,181 @@
+from typing import Callable, Dict, Iterable, List, Union
+
+JOIN = 0x41
+TX_MSG_CONFIRMED = 0x47
+TX_MSG_UNCONFIRMED = 0x48
+RX_MSG = 0x49
+
+# Options byte of the rx indication
+RX_OPTION_ACK = 0x01
+RX_OPTION_PENDING = 0x02
+
+
+class Indication:
+    """ Base of the decoded indications.
+
+    The records only hold the fields, no per-instance dict. Variable length
+    payload is kept as memoryview slice of the received frame, use bytes()
+    to keep it beyond the frame.
+    """
+
+    __slots__ = ()
+    # Indication name, as in the dicts of Mipot32001353.parse_indication()
+    kind = ''
+    code = 0
+    # Fields of as_dict() besides 'indication'
+    _dict_fields = ()
+
+    def as_dict(self) -> Dict[str, Union[str, int, bool, bytes]]:
+        result = {'indication': self.kind}
+        for name in self._dict_fields:
+            value = getattr(self, name)
+            result[name] = bytes(value) if isinstance(value, memoryview) else value
+        return result
+
+    def __repr__(self) -> str:
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+
+class JoinIndication(Indication):
+    """ 0x41, status 0: accepted, 1: failed """
+
+    __slots__ = ('status',)
+    kind = 'join'
+    code = JOIN
+    _dict_fields = ('success',)
+
+    def __init__(self, status: int):
+        self.status = status
+
+    @property
+    def success(self) -> bool:
+        return self.status == 0
+
+
+class TxConfirmedIndication(Indication):
+    """ 0x47, status 0: acknowledged, 1: no ack, and the number of retransmissions """
+
+    __slots__ = ('status', 'retransmissions')
+    kind = 'tx_msg_con'
+    code = TX_MSG_CONFIRMED
+    _dict_fields = ('success', 'status', 'retransmissions')
+
+    def __init__(self, status: int, retransmissions: int):
+        self.status = status
+        self.retransmissions = retransmissions
+
+    @property
+    def success(self) -> bool:
+        return self.status == 0
+
+
+class TxUnconfirmedIndication(Indication):
+    """ 0x48, status 0: sent """
+
+    __slots__ = ('status',)
+    kind = 'tx_msg_uncon'
+    code = TX_MSG_UNCONFIRMED
+    _dict_fields = ('success', 'status')
+
+    def __init__(self, status: int):
+        self.status = status
+
+    @property
+    def success(self) -> bool:
+        return self.status == 0
+
+
+class RxIndication(Indication):
+    """ 0x49, a downlink: options, fport, rssi and snr (signed) and the data """
+
+    __slots__ = ('options', 'fport', 'rssi', 'snr', 'data')
+    kind = 'rx_msg'
+    code = RX_MSG
+    _dict_fields = ('ack', 'pending', 'fport', 'rssi', 'snr', 'data')
+
+    def __init__(self, options: int, fport: int, rssi: int, snr: int, data: memoryview):
+        self.options = options
+        self.fport = fport
+        self.rssi = rssi
+        self.snr = snr
+        self.data = data
+
+    @property
+    def ack(self) -> bool:
+        return bool(self.options & RX_OPTION_ACK)
+
+    @property
+    def pending(self) -> bool:
+        return bool(self.options & RX_OPTION_PENDING)
+
+
+def _check(indication: bytes, code: int, length: int, name: str) -> None:
+    if indication[0] != code:
+        raise ValueError('Not a %s indication' % (name))
+    if len(indication) != length or indication[1] != length - 2:
+        raise ValueError('Wrong length for %s indication' % (name))
+
+
+def decode_join(indication: bytes) -> JoinIndication:
+    _check(indication, JOIN, 3, 'join')
+    return JoinIndication(indication[2])
+
+
+def decode_tx_confirmed(indication: bytes) -> TxConfirmedIndication:
+    _check(indication, TX_MSG_CONFIRMED, 4, 'tx confirmed')
+    return TxConfirmedIndication(indication[2], indication[3])
+
+
+def decode_tx_unconfirmed(indication: bytes) -> TxUnconfirmedIndication:
+    _check(indication, TX_MSG_UNCONFIRMED, 3, 'tx unconfirmed')
+    return TxUnconfirmedIndication(indication[2])
+
+
+def decode_rx(indication: bytes) -> RxIndication:
+    if indication[0] != RX_MSG:
+        raise ValueError('Not a rx indication')
+    if len(indication) < 6 or indication[1] != len(indication) - 2:
+        raise ValueError('Wrong length for rx indication')
+    rssi = indication[4]
+    snr = indication[5]
+    return RxIndication(indication[2], indication[3], rssi - 256 if rssi > 127 else rssi,
+                        snr - 256 if snr > 127 else snr, memoryview(indication)[6:])
+
+
+# Decoder per indication code
+DECODERS: Dict[int, Callable[[bytes], Indication]] = {
+        JOIN: decode_join,
+        TX_MSG_CONFIRMED: decode_tx_confirmed,
+        TX_MSG_UNCONFIRMED: decode_tx_unconfirmed,
+        RX_MSG: decode_rx,
+        }
+
+
+def decode_indication(indication: bytes) -> Indication:
+    """ Decode an indication as returned by get_indication()
+    raises:
+    - RuntimeError for an unknown indication code
+    - ValueError for a malformed indication
+    """
+
+    decoder = DECODERS.get(indication[0])
+    if decoder is None:
+        raise RuntimeError('Unexpected indication 0x%02X' % (indication[0]))
+    return decoder(indication)
+
+
+def decode_indications(indications: Iterable[bytes]) -> List[Indication]:
+    """ Decode a batch of indications, malformed and unknown ones are skipped """
+
+    decoders = DECODERS
+    result = []
+    append = result.append
+    for indication in indications:
+        decoder = decoders.get(indication[0])
+        if decoder is None:
+            continue
+        try:
+            append(decoder(indication))
+        except ValueError:
+            pass
+    return result
@@ -0,0 +1,373 @@
+""" Simulated Mipot 32001353 module speaking the binary command protocol.
+
+The simulator serves the slave side of a pty pair, Mipot32001353 opens
+MipotSimulator.port like a real serial port. Every command in
+Mipot32001353._valid_commands is answered after a per-opcode latency plus
+the time the reply needs on the wire. Join, tx and rx indications are sent
+on their own schedule.
+
+Indication payloads (after command and length byte):
+- 0x41 join: status (0: accepted, 1: failed)
+- 0x47 tx confirmed: status (0: acknowledged, 1: no ack), retransmissions
+- 0x48 tx unconfirmed: status (0: sent)
+- 0x49 rx: options (bit 0: ack, bit 1: frame pending), fport, rssi (int8), snr (int8), data
+
+Faults can be injected on outgoing frames, either once with inject_fault()
+or randomly with fault_rates:
+- 'bad_checksum': checksum byte is wrong
+- 'stray_sync': additional 0xAA bytes before the frame
+- 'truncated': frame is cut short
+- 'drop_reply': frame is not sent at all
+
+usage (without a Raspberry Pi, call fakegpio.install() before the import):
+    with MipotSimulator(seed=1) as sim:
+        mipot = Mipot32001353({'wakeup': 8, 'reset': 5}, sim.port)
+"""
+
+import heapq
+import os
+import random
+import select
+import threading
+import time
+import tty
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from framing import FrameDecoder, checksum
+from wirelessModule import Mipot32001353
+
+# Commands the simulator accepts, the ones the driver knows
+VALID_COMMANDS = Mipot32001353._valid_commands
+
+FAULTS = ('bad_checksum', 'stray_sync', 'truncated', 'drop_reply')
+
+# Seconds from the end of a command to the start of its reply
+DEFAULT_LATENCIES = {
+        0x30: 0.050, 0x31: 0.100, 0x32: 0.012, 0x33: 0.004,
+        0x40: 0.005, 0x43: 0.015, 0x44: 0.015, 0x45: 0.015,
+        0x46: 0.006, 0x57: 0.006,
+        }
+DEFAULT_LATENCY = 0.002
+
+
+class MipotSimulator:
+
+    def __init__(self,
+                 latencies: Optional[Dict[int, float]] = None,
+                 join_delay: float = 2.0,
+                 tx_delay: float = 1.5,
+                 downlink_probability: float = 0.0,
+                 indication_interval: Optional[float] = None,
+                 fault_rates: Optional[Dict[str, float]] = None,
+                 baudrate: int = 115200,
+                 seed: Optional[int] = None):
+        """ args:
+        - latencies (Dict[int, float]): reply latency per opcode in seconds, overrides the defaults
+        - join_delay (float): seconds from join command to join indication
+        - tx_delay (float): seconds from tx_msg command to tx indication
+        - downlink_probability (float): chance of an rx indication after each tx indication
+        - indication_interval (float): additionally send an rx indication every that many seconds
+        - fault_rates (Dict[str, float]): probability per outgoing frame for each kind of fault
+        - baudrate (int): wire speed used to delay replies, 0 to send instantly
+        - seed (int): seed for reproducible runs
+        """
+        self._latencies = dict(DEFAULT_LATENCIES)
+        if latencies is not None:
+            self._latencies.update(latencies)
+        self.join_delay = join_delay
+        self.tx_delay = tx_delay
+        self.downlink_probability = downlink_probability
+        self.indication_interval = indication_interval
+        self.fault_rates = dict(fault_rates or {})
+        for kind in self.fault_rates:
+            if kind not in FAULTS:
+                raise ValueError('Unknown fault %s' % (kind))
+        self._byte_time = 10 / baudrate if baudrate > 0 else 0.0
+        self._random = random.Random(seed)
+
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self.port = ''
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake_read, self._wake_write = (-1, -1)
+        self._lock = threading.Lock()
+        self._events: List[Tuple[float, int, Callable[[], None]]] = []
+        self._sequence = 0
+        self._faults: deque = deque()
+
+        self.commands_received = 0
+        self.frames_sent = 0
+        self.faults_injected = dict((kind, 0) for kind in FAULTS)
+        self.fw_version = 0x01020304
+        self.serial_no = 0x0012D687
+        self.deveui = bytes.fromhex('0004A30B01063D73')
+        self._factory_defaults()
+
+    def _factory_defaults(self) -> None:
+        self.eeprom = bytearray(0x100)
+        self._power_on()
+
+    def _power_on(self) -> None:
+        self.activation_status = 0
+        self.battery_level = 0
+        self.uplink_counter = 0
+        self.downlink_counter = 0
+        self.channels: Dict[int, bytes] = dict()
+        self.tx_busy_until = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        (self._master, self._slave) = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        (self._wake_read, self._wake_write) = os.pipe()
+        self._stop.clear()
+        if self.indication_interval is not None:
+            self._schedule(self.indication_interval, self._periodic_indication)
+        self._thread = threading.Thread(target=self._run, name='mipot-simulator', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        os.write(self._wake_write, b'\x00')
+        self._thread.join()
+        self._thread = None
+        for fd in (self._master, self._slave, self._wake_read, self._wake_write):
+            os.close(fd)
+        (self._wake_read, self._wake_write) = (-1, -1)
+
+    def __enter__(self) -> 'MipotSimulator':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    def inject_fault(self, kind: str) -> None:
+        """ Apply a fault to the next outgoing frame """
+        if kind not in FAULTS:
+            raise ValueError('Unknown fault %s' % (kind))
+        self._faults.append(kind)
+
+    def send_indication(self, code: int, payload: bytes, delay: float = 0.0) -> None:
+        """ Send an indication after delay seconds """
+        self._schedule(delay, lambda: self._send(code, payload))
+
+    def on_reset_pin(self, pin: int, level: int) -> None:
+        """ fakegpio listener for the reset pin, a low level resets the module """
+        if level == 0:
+            with self._lock:
+                self._events.clear()
+            self._power_on()
+
+    def _schedule(self, delay: float, action: Callable[[], None]) -> None:
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._events, (time.monotonic() + delay, self._sequence, action))
+        # Interrupt the select() unless called from the simulator thread itself
+        if self._wake_write >= 0 and threading.current_thread() is not self._thread:
+            os.write(self._wake_write, b'\x00')
+
+    def _run(self) -> None:
+        decoder = FrameDecoder()
+        accept = frozenset(VALID_COMMANDS)
+        while not self._stop.is_set():
+            with self._lock:
+                timeout = None
+                if self._events:
+                    timeout = max(self._events[0][0] - time.monotonic(), 0.0)
+            (readable, _, _) = select.select([self._master, self._wake_read], [], [], timeout)
+
+            if self._wake_read in readable:
+                os.read(self._wake_read, 64)
+            if self._master in readable:
+                decoder.feed(os.read(self._master, 4096))
+                frame = decoder.next_frame(accept)
+                while frame is not None:
+                    self.commands_received += 1
+                    self._handle_command(frame[0], frame[2:])
+                    frame = decoder.next_frame(accept)
+
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._events or self._events[0][0] > now:
+                        break
+                    (_, _, action) = heapq.heappop(self._events)
+                action()
+
+    def _send(self, code: int, payload: bytes) -> None:
+        frame = bytes([0xAA, code, len(payload)]) + payload
+        frame += bytes([checksum(frame)])
+
+        kind = self._faults.popleft() if self._faults else None
+        if kind is None:
+            for (candidate, rate) in self.fault_rates.items():
+                if self._random.random() < rate:
+                    kind = candidate
+                    break
+        if kind is not None:
+            self.faults_injected[kind] += 1
+            if kind == 'drop_reply':
+                return
+            if kind == 'bad_checksum':
+                frame = frame[:-1] + bytes([frame[-1] ^ 0x5A])
+            elif kind == 'stray_sync':
+                frame = b'\xaa' * self._random.randint(1, 3) + frame
+            elif kind == 'truncated':
+                frame = frame[:self._random.randint(1, len(frame) - 1)]
+
+        os.write(self._master, frame)
+        self.frames_sent += 1
+
+    def _reply(self, command: int, payload: bytes) -> None:
+        delay = self._latencies.get(command, DEFAULT_LATENCY) + (len(payload) + 4) * self._byte_time
+        self._schedule(delay, lambda: self._send(command | 0x80, payload))
+
+    def _handle_command(self, command: int, data: bytes) -> None:
+        handler = getattr(self, '_cmd_%02x' % (command), None)
+        if handler is None:
+            # Setters without a modelled effect just acknowledge
+            self._reply(command, b'\x00')
+            return
+        handler(command, data)
+
+    def _cmd_30(self, command: int, data: bytes) -> None:
+        # Reset
+        self._reply(command, b'')
+        self._schedule(self._latencies[0x30], self._power_on)
+
+    def _cmd_31(self, command: int, data: bytes) -> None:
+        # Factory reset
+        self._reply(command, b'\x00')
+        self._schedule(self._latencies[0x31], self._factory_defaults)
+
+    def _cmd_32(self, command: int, data: bytes) -> None:
+        # EEPROM write
+        if len(data) < 1 or data[0] + len(data) - 1 > 0xFF:
+            self._reply(command, b'\x01')
+            return
+        self.eeprom[data[0]:data[0] + len(data) - 1] = data[1:]
+        self._reply(command, b'\x00')
+
+    def _cmd_33(self, command: int, data: bytes) -> None:
+        # EEPROM read
+        if len(data) != 2 or data[0] + data[1] > 0x100:
+            self._reply(command, b'\x01')
+            return
+        self._reply(command, b'\x00' + bytes(self.eeprom[data[0]:data[0] + data[1]]))
+
+    def _cmd_34(self, command: int, data: bytes) -> None:
+        self._reply(command, self.fw_version.to_bytes(4, 'little'))
+
+    def _cmd_35(self, command: int, data: bytes) -> None:
+        self._reply(command, self.serial_no.to_bytes(4, 'little'))
+
+    def _cmd_36(self, command: int, data: bytes) -> None:
+        self._reply(command, self.deveui[::-1])
+
+    def _cmd_40(self, command: int, data: bytes) -> None:
+        # Join
+        if len(data) != 1 or data[0] > 1:
+            self._reply(command, b'\x01')
+            return
+        if self.activation_status == 1:
+            self._reply(command, b'\x02')
+            return
+        self.activation_status = 1
+        self._reply(command, b'\x00')
+        self._schedule(self.join_delay, self._join_done)
+
+    def _join_done(self) -> None:
+        self.activation_status = 2
+        self._send(0x41, b'\x00')
+
+    def _cmd_42(self, command: int, data: bytes) -> None:
+        self._reply(command, bytes([self.activation_status]))
+
+    def _cmd_43(self, command: int, data: bytes) -> None:
+        # Set app key, stored in EEPROM
+        self._reply(command, b'')
+
+    def _cmd_44(self, command: int, data: bytes) -> None:
+        self._reply(command, b'')
+
+    def _cmd_45(self, command: int, data: bytes) -> None:
+        self._reply(command, b'')
+
+    def _cmd_46(self, command: int, data: bytes) -> None:
+        # Transmit message: options, fport, data
+        now = time.monotonic()
+        if self.activation_status != 2:
+            status = 2
+        elif self.tx_busy_until > now:
+            status = 1
+        elif len(data) < 3:
+            status = 5
+        elif data[1] < 1 or data[1] > 223:
+            status = 4
+        else:
+            status = 0
+        self._reply(command, bytes([status]))
+        if status != 0:
+            return
+        self.tx_busy_until = now + self.tx_delay
+        self.uplink_counter += 1
+        self._schedule(self.tx_delay, lambda: self._tx_done(data[0] & 0x01 == 0x01))
+
+    def _tx_done(self, confirmed: bool) -> None:
+        if confirmed:
+            self._send(0x47, b'\x00\x00')
+        else:
+            self._send(0x48, b'\x00')
+        if self._random.random() < self.downlink_probability:
+            self._downlink(confirmed)
+
+    def _downlink(self, ack: bool) -> None:
+        self.downlink_counter += 1
+        data = bytes(self._random.getrandbits(8) for _ in range(self._random.randint(0, 16)))
+        rssi = self._random.randint(-120, -40) & 0xFF
+        snr = self._random.randint(-15, 10) & 0xFF
+        self._send(0x49, bytes([0x01 if ack else 0x00, 1, rssi, snr]) + data)
+
+    def _periodic_indication(self) -> None:
+        self._downlink(False)
+        self._schedule(self.indication_interval, self._periodic_indication)
+
+    def _cmd_4a(self, command: int, data: bytes) -> None:
+        # Session status
+        self._reply(command, bytes([self.activation_status]))
+
+    def _cmd_51(self, command: int, data: bytes) -> None:
+        self._reply(command, bytes([self.battery_level]))
+
+    def _cmd_50(self, command: int, data: bytes) -> None:
+        if len(data) == 1:
+            self.battery_level = data[0]
+        self._reply(command, b'\x00')
+
+    def _cmd_53(self, command: int, data: bytes) -> None:
+        self._reply(command, self.uplink_counter.to_bytes(4, 'little'))
+
+    def _cmd_55(self, command: int, data: bytes) -> None:
+        self._reply(command, self.downlink_counter.to_bytes(4, 'little'))
+
+    def _cmd_57(self, command: int, data: bytes) -> None:
+        # Set channel parameters: channel, frequency, data rate, enabled
+        if len(data) != 7 or data[0] < 3 or data[0] > 15:
+            self._reply(command, b'\xF1')
+            return
+        self.channels[data[0]] = bytes(data[1:])
+        self._reply(command, b'\x00')
+
+    def _cmd_58(self, command: int, data: bytes) -> None:
+        # Get channel parameters
+        if len(data) != 1 or data[0] > 15:
+            self._reply(command, b'\xF1')
+            return
+        self._reply(command, b'\x00' + self.channels.get(data[0], bytes(6)))
@@ -0,0 +1,150 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set
+
+
+class ReplyTimeoutError(TimeoutError):
+    """ No reply matching a command arrived in time """
+
+    def __init__(self, command: int, timeout: float, attempts: int = 1, reason: str = 'timed out'):
+        super().__init__('No reply to command 0x%02X: %s after %d attempt(s), last timeout %.3f s'
+                         % (command, reason, attempts, timeout))
+        self.command = command
+        self.timeout = timeout
+        self.attempts = attempts
+        self.reason = reason
+
+
+class RetryPolicy:
+    """ How often a command is sent and how long to pause in between """
+
+    def __init__(self, attempts: int = 1, backoff: float = 0.01, backoff_factor: float = 2.0, max_backoff: float = 0.5):
+        """ args:
+        - attempts (int): transmissions of the command in total, 1 disables retries
+        - backoff (float): seconds to wait before the first retry
+        - backoff_factor (float): growth of the pause with every retry
+        - max_backoff (float): upper bound of the pause
+        """
+        if attempts < 1:
+            raise ValueError('At least one attempt needed')
+        self.attempts = attempts
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def pause(self, attempt: int) -> float:
+        """ Seconds to wait after failed attempt number attempt (1 based) """
+        return min(self.max_backoff, self.backoff * self.backoff_factor ** (attempt - 1))
+
+
+class LatencyTracker:
+    """ Reply latency per command code, as EWMA and over a window of recent samples.
+
+    timeout() derives a timeout from both: the higher of the percentile and
+    the EWMA times a factor, never below min_timeout and never above the
+    caller's default, which stays the worst case from the command reference.
+    Until min_samples replies of a command were seen, the default is used.
+    """
+
+    def __init__(self, alpha: float = 0.2, window: int = 64, percentile: float = 99.0, margin: float = 1.5,
+                 ewma_factor: float = 3.0, min_samples: int = 8, min_timeout: float = 0.02):
+        self.alpha = alpha
+        self.window = window
+        self.percentile = percentile
+        self.margin = margin
+        self.ewma_factor = ewma_factor
+        self.min_samples = min_samples
+        self.min_timeout = min_timeout
+        self._ewma: Dict[int, float] = dict()
+        self._samples: Dict[int, Deque[float]] = dict()
+        self.timeouts: Dict[int, int] = dict()
+
+    def record(self, command: int, seconds: float) -> None:
+        ewma = self._ewma.get(command)
+        self._ewma[command] = seconds if ewma is None else ewma + self.alpha * (seconds - ewma)
+        samples = self._samples.get(command)
+        if samples is None:
+            samples = deque(maxlen=self.window)
+            self._samples[command] = samples
+        samples.append(seconds)
+
+    def record_timeout(self, command: int) -> None:
+        self.timeouts[command] = self.timeouts.get(command, 0) + 1
+
+    def ewma(self, command: int) -> Optional[float]:
+        return self._ewma.get(command)
+
+    def high_percentile(self, command: int) -> Optional[float]:
+        samples = self._samples.get(command)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))]
+
+    def timeout(self, command: int, default: float) -> float:
+        samples = self._samples.get(command)
+        if samples is None or len(samples) < self.min_samples:
+            return default
+        adaptive = max(self.high_percentile(command) * self.margin, self._ewma[command] * self.ewma_factor)
+        return min(default, max(self.min_timeout, adaptive))
+
+
+class LateReplies:
+    """ Replies to attempts of retried commands which may still arrive.
+
+    Replies carry no reference to their request, so a late reply to an
+    attempt given up on would be taken for the reply to the next command of
+    the same code, e.g. an EEPROM read of another address. The drivers drop
+    such replies whenever they arrive, and only the next command of the same
+    code waits while one is still outstanding. A reply which didn't arrive by
+    its deadline counts as lost.
+    """
+
+    def __init__(self):
+        # reply code -> deadlines (time.monotonic()) of the outstanding replies
+        self._deadlines: Dict[int, List[float]] = dict()
+        self.discarded = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._deadlines)
+
+    def codes(self) -> Set[int]:
+        """ Reply codes with late replies outstanding or expired but not cleaned up yet """
+        return set(self._deadlines)
+
+    def expect(self, reply: int, deadlines: Iterable[float]) -> None:
+        """ Replies with code reply may arrive, one until each of deadlines """
+        now = time.monotonic()
+        deadlines = [deadline for deadline in deadlines if deadline > now]
+        if deadlines:
+            self._deadlines.setdefault(reply, []).extend(deadlines)
+
+    def take(self, reply: int) -> bool:
+        """ Account for an arrived reply, returns True if it is a late one to drop """
+        deadlines = self._outstanding(reply)
+        if deadlines is None:
+            return False
+        deadlines.remove(min(deadlines))
+        if not deadlines:
+            del self._deadlines[reply]
+        self.discarded += 1
+        return True
+
+    def deadline(self, reply: int) -> Optional[float]:
+        """ Until when a late reply with code reply may arrive, None if none is outstanding """
+        deadlines = self._outstanding(reply)
+        return None if deadlines is None else max(deadlines)
+
+    def clear(self) -> None:
+        self._deadlines.clear()
+
+    def _outstanding(self, reply: int) -> Optional[List[float]]:
+        deadlines = self._deadlines.get(reply)
+        if deadlines is None:
+            return None
+        now = time.monotonic()
+        deadlines[:] = [deadline for deadline in deadlines if deadline > now]
+        if not deadlines:
+            del self._deadlines[reply]
+            return None
+        return deadlines
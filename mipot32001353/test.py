@@ -1,9 +1,14 @@
 
+import os
+import sys
 import time
 import serial
 import RPi.GPIO as GPIO
 from wirelessModule import WirelessModule, Mipot32001353
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics as m
+
 
 def show_hex(msg, data: bytes) -> None:
     print(msg, end='')
@@ -16,14 +21,14 @@ def show_hex(msg, data: bytes) -> None:
 GPIO.setmode(GPIO.BOARD)
 
 mipot = Mipot32001353({'wakeup':8, 'reset': 5}, '/dev/ttyS0')
+# The join and tx phases below are commented out, record to metrics.csv once they run:
+# metrics = m.MetricsRecorder('metrics.csv')
+metrics = m.NullRecorder()
+metrics.start_cycle()
 
-time.sleep(1)
 mipot.reset()
-time.sleep(1)
-mipot.transmit(b'\x30\x00') # reset by command
-time.sleep(1)
-# Get version
-module_version = mipot.get_fw_version()
+# Reset by command, the module answers the version request as soon as it is up again
+module_version = mipot.soft_reset()
 print('Module version: %x' % (module_version))
 
 # # Get serial number
@@ -34,12 +39,14 @@ print('Module version: %x' % (module_version))
 # device_eui = mipot.get_deveui()
 # show_hex('Device EUI:', device_eui)
 
+# # EEPROM settings below are served from the shadow image, which is
+# # filled by at most two eeprom_read commands
 # # Get AppEUI / Join EUI
-# join_eui = mipot.eeprom_read(0x08, 8)[::-1]
+# join_eui = mipot.eeprom_shadow.read(0x08, 8)[::-1]
 # show_hex('Join EUI:', join_eui)
 
 # # Get Class
-# lora_class = mipot.eeprom_read(0x20, 1)
+# lora_class = mipot.eeprom_shadow.read(0x20, 1)
 # if lora_class[0] == 0:
 #     print('Class: A')
 # elif lora_class[0] == 1:
@@ -48,18 +55,18 @@ print('Module version: %x' % (module_version))
 #     print('Unknown class: 0x%02X' % (lora_class[0]))
 
 # # ADR active?
-# adr = mipot.eeprom_read(0x23, 1)
+# adr = mipot.eeprom_shadow.read(0x23, 1)
 # if adr[0] == 0:
 #     print('ADR disabled')
 # else:
 #     print('ADR enabled')
 
 # # Unconfirmed transmit message repeat setting
-# tx_repeat = mipot.eeprom_read(0x25, 1)
+# tx_repeat = mipot.eeprom_shadow.read(0x25, 1)
 # print('Unconfirmed message repeat: %d' % (tx_repeat[0]))
 
 # # Public network?
-# public_net = mipot.eeprom_read(0x2E, 1)
+# public_net = mipot.eeprom_shadow.read(0x2E, 1)
 # if public_net[0] == 0:
 #     print('Network: private')
 # elif public_net[0] == 1:
@@ -75,6 +82,7 @@ print('Module version: %x' % (module_version))
 
 
 # # Initiate join
+# join_start = time.perf_counter_ns()
 # result = mipot.join(1)
 # if result != 0:
 #     print('Join command failed with code %d' % result)
@@ -101,10 +109,16 @@ print('Module version: %x' % (module_version))
 #     print('Join OK')
 # else:
 #     print('Join failed')
+# metrics.record(m.JOIN, time.perf_counter_ns() - join_start, ok=got_join and indication['success'])
 
 
-# result = mipot.tx_msg(b'\x01\x23\x45\x67\x89\xAB\xCD\xEF', 1, False)
-# if result != 0:
-#     print('Sending failed with error code %s' % (result))
+# with metrics.phase(m.MIPOT_TX):
+#     result = mipot.tx_msg(b'\x01\x23\x45\x67\x89\xAB\xCD\xEF', 1, False)
+#     if result != 0:
+#         print('Sending failed with error code %s' % (result))
+#     else:
+#         # tx_msg only queues the frame, the radio reports the end of the transmission
+#         indication = mipot.get_parsed_indication(10)
 
-time.sleep(1)
+mipot.close()
+metrics.close()
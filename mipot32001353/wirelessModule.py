@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Optional, Tuple, Union
+from contextlib import contextmanager
+from typing import Container, Dict, Iterator, List, Optional, Tuple, Union
+import os
+import sys
 import serial
 import time
 import RPi.GPIO as GPIO
-import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from framing import FrameBuilder, FrameDecoder
+from eepromShadow import EepromShadow
+from replyTiming import LatencyTracker, LateReplies, ReplyTimeoutError, RetryPolicy
+from indicationBuffer import IndicationBuffer
+from indications import Indication, decode_indication, decode_indications, decode_join, decode_rx, decode_tx_confirmed, decode_tx_unconfirmed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import airtime
+import readiness
+import transport
 
 class WirelessModule(ABC):
 
@@ -34,22 +48,134 @@ class WirelessModule(ABC):
         pass
 
 class Mipot32001353(WirelessModule):
-    _pin_configuration = dict()
     _valid_indications = [0x41, 0x47, 0x48, 0x49]
-    _indication_queue: queue.Queue = queue.Queue(32)
     _valid_commands = [
             0x30, 0x31, 0x32, 0x33, 0x34, 0x35, 0x36,
             0x40, 0x42, 0x43, 0x44, 0x45, 0x46, 0x4A, 0x4B,
             0x50, 0x51, 0x52, 0x53, 0x54, 0x55, 0x57, 0x58]
-
-    def __init__(self, pins: Dict[str, int], port: str):
-        self.set_pin_configuration(pins)
-        self._uart = serial.Serial(port=port, baudrate=115200, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, rtscts=False, dsrdtr=False)
+    # Commands after which the EEPROM contents are unknown
+    _reset_commands = [0x30, 0x31]
+    _indication_codes = frozenset(_valid_indications)
+    _any_reply_codes = frozenset([value | 0x80 for value in _valid_commands]) | _indication_codes
+    # Upper bound for a single read from the UART
+    _read_chunk_size = 256
+    # How often the reader thread checks whether it should stop
+    _reader_poll_interval = 0.1
+    # tracer(event, ts_ns, **fields), see tracing.py
+    tracer = None
+    # Commands without side effects, these are sent again when the reply is lost
+    _idempotent_commands = [0x33, 0x34, 0x35, 0x36, 0x42]
+    # Replies of the wrong length skipped before giving up
+    _max_skipped_replies = 8
+    # Longest time the module may take to answer after a reset
+    _reset_timeout = 5.0
+    # Reply timeout of a single readiness probe
+    _probe_timeout = 0.1
+    # Largest payload tx_msg() accepts
+    max_tx_payload = 209
+
+    def __init__(self, pins: Dict[str, int], port: str, reader_thread: bool = False, indication_buffer: Optional[IndicationBuffer] = None,
+                 airtime_budget: Optional[airtime.DutyCycleBudget] = None):
+        """ Open the module
+        args:
+        - pins (Dict[str, int]): GPIO pins, keys 'wakeup' and 'reset'
+        - port (str): serial port the module is connected to
+        - reader_thread (bool): Let a background thread own the UART, see start_reader()
+        - indication_buffer (IndicationBuffer): Buffer for received indications, default 32 frames dropping the newest
+        - airtime_budget (DutyCycleBudget): Delay tx_msg() until the duty cycle allows it, None to leave it to the module
+        """
+        self._pin_configuration = dict(pins)
+        self._awake = False
+        self._session_depth = 0
+        self._sleep_skipped = False
+        self.gpio_toggles_saved = 0
+        self.wakeup_delays_saved = 0
+        self._uart = transport.open(port, baudrate=115200, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, rtscts=False, dsrdtr=False)
+        self._decoder = FrameDecoder()
+        self._frame_builder = FrameBuilder()
+        self.eeprom_shadow = EepromShadow(self)
+        self._reader: Optional[threading.Thread] = None
+        self._reader_stop = threading.Event()
+        self._pending_lock = threading.Lock()
+        self._pending_replies: Dict[int, Future] = dict()
+        self.indication_buffer = indication_buffer if indication_buffer is not None else IndicationBuffer()
+        self.airtime_budget = airtime_budget
+        # Reply latencies drive the timeouts of commands which may be retried
+        self.reply_timing = LatencyTracker()
+        self.retry_policy = RetryPolicy()
+        self.retry_policies: Dict[int, RetryPolicy] = dict((command, RetryPolicy(attempts=3)) for command in self._idempotent_commands)
+        # Guarded by _pending_lock, _late_reply_seen is notified when one was dropped
+        self.late_replies = LateReplies()
+        self._late_reply_seen = threading.Condition(self._pending_lock)
         GPIO.setup(self._pin_configuration['wakeup'], GPIO.OUT)
         GPIO.setup(self._pin_configuration['reset'], GPIO.OUT)
+        if reader_thread:
+            self.start_reader()
+
+    def start_reader(self) -> None:
+        """ Start a background thread which reads and demultiplexes all frames.
+
+        While it runs, command replies are handed to the command waiting for
+        them and indications are queued as soon as they arrive, also between
+        commands. receive() must not be called directly in this mode.
+        """
+        if self._reader is not None:
+            return
+        self._reader_stop.clear()
+        self._reader = threading.Thread(target=self._reader_loop, name='mipot-reader', daemon=True)
+        self._reader.start()
+
+    def stop_reader(self) -> None:
+        """ Stop the background reader thread, if running """
+        if self._reader is None:
+            return
+        self._reader_stop.set()
+        self._reader.join()
+        self._reader = None
+
+    def _reader_loop(self) -> None:
+        while not self._reader_stop.is_set():
+            try:
+                (data, is_indication) = self.receive(self._reader_poll_interval, None)
+            except TimeoutError:
+                continue
+            except serial.SerialException:
+                # Port closed or device gone
+                break
+
+            if is_indication:
+                self._queue_indication(data)
+            else:
+                with self._pending_lock:
+                    pending = self._pending_replies.pop(data[0], None)
+                if pending is not None:
+                    pending.set_result(data)
+
+    def _queue_indication(self, frame: bytes) -> None:
+        buffer = self.indication_buffer
+        dropped = buffer.dropped
+        buffer.put(frame)
+        if buffer.dropped != dropped and self.tracer is not None:
+            self.tracer('indication_dropped', time.perf_counter_ns(), dropped=buffer.dropped)
+
+    @classmethod
+    def _tx_msg_cmd(cls, data: bytes, fport: int, confirmed: bool) -> bytes:
+        if fport < 1 or fport > 223:
+            raise ValueError('Bad fport')
+        if len(data) > cls.max_tx_payload:
+            raise ValueError('data length too big')
+        if len(data) == 0:
+            raise ValueError('nothing to transmit')
+
+        if confirmed:
+            options = 1
+        else:
+            options = 0
+
+        return b'\x46' + bytes([len(data) + 2, options, fport]) + data
 
     def tx_msg(self, data: bytes, fport: int, confirmed: bool) -> int:
-        """ Transmit a message
+        """ Transmit a message, with an airtime budget not before the duty cycle allows it
         args:
         - data (bytes): data to be transmitted
         - fport (int): LoRaWAN frame port (1-223)
@@ -65,24 +191,13 @@ class Mipot32001353(WirelessModule):
                         7: error
         """
 
-        if fport < 1 or fport > 223:
-            raise ValueError('Bad fport')
-        if len(data) > 209:
-            raise ValueError('data length too big')
-        if len(data) == 0:
-            raise ValueError('nothing to transmit')
-
-        if confirmed:
-            options = 1
-        else:
-            options = 0
-
-        cmd = b'\x46' + bytes([len(data) + 2, options, fport]) + data
-        try:
-            self.transmit(cmd)
-            response = self._get_reply(0x46, 1, 0.25)
-        finally:
-            self.sleep()
+        cmd = self._tx_msg_cmd(data, fport, confirmed)
+        budget = self.airtime_budget
+        if budget is not None:
+            budget.wait()
+        response = self._command(cmd, 1, 0.25)
+        if budget is not None and response[2] == 0:
+            budget.charge(budget.airtime(len(data)))
 
         return response[2]
 
@@ -91,59 +206,171 @@ class Mipot32001353(WirelessModule):
     def parse_join_indication(indication: bytes) -> Dict[str, Union[str, bool]]:
         """ Parse a join indication
          args:
+        - indication (bytes): A join indication
+        returns dict with the following keys:
+        - indication (str): 'join'
+        - success (bool): True on success
+        """
+
+        return decode_join(indication).as_dict()
+
+    @staticmethod
+    def parse_tx_msg_confirmed_indication(indication: bytes) -> Dict[str, Union[str, int, bool]]:
+        """ Parse a message confirmed indication
+         args:
         - indication (bytes): A message confirmed indication
         returns dict with the following keys:
         - indication (str): 'tx_msg_con'
-        - success (bool): True on success
+        - success (bool): True when acknowledged
+        - status (int): 0: acknowledged, 1: no ack
+        - retransmissions (int): Number of retransmissions
         """
 
-        if len(indication) != 3:
-            raise ValueError('Wrong length for join indication')
-        if indication[0] != 0x41:
-            raise ValueError('Not a join indication')
-        return {
-                'indication': 'join',
-                'success': (indication[2] == 0)
-                }
+        return decode_tx_confirmed(indication).as_dict()
+
+    @staticmethod
+    def parse_tx_msg_unconfirmed_indication(indication: bytes) -> Dict[str, Union[str, int, bool]]:
+        """ Parse a message unconfirmed indication
+         args:
+        - indication (bytes): A message unconfirmed indication
+        returns dict with the following keys:
+        - indication (str): 'tx_msg_uncon'
+        - success (bool): True when sent
+        - status (int): 0: sent
+        """
+
+        return decode_tx_unconfirmed(indication).as_dict()
+
+    @staticmethod
+    def parse_rx_msg_indication(indication: bytes) -> Dict[str, Union[str, int, bool, bytes]]:
+        """ Parse a received message indication
+         args:
+        - indication (bytes): A received message indication
+        returns dict with the following keys:
+        - indication (str): 'rx_msg'
+        - ack (bool): Acknowledge of a confirmed uplink received
+        - pending (bool): The network has more downlink data
+        - fport (int): Port
+        - rssi (int): RSSI in dBm
+        - snr (int): SNR in dB
+        - data (bytes): Received data
+        """
+
+        return decode_rx(indication).as_dict()
 
 
     def set_pin_configuration(self, pins: Dict[str, int]) -> None:
         self._pin_configuration |= pins
 
     def sleep(self) -> None:
+        if self._session_depth > 0:
+            # Stays awake until the session ends
+            self.gpio_toggles_saved += 1
+            self._sleep_skipped = True
+            return
         GPIO.output(self._pin_configuration['wakeup'],GPIO.HIGH)
+        self._awake = False
+        self._sleep_skipped = False
 
     def wakeup(self) -> None:
         GPIO.output(self._pin_configuration['wakeup'],GPIO.LOW)
+        self._awake = True
+
+    @contextmanager
+    def session(self) -> Iterator['Mipot32001353']:
+        """ Keep the module awake for a burst of commands
+        The module is woken by the first command and put to sleep once when
+        the outermost session ends. Sessions may be nested.
+        usage:
+            with mipot.session():
+                version = mipot.get_fw_version()
+                eui = mipot.get_deveui()
+        """
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if self._session_depth == 0 and self._awake:
+                if self._sleep_skipped:
+                    # Stands in for the last sleep skipped within the session
+                    self.gpio_toggles_saved -= 1
+                self.sleep()
 
     def reset(self) -> None:
+        """ Reset the module by its reset pin and wait until it answers again
+        raises:
+        - readiness.NotReadyError if it doesn't within _reset_timeout seconds
+        """
         GPIO.output(self._pin_configuration['reset'],GPIO.LOW)
         time.sleep(0.1)
         GPIO.output(self._pin_configuration['reset'],GPIO.HIGH)
-        time.sleep(2)
+        self.eeprom_shadow.invalidate()
+        with self._pending_lock:
+            self.late_replies.clear()
+        self.wait_ready(self._reset_timeout)
         return
 
+    def soft_reset(self) -> int:
+        """ Reset the module by command (0x30) and wait until it answers again
+        returns:
+        - int: firmware version
+        raises:
+        - ReplyTimeoutError if the reset isn't acknowledged
+        - readiness.NotReadyError if the module doesn't answer within _reset_timeout seconds
+        """
+        # Poll only once the reset was acknowledged, a probe sent earlier
+        # could be answered before the module restarts
+        self._command(b'\x30\x00', None, 0.25)
+        with self._pending_lock:
+            self.late_replies.clear()
+        return self.wait_ready(self._reset_timeout)
+
+    def wait_ready(self, timeout_seconds: float) -> int:
+        """ Poll the firmware version (0x34) until the module answers, e.g. after a reset
+        returns:
+        - int: firmware version
+        raises:
+        - readiness.NotReadyError
+        """
+        try:
+            response = readiness.wait_until(self._probe, timeout_seconds, initial=0.02, maximum=0.5, what='Mipot32001353')
+        finally:
+            self.sleep()
+        return int.from_bytes(response[2:6], 'little', signed=False)
+
+    def _probe(self, remaining: float) -> bytes:
+        self.transmit(b'\x34\x00')
+        return self._get_reply(0x34, 4, min(remaining, self._probe_timeout))
 
-    def transmit(self, command: bytes) -> None:
-        # add 0xAA to the beginning of the command
-        to_transmit = b'\xaa' + command
 
-        # Calculate checksum
-        checksum = 0
-        for value in to_transmit:
-            checksum += value
+    def transmit(self, command: bytes) -> None:
+        # add 0xAA to the beginning of the command and append checksum
+        to_transmit = self._frame_builder.build(command)
 
-        checksum = ((checksum ^ 0xFF) + 1) & 0xFF
+        if command[0] in self._reset_commands:
+            self.eeprom_shadow.invalidate()
 
-        # Append checksum
-        to_transmit += bytes([checksum])
+        # Register for the reply before it can possibly arrive
+        if self._reader is not None:
+            with self._pending_lock:
+                self._pending_replies[command[0] | 0x80] = Future()
 
-        self.wakeup()
+        if self._session_depth > 0 and self._awake:
+            self.gpio_toggles_saved += 1
+            self.wakeup_delays_saved += 1
+        else:
+            self.wakeup()
 
-        # command reference says we should wait 1ms
-        time.sleep(0.001)
+            # command reference says we should wait 1ms
+            time.sleep(0.001)
 
+        tracer = self.tracer
+        if tracer is not None:
+            tracer('write_start', time.perf_counter_ns(), code=command[0], bytes=len(to_transmit))
         self._uart.write(to_transmit)
+        if tracer is not None:
+            tracer('write_end', time.perf_counter_ns(), bytes=len(to_transmit))
         
         return
 
@@ -163,141 +390,236 @@ class Mipot32001353(WirelessModule):
         if timeout_sec <= 0:
             raise ValueError('Timeout cannot be less or equal zero')
 
+        # Accept the expected reply and indications only. Without an expected
+        # reply, any command reply or indication is accepted.
+        if expected_cmd_reply is None:
+            accept = self._any_reply_codes
+        else:
+            accept = self._indication_codes | {expected_cmd_reply}
+
         # Calculate timeout
-        now = time.clock_gettime(time.CLOCK_MONOTONIC)
-        timeout = now + timeout_sec
-
-        # Checksum OK?
-        checksum_ok = False
-        while not checksum_ok:
-            # Get start of a command
-            got_command = False
-            while not got_command:
-                # Wait for sync byte
-                now = time.clock_gettime(time.CLOCK_MONOTONIC)
-                while timeout > now:
-                    self._uart.timeout = timeout - now
-                    sync_byte = self._uart.read(size=1)
-                    if len(sync_byte) != 1:
-                        raise TimeoutError('Waiting for sync byte timed out')
-                    if sync_byte[0] == 0xAA:
-                        break
-                    now = time.clock_gettime(time.CLOCK_MONOTONIC)
-
-                # Get command byte. 0xAA is not a valid command reply or indication.
-                # Skip superfluous 0xAA bytes but resync to 0xAA on other
-                # unexpected command-reply or indication codes.
-                command_byte = bytes([0xAA])
-                while command_byte[0] == 0xAA:
-                    now = time.clock_gettime(time.CLOCK_MONOTONIC)
-                    self._uart.timeout = timeout - now
-                    command_byte = self._uart.read(size=1)
-                    if len(command_byte) != 1:
-                        raise TimeoutError('Waiting for command byte timed out')
-                    if expected_cmd_reply is not None:
-                        if command_byte[0] == expected_cmd_reply or command_byte[0] in self._valid_indications:
-                            got_command = True
-                            break
-                    elif (command_byte[0] & 0x7F in self._valid_commands and command_byte[0] & 0x80 == 0x80) or command_byte[0] in self._valid_indications:
-                        got_command = True
-                        break
-
-            # Get length byte
-            now = time.clock_gettime(time.CLOCK_MONOTONIC)
-            if now >= timeout:
-                raise TimeoutError('Waiting for length byte timed out')
-            self._uart.timeout = timeout - now
-            length_byte = self._uart.read(size=1)
-            if len(length_byte) == 0:
-                raise TimeoutError('Waiting for length byte timed out')
-
-            # Receive remaining bytes
+        timeout = time.clock_gettime(time.CLOCK_MONOTONIC) + timeout_sec
+
+        tracer = self.tracer
+        checksum_errors = self._decoder.checksum_errors
+
+        # Serve frames already buffered, otherwise pull whatever the UART has
+        # and block only while nothing is pending.
+        frame = self._next_frame(accept)
+        while frame is None:
             now = time.clock_gettime(time.CLOCK_MONOTONIC)
-            if now >= timeout:
-                raise TimeoutError('Timeout while reading remaining bytes')
-            self._uart.timeout = timeout - now
-            bytes_to_read = length_byte[0] + 1
-            further_bytes = self._uart.read(bytes_to_read)
-            if len(further_bytes) != bytes_to_read:
-                raise TimeoutError('Timeout while reading remaining bytes')
-
-            # Calculate checksum
-            checksum = 0xAA + command_byte[0] + length_byte[0]
-            for value in further_bytes:
-                checksum += value
-
-            # Checksum OK?
-            checksum_ok = ((checksum & 0xFF) == 0)
-
-        # Return result
-        result = command_byte + length_byte + further_bytes[0:-1]
-        return (result, command_byte[0] in self._valid_indications)
-    
+            data = self._uart.read_chunk(max(timeout - now, 0.0), self._read_chunk_size)
+            if not data:
+                self._trace_timeout(expected_cmd_reply)
+                raise TimeoutError('Waiting for frame timed out')
+            if tracer is not None and len(self._decoder) == 0:
+                tracer('first_byte', time.perf_counter_ns(), bytes=len(data))
+            self._decoder.feed(data)
+            frame = self._next_frame(accept)
+            if tracer is not None and self._decoder.checksum_errors != checksum_errors:
+                tracer('checksum_error', time.perf_counter_ns(), count=self._decoder.checksum_errors - checksum_errors)
+                checksum_errors = self._decoder.checksum_errors
+
+        if tracer is not None:
+            tracer('frame_complete', time.perf_counter_ns(), code=frame[0], bytes=len(frame))
+        return (frame, frame[0] in self._indication_codes)
+
+    def _trace_timeout(self, expected_cmd_reply: Optional[int]) -> None:
+        if self.tracer is not None:
+            self.tracer('timeout', time.perf_counter_ns(), code=expected_cmd_reply)
+
+    def _command(self, command: bytes, expected_len: Optional[int], timeout_seconds: float) -> bytes:
+        """ Transmit a command and return its reply, sending it again as the retry policy allows
+        args:
+        - command (bytes): command code, length and payload
+        - expected_len (int): expected length byte of the reply, None for any
+        - timeout_seconds (float): worst case reply time of the command
+        raises:
+        - ReplyTimeoutError if no matching reply arrived
+        """
+        code = command[0]
+        policy = self.retry_policies.get(code, self.retry_policy)
+        attempt = 0
+        # Until when the replies to the attempts given up on may arrive
+        late = []
+        try:
+            if self.late_replies:
+                self._wait_late_replies(code | 0x80)
+            while True:
+                attempt += 1
+                if attempt == policy.attempts:
+                    timeout = timeout_seconds
+                else:
+                    # Adaptive timeout, grows with every retry up to the worst case
+                    timeout = min(timeout_seconds, self.reply_timing.timeout(code, timeout_seconds) * 2 ** (attempt - 1))
+                start = time.monotonic()
+                self.transmit(command)
+                try:
+                    response = self._get_reply(code, expected_len, timeout)
+                except ReplyTimeoutError as e:
+                    self.reply_timing.record_timeout(code)
+                    late.append(start + timeout_seconds)
+                    if attempt >= policy.attempts:
+                        self._expect_late_replies(code | 0x80, late)
+                        raise ReplyTimeoutError(code, timeout, attempt, e.reason) from None
+                    if self.tracer is not None:
+                        self.tracer('retry', time.perf_counter_ns(), code=code | 0x80)
+                    time.sleep(policy.pause(attempt))
+                    continue
+                self.reply_timing.record(code, time.monotonic() - start)
+                if late:
+                    self._expect_late_replies(code | 0x80, late)
+                return response
+        finally:
+            self.sleep()
+
+    def _next_frame(self, accept: Container[int]) -> Optional[bytes]:
+        """ Next decoded frame with a code in accept, late replies to retried commands are dropped """
+        if not self.late_replies:
+            return self._decoder.next_frame(accept)
+        with self._pending_lock:
+            decode = set(accept) | self.late_replies.codes()
+        frame = self._decoder.next_frame(decode)
+        while frame is not None and (self._take_late_reply(frame[0]) or frame[0] not in accept):
+            frame = self._decoder.next_frame(decode)
+        return frame
+
+    def _expect_late_replies(self, reply: int, deadlines: List[float]) -> None:
+        """ Replies to the attempts given up on may still arrive, they are dropped as they do """
+        with self._pending_lock:
+            self.late_replies.expect(reply, deadlines)
+
+    def _take_late_reply(self, reply: int) -> bool:
+        with self._pending_lock:
+            if not self.late_replies.take(reply):
+                return False
+            self._late_reply_seen.notify_all()
+        if self.tracer is not None:
+            self.tracer('retry', time.perf_counter_ns(), code=reply)
+        return True
+
+    def _wait_late_replies(self, reply: int) -> None:
+        """ Before a command is sent, wait until the late replies to its retried
+        predecessor arrived or their deadline passed. Otherwise the reply to
+        this command could be dropped in place of a late one which was lost.
+        """
+        if self._reader is not None:
+            with self._pending_lock:
+                deadline = self.late_replies.deadline(reply)
+                while deadline is not None:
+                    self._late_reply_seen.wait(deadline - time.monotonic())
+                    deadline = self.late_replies.deadline(reply)
+            return
+
+        accept = self._indication_codes | {reply}
+        while True:
+            frame = self._next_frame(accept)
+            if frame is not None:
+                if frame[0] in self._indication_codes:
+                    self._queue_indication(frame)
+                continue
+            with self._pending_lock:
+                deadline = self.late_replies.deadline(reply)
+            if deadline is None:
+                return
+            self._decoder.feed(self._uart.read_chunk(max(deadline - time.monotonic(), 0.0), self._read_chunk_size))
+
     def _get_reply(self, command: int, expected_len: Optional[int], timeout_seconds: float) -> bytes:
-        got_reply = False
-        num_retries = 8
-        while not got_reply and num_retries > 0:
-            num_retries -= 1
-            (data, is_indication) = self.receive(timeout_seconds, command | 0x80)
+        """ Wait for the reply to command, indications arriving meanwhile are queued
+        raises:
+        - ReplyTimeoutError if no reply of the expected length arrived in time
+        """
+        if self._reader is not None:
+            return self._wait_reply(command | 0x80, expected_len, timeout_seconds)
+
+        deadline = time.monotonic() + timeout_seconds
+        skipped = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ReplyTimeoutError(command, timeout_seconds)
+            try:
+                (data, is_indication) = self.receive(remaining, command | 0x80)
+            except TimeoutError:
+                raise ReplyTimeoutError(command, timeout_seconds) from None
             if is_indication:
-                try:
-                    self._indication_queue.put(data, block=False)
-                except queue.Full:
-                    pass
+                self._queue_indication(data)
             elif expected_len is None or data[1] == expected_len:
-                got_reply = True
-
-        return data
+                return data
+            else:
+                skipped += 1
+                if skipped >= self._max_skipped_replies:
+                    raise ReplyTimeoutError(command, timeout_seconds, reason='%d replies of wrong length' % (skipped))
+                if self.tracer is not None:
+                    self.tracer('retry', time.perf_counter_ns(), code=data[0])
+
+    def _wait_reply(self, reply: int, expected_len: Optional[int], timeout_seconds: float) -> bytes:
+        """ Wait for the reader thread to deliver a reply registered by transmit() """
+        deadline = time.monotonic() + timeout_seconds
+        skipped = 0
+        while True:
+            with self._pending_lock:
+                pending = self._pending_replies.get(reply)
+                if pending is None:
+                    # Reply with a wrong length consumed the previous one
+                    pending = Future()
+                    self._pending_replies[reply] = pending
+            try:
+                data = pending.result(max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                with self._pending_lock:
+                    if self._pending_replies.get(reply) is pending:
+                        del self._pending_replies[reply]
+                self._trace_timeout(reply)
+                raise ReplyTimeoutError(reply & 0x7F, timeout_seconds) from None
+            if expected_len is None or data[1] == expected_len:
+                return data
+            skipped += 1
+            if skipped >= self._max_skipped_replies:
+                raise ReplyTimeoutError(reply & 0x7F, timeout_seconds, reason='%d replies of wrong length' % (skipped))
+            if self.tracer is not None:
+                self.tracer('retry', time.perf_counter_ns(), code=reply)
 
     def get_fw_version(self) -> int:
-        try:
-            self.transmit(b'\x34\x00')
-            response = self._get_reply(0x34, 4, 0.25)
-        finally:
-            self.sleep()
+        response = self._command(b'\x34\x00', 4, 0.25)
 
         return int.from_bytes(response[2:6], 'little', signed=False)
 
     def get_serial_no(self) -> int:
-        try:
-            self.transmit(b'\x35\x00')
-            response = self._get_reply(0x35, 4, 0.25)
-        finally:
-            self.sleep()
+        response = self._command(b'\x35\x00', 4, 0.25)
 
         return int.from_bytes(response[2:6], 'little', signed=False)
 
     def get_deveui(self) -> bytes:
-        try:
-            self.transmit(b'\x36\x00')
-            response = self._get_reply(0x36, 8, 0.25)
-        finally:
-            self.sleep()
+        response = self._command(b'\x36\x00', 8, 0.25)
 
         eui = response[2:10]
 
         return eui[::-1]
     
+    @staticmethod
+    def _set_app_key_cmd(app_key: bytes) -> bytes:
+        if len(app_key) != 16:
+            raise ValueError('app key must be exactly 16 bytes long')
+
+        return b'\x43\x10' + app_key[::-1]
+
     def set_app_key(self, app_key: bytes) -> None:
         """ Write the application key needed for OTAA to eeprom
         Args:
         - app_key (bytes): 16 bytes application key
         """
 
-        if len(app_key) != 16:
-            raise ValueError('app key must be exactly 16 bytes long')
-
-        cmd = b'\x43\x10' + app_key[::-1]
-        try:
-            self.transmit(cmd)
-            self._get_reply(0x43, 0, 2)
-        finally:
-            self.sleep()
+        cmd = self._set_app_key_cmd(app_key)
+        self._command(cmd, 0, 2)
 
         return
 
     def get_indication(self, timeout_seconds: Optional[int]) -> Optional[bytes]:
-        if self._indication_queue.empty():
+        if self._reader is not None:
+            return self.indication_buffer.get(timeout_seconds)
+
+        if self.indication_buffer.empty():
             self.wakeup()
             try:
                 (data, is_indication) = self.receive(timeout_seconds, None)
@@ -307,24 +629,10 @@ class Mipot32001353(WirelessModule):
                 raise RuntimeError('Got unexpected command reply 0x%02X' % (data[0]))
             return data
         else:
-            return self._indication_queue.get(block=False)
-
-    def set_ch_parameters(self, channel: int, frequency: int, min_data_rate: int, max_data_rate: int, enabled: bool) -> int:
-        """ Set channel parameters
-        args:
-        - channel (int): Channel index, from 3-15
-        - frequency (int): Frequency in hertz, from 863.125 MHz to 869.875 MHz
-        - min_data_rate (int): Minimum data rate 0-7, 0=SF12/125Khz, 5=SF7/125kHz, 6=SF7/250kHz, 7=FSK/50kHz
-        - max_data_rate (int): Maximum data rate
-        - enabled (bool): Channel enabled?
-        returns:
-        - status (int): 0x00: Success
-                        0xF1: channel out of range
-                        0xF2: data rate out of range
-                        0xF3: data rate and frequency out of range
-                        0xF4: MAC busy
-        """
+            return self.indication_buffer.get_nowait()
 
+    @staticmethod
+    def _set_ch_parameters_cmd(channel: int, frequency: int, min_data_rate: int, max_data_rate: int, enabled: bool) -> bytes:
         if channel < 3 or channel > 15:
             raise ValueError('Bad channel')
 
@@ -357,13 +665,29 @@ class Mipot32001353(WirelessModule):
         else:
             enabled_parm = b'\x00'
 
-        cmd = b'\x57\x07' + bytes([channel]) + frequency.to_bytes(4, 'little', signed=False) + bytes([data_rate]) + enabled_parm
+        return b'\x57\x07' + bytes([channel]) + frequency.to_bytes(4, 'little', signed=False) + bytes([data_rate]) + enabled_parm
 
-        try:
-            self.transmit(cmd)
-            response = self._get_reply(0x57, 1, 0.55)
-        finally:
-            self.sleep()
+    def set_ch_parameters(self, channel: int, frequency: int, min_data_rate: int, max_data_rate: int, enabled: bool) -> int:
+        """ Set channel parameters
+        args:
+        - channel (int): Channel index, from 3-15
+        - frequency (int): Frequency in hertz, from 863.125 MHz to 869.875 MHz
+        - min_data_rate (int): Minimum data rate 0-7, 0=SF12/125Khz, 5=SF7/125kHz, 6=SF7/250kHz, 7=FSK/50kHz
+        - max_data_rate (int): Maximum data rate
+        - enabled (bool): Channel enabled?
+        returns:
+        - status (int): 0x00: Success
+                        0xF1: channel out of range
+                        0xF2: data rate out of range
+                        0xF3: data rate and frequency out of range
+                        0xF4: MAC busy
+        """
+
+        cmd = self._set_ch_parameters_cmd(channel, frequency, min_data_rate, max_data_rate, enabled)
+
+        response = self._command(cmd, 1, 0.55)
+        if self.airtime_budget is not None and response[2] == 0:
+            self.airtime_budget.set_channel(channel, frequency, enabled)
 
         return response[2]
 
@@ -380,19 +704,47 @@ class Mipot32001353(WirelessModule):
         if indication is None:
             return None
 
-        if indication[0] == 0x41:
-            return self.parse_join_indication(indication)
+        return self.parse_indication(indication)
 
-        if indication[0] == 0x47:
-            return self.parse_tx_msg_confirmed_indication(indication)
+    @classmethod
+    def parse_indication(cls, indication: bytes) -> Dict[str, Union[str, int, bool]]:
+        """ Parse any indication
+        args:
+        - indication (bytes): An indication as returned by get_indication()
+        Returns:
+        - Dict with a parsed indication
+        """
 
-        if indication[0] == 0x48:
-            return self.parse_tx_msg_unconfirmed_indication(indication)
+        return decode_indication(indication).as_dict()
 
-        if indication[0] == 0x49:
-            return self.parse_rx_msg_indication(indication)
+    def get_decoded_indication(self, timeout_seconds: Optional[int]) -> Optional[Indication]:
+        """ Get a indication as record, see indications.py. Cheaper than get_parsed_indication() """
 
-        raise RuntimeError('Unexpected indication 0x%02X' % (indication[0]))
+        indication = self.get_indication(timeout_seconds)
+
+        if indication is None:
+            return None
+
+        return decode_indication(indication)
+
+    def drain_indications(self, max_count: Optional[int] = None) -> List[Indication]:
+        """ Decode the queued indications without waiting
+        args:
+        - max_count (int): Upper limit of indications taken or None for all
+        Returns:
+        - List of records, see indications.py. Malformed indications are dropped.
+
+        Without reader thread, indications are only queued while waiting for a command reply.
+        """
+
+        return decode_indications(self.indication_buffer.drain(max_count))
+
+    @staticmethod
+    def _join_cmd(mode: int) -> bytes:
+        if mode < 0 or mode > 1:
+            raise ValueError('Bad mode')
+
+        return b'\x40\x01' + bytes([mode])
 
     def join(self, mode: int) -> int:
         """ Join the LoRaWAN network
@@ -405,15 +757,8 @@ class Mipot32001353(WirelessModule):
                 2: Busy
         """
 
-        if mode < 0 or mode > 1:
-            raise ValueError('Bad mode')
-
-        cmd = b'\x40\x01' + bytes([mode])
-        try:
-            self.transmit(cmd)
-            response = self._get_reply(0x40, 1, 0.25)
-        finally:
-            self.sleep()
+        cmd = self._join_cmd(mode)
+        response = self._command(cmd, 1, 0.25)
 
         return response[2]
 
@@ -426,15 +771,12 @@ class Mipot32001353(WirelessModule):
                3: MAC error
         """
 
-        try:
-            self.transmit(b'\x42\x00')
-            response = self._get_reply(0x42, 1, 0.25)
-        finally:
-            self.sleep()
+        response = self._command(b'\x42\x00', 1, 0.25)
 
         return response[2]
 
-    def eeprom_write(self, start_address: int, data: bytes) -> bool:
+    @staticmethod
+    def _eeprom_write_cmd(start_address: int, data: bytes) -> bytes:
         if start_address > 0xFF:
             raise ValueError('Bad start address')
         if len(data) > 0xFE:
@@ -442,35 +784,48 @@ class Mipot32001353(WirelessModule):
         if start_address + len(data) > 0xFF:
             raise ValueError('Data too long for start address')
 
-        cmd = b'\x32' + bytes([len(data) + 1, start_address]) + data
-        try:
-            self.transmit(cmd)
-            response = self._get_reply(0x32, 1, 1)
-        finally:
-            self.sleep()
+        return b'\x32' + bytes([len(data) + 1, start_address]) + data
 
-        return response[2] == 0x00
+    def eeprom_write(self, start_address: int, data: bytes) -> bool:
+        cmd = self._eeprom_write_cmd(start_address, data)
+        response = self._command(cmd, 1, 1)
 
-    def eeprom_read(self, start_address: int, num_bytes: int) -> Optional[bytes]:
+        if response[2] != 0x00:
+            return False
+
+        self.eeprom_shadow.update(start_address, data)
+        return True
+
+    @staticmethod
+    def _eeprom_read_cmd(start_address: int, num_bytes: int) -> bytes:
         if start_address > 0xFF:
             raise ValueError('Bad start address')
         if start_address + num_bytes > 0x100:
             raise ValueError('Too many bytes requested')
 
-        cmd = b'\x33\x02' + bytes([start_address, num_bytes])
+        return b'\x33\x02' + bytes([start_address, num_bytes])
 
-        try:
-            self.transmit(cmd)
-            response = self._get_reply(0x33, None, 1)
-        finally:
-            self.sleep()
+    def eeprom_read(self, start_address: int, num_bytes: int) -> Optional[bytes]:
+        cmd = self._eeprom_read_cmd(start_address, num_bytes)
+
+        response = self._command(cmd, None, 1)
 
         if response[1] != num_bytes + 1 or response[2] != 0x00:
             return None
 
         return response[3:]
 
-    def __del__(self):
+    def close(self) -> None:
+        """ Stop the reader thread, close the UART and release the GPIO pins. Closing twice is harmless. """
+        if self._uart.closed:
+            return
+        self.stop_reader()
         self._uart.close()
         for item in self._pin_configuration.values():
             GPIO.cleanup(item)
+
+    def __enter__(self) -> 'Mipot32001353':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,110 @@
+""" Waiting for a device to become ready instead of sleeping a fixed time.
+
+wait_until() calls a probe, e.g. a command the device only answers once it
+is up, with exponentially growing pauses in between until the probe
+succeeds or the deadline passes. A device that is ready early ends the wait
+early, one that never gets ready raises NotReadyError instead of failing
+later on.
+
+usage:
+    version = readiness.wait_until(lambda remaining: probe(min(remaining, 0.1)), 5.0,
+                                   what='Mipot answering 0x34')
+
+    version = await readiness.wait_until_async(lambda remaining: probe_async(min(remaining, 0.1)), 5.0)
+
+    backoff = Backoff(initial=1.0, maximum=60.0)   # e.g. between join attempts
+    time.sleep(backoff.next())
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+T = TypeVar('T')
+
+
+class NotReadyError(TimeoutError):
+    """ The device did not get ready before the deadline """
+
+    def __init__(self, what: str, timeout: float, attempts: int):
+        super().__init__('%s not ready after %.2f s and %d attempt(s)' % (what, timeout, attempts))
+        self.timeout = timeout
+        self.attempts = attempts
+
+
+class Backoff:
+    """ Exponentially growing pauses, bounded by maximum """
+
+    def __init__(self, initial: float = 0.01, factor: float = 2.0, maximum: float = 1.0):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self._next = initial
+
+    def next(self) -> float:
+        """ The next pause in seconds """
+        pause = self._next
+        self._next = min(self.maximum, self._next * self.factor)
+        return pause
+
+    def reset(self) -> None:
+        self._next = self.initial
+
+
+def wait_until(probe: Callable[[float], Optional[T]], timeout: float, initial: float = 0.01, factor: float = 2.0,
+               maximum: float = 1.0, what: str = 'device',
+               retry_on: Tuple[Type[BaseException], ...] = (TimeoutError,)) -> T:
+    """ Call probe(remaining_seconds) until it returns something else than None or False
+    args:
+    - probe: checks readiness once, should not block longer than remaining_seconds
+    - timeout (float): deadline in seconds from now
+    - initial, factor, maximum (float): pauses between probes, see Backoff
+    - what (str): device name for the error message
+    - retry_on: exceptions of probe which count as not ready
+    returns:
+    - the result of probe
+    raises:
+    - NotReadyError
+    """
+    deadline = time.monotonic() + timeout
+    backoff = Backoff(initial, factor, maximum)
+    attempts = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise NotReadyError(what, timeout, attempts)
+        attempts += 1
+        try:
+            result = probe(remaining)
+        except retry_on:
+            result = None
+        if result is not None and result is not False:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise NotReadyError(what, timeout, attempts)
+        time.sleep(min(backoff.next(), remaining))
+
+
+async def wait_until_async(probe: Callable[[float], Awaitable[Optional[T]]], timeout: float, initial: float = 0.01,
+                           factor: float = 2.0, maximum: float = 1.0, what: str = 'device',
+                           retry_on: Tuple[Type[BaseException], ...] = (TimeoutError, asyncio.TimeoutError)) -> T:
+    """ wait_until() for a coroutine probe, the pauses don't block the event loop """
+    deadline = time.monotonic() + timeout
+    backoff = Backoff(initial, factor, maximum)
+    attempts = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise NotReadyError(what, timeout, attempts)
+        attempts += 1
+        try:
+            result = await probe(remaining)
+        except retry_on:
+            result = None
+        if result is not None and result is not False:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise NotReadyError(what, timeout, attempts)
+        await asyncio.sleep(min(backoff.next(), remaining))
@@ -1,22 +1,37 @@
-from cSer import cSer
+import os
 import time
 import serial
+from time import monotonic
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cSer import cSer
+import airtime
+import metrics as m
+import readiness
 
-def sleep_and_wake():
-    lora._ser_write("sys sleep 10000")
-    time.sleep(1)
 
-    lora._ser.send_break(10)
+def autobaud(lora, remaining):
+    '''Break and 0x55 for autobaud, True once the module answers "ok"'''
+    lora._ser.send_break(0.01)
     lora._ser_write("U")
-    lora._ser_read_verify("ok")
+    try:
+        return lora._ser_read_filtered(monotonic() + min(remaining, 0.5)).strip() == "ok"
+    except TimeoutError:
+        return False
+
+
+def sleep_and_wake(lora):
+    lora._ser_write("sys sleep 10000")
+    # the module answers a wakeup attempt with "invalid_param" until it sleeps
+    readiness.wait_until(lambda remaining: autobaud(lora, remaining), 15, initial=0.05, what="RN2483")
 
 
-def connect():
-    r = True
-    while r:
+def connect(lora, max_backoff=300):
+    '''Join by OTAA, retrying with exponential backoff'''
+    backoff = readiness.Backoff(initial=10, maximum=max_backoff)
+    while True:
         lora._ser_write("mac join otaa")
-        time.sleep(0.1)
         try:
             for _ in range(2):
                 y = lora._ser_read()
@@ -24,61 +39,87 @@ def connect():
 
                 if (y.rstrip() == 'accepted'):
                     lora._ser_write_read_verify("mac save", "ok")
-                    r = False
                     return
         except TimeoutError:
             pass
-        time.sleep(10)
-
-
-try:
-    lora = cSer('/dev/ttyS0', 57600, serial.EIGHTBITS,
-                serial.PARITY_NONE, serial.STOPBITS_ONE, 1)
-
-    sleep_and_wake()
-    lora._ser_write_read_verify("sys reset")
-    if False:
-
-        lora._ser_write_read_verify("sys factoryRESET")
-        lora._ser_write_read_verify("mac reset 868", "ok")
-        lora._ser_write_read_verify("radio set crc off", "ok")
-        # lora._ser_write_read_verify("radio set sf sf9", "ok")
-
-        lora._ser_write_read_verify("mac set devaddr 00000000", "ok")
-        lora._ser_write_read_verify(
-            "mac set appskey 00000000000000000000000000000000", "ok")
-
-        lora._ser_write_read_verify(
-            "mac set nwkskey 00000000000000000000000000000000", "ok")
-
-        # lora._ser_write_read_verify("sys get hweui", "0004A30B01063D73")
-        lora._ser_write_read_verify("mac set deveui 0004A30B01063D73", "ok")
-        lora._ser_write_read_verify("mac set appeui 0000000000000000", "ok")
-        lora._ser_write_read_verify(
-            "mac set appkey AFB01FC11AB36057B35765D6D7195401", "ok")
-        connect()
-
-    lora._ser_write_read_verify("mac resume", "ok")
-    lora._ser_write_read_verify("mac join abp", "ok")
-    lora._ser_read_verify("accepted")
-
-    for _ in range(1):
-        lora._ser_write_read_verify("mac set dr 5", "ok")
-        lora._ser_write_read_verify(
-            "mac tx uncnf 1 00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000", "ok")
-        lora._ser_read_verify("mac_tx_ok")
-
-        lora._ser_write_read_verify("mac set dr 5", "ok")
-        lora._ser_write_read_verify(
-            "mac tx uncnf 1 11111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111", "ok")
-        lora._ser_read_verify("mac_tx_ok")
-
-    lora._ser_write_read_verify("mac save", "ok")
-
-    sleep_and_wake()
-
-
-except KeyboardInterrupt:
-    print("\n\radios amigos")
-finally:
-    pass
+        time.sleep(backoff.next())
+
+
+def mac_tx(lora, budget, fport, payload, confirmed=False):
+    '''mac tx not before the duty cycle allows it, payload in hex.
+    Returns False if the module refused it, e.g. with no_free_ch'''
+    if budget is not None:
+        budget.wait()
+    answer = lora._ser_write_read_verify("mac tx %s %d %s" % ("cnf" if confirmed else "uncnf", fport, payload), "ok")
+    if answer.strip() != "ok":
+        return False
+    if budget is not None:
+        budget.charge(budget.airtime(len(payload) // 2))
+    lora._ser_read_verify("mac_tx_ok")
+    return True
+
+
+def main(port):
+    lora = None
+    metrics = m.MetricsRecorder("metrics.csv")
+    budget = airtime.DutyCycleBudget(data_rate=5)
+    try:
+        lora = cSer(port, 57600, serial.EIGHTBITS,
+                    serial.PARITY_NONE, serial.STOPBITS_ONE, 1, final_results=None,
+                    echo=False)
+
+        sleep_and_wake(lora)
+        lora._ser_write_read_verify("sys reset")
+        if False:
+
+            lora._ser_write_read_verify("sys factoryRESET")
+            lora._ser_write_read_verify("mac reset 868", "ok")
+            lora._ser_write_read_verify("radio set crc off", "ok")
+            # lora._ser_write_read_verify("radio set sf sf9", "ok")
+
+            lora._ser_write_read_verify("mac set devaddr 00000000", "ok")
+            lora._ser_write_read_verify(
+                "mac set appskey 00000000000000000000000000000000", "ok")
+
+            lora._ser_write_read_verify(
+                "mac set nwkskey 00000000000000000000000000000000", "ok")
+
+            # lora._ser_write_read_verify("sys get hweui", "0004A30B01063D73")
+            lora._ser_write_read_verify("mac set deveui 0004A30B01063D73", "ok")
+            lora._ser_write_read_verify("mac set appeui 0000000000000000", "ok")
+            lora._ser_write_read_verify(
+                "mac set appkey AFB01FC11AB36057B35765D6D7195401", "ok")
+            connect(lora)
+
+        metrics.start_cycle()
+        lora._ser_write_read_verify("mac resume", "ok")
+        with metrics.phase(m.JOIN):
+            lora._ser_write_read_verify("mac join abp", "ok")
+            lora._ser_read_verify("accepted")
+
+        for _ in range(1):
+            lora._ser_write_read_verify("mac set dr 5", "ok")
+            with metrics.phase(m.MAC_TX):
+                mac_tx(lora, budget, 1,
+                    "00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000")
+
+            lora._ser_write_read_verify("mac set dr 5", "ok")
+            with metrics.phase(m.MAC_TX):
+                mac_tx(lora, budget, 1,
+                    "11111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111111")
+
+        lora._ser_write_read_verify("mac save", "ok")
+
+        sleep_and_wake(lora)
+
+
+    except KeyboardInterrupt:
+        print("\n\radios amigos")
+    finally:
+        if lora is not None:
+            lora.close()
+        metrics.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyS0')
@@ -0,0 +1,143 @@
+""" Tracing of the serial traffic of the drivers.
+
+cSer, Mipot32001353 and AsyncMipot32001353 have a tracer attribute, None by
+default. When it is set, the drivers call
+
+    tracer(event, ts_ns, **fields)
+
+with ts_ns from time.perf_counter_ns() at these points:
+
+- write_start: before a command is written (command / code, bytes)
+- write_end: after the write returned (bytes)
+- first_byte: bytes arrived while no partial line or frame was buffered (bytes)
+- frame_complete: a line or frame was taken from the receive buffer (line / code, bytes)
+- checksum_error: a frame with a bad checksum was dropped
+- retry: a reply was skipped and waiting starts again, or a command is sent again (code)
+- timeout: no reply arrived in time (code)
+- indication_dropped: the indication buffer was full and its policy discarded a frame (dropped, the total so far)
+
+Without a tracer a driver only pays for one attribute check per event.
+
+usage:
+    ring = RingBufferSink(4096)
+    nbiot.tracer = ring
+    ...
+    write_chrome_trace(ring.events(), 'trace.json')   # open in chrome://tracing or Perfetto
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, List, Tuple
+
+WRITE_START = 'write_start'
+WRITE_END = 'write_end'
+FIRST_BYTE = 'first_byte'
+FRAME_COMPLETE = 'frame_complete'
+CHECKSUM_ERROR = 'checksum_error'
+RETRY = 'retry'
+TIMEOUT = 'timeout'
+INDICATION_DROPPED = 'indication_dropped'
+
+Event = Tuple[str, int, Dict[str, Any]]
+
+
+class RingBufferSink:
+    """ Keeps the last capacity events in memory """
+
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self._events: List[Event] = [None] * capacity
+        self._next = 0
+        self.count = 0
+
+    def __call__(self, event: str, ts_ns: int, **fields) -> None:
+        self._events[self._next] = (event, ts_ns, fields)
+        self._next = (self._next + 1) % self.capacity
+        self.count += 1
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def events(self) -> List[Event]:
+        """ Buffered events, oldest first """
+        if self.count < self.capacity:
+            return self._events[:self.count]
+        return self._events[self._next:] + self._events[:self._next]
+
+    def clear(self) -> None:
+        self._events = [None] * self.capacity
+        self._next = 0
+        self.count = 0
+
+
+class ChromeTraceSink(RingBufferSink):
+    """ Collects events and writes them as Chrome trace file on close() """
+
+    def __init__(self, path: str, capacity: int = 1 << 20, name: str = 'serial'):
+        super().__init__(capacity)
+        self.path = path
+        self.name = name
+
+    def close(self) -> None:
+        write_chrome_trace(self.events(), self.path, self.name)
+
+    def __enter__(self) -> 'ChromeTraceSink':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def fan_out(*sinks: Callable[..., None]) -> Callable[..., None]:
+    """ Tracer passing every event to all sinks """
+    def tracer(event: str, ts_ns: int, **fields) -> None:
+        for sink in sinks:
+            sink(event, ts_ns, **fields)
+    return tracer
+
+
+def chrome_trace_events(events: List[Event], name: str = 'serial') -> List[Dict[str, Any]]:
+    """ Convert events to Chrome trace events.
+
+    Each event becomes an instant event. Additionally every command gets a
+    'write' span from write_start to write_end and a round trip span from
+    write_start to the first frame_complete after it, named after the command.
+    """
+    pid = os.getpid()
+    trace = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}}]
+    command_start = None
+    command_name = None
+    for (event, ts_ns, fields) in events:
+        ts_us = ts_ns / 1000.0
+        trace.append({'name': event, 'ph': 'i', 's': 't', 'ts': ts_us, 'pid': pid, 'tid': 1,
+                      'args': _json_fields(fields)})
+        if event == WRITE_START:
+            command_start = ts_ns
+            command_name = _command_name(fields)
+        elif event == WRITE_END and command_start is not None:
+            trace.append({'name': 'write', 'ph': 'X', 'ts': command_start / 1000.0,
+                          'dur': (ts_ns - command_start) / 1000.0, 'pid': pid, 'tid': 2})
+        elif event in (FRAME_COMPLETE, TIMEOUT) and command_start is not None:
+            trace.append({'name': command_name, 'ph': 'X', 'ts': command_start / 1000.0,
+                          'dur': (ts_ns - command_start) / 1000.0, 'pid': pid, 'tid': 3,
+                          'args': {'end': event}})
+            command_start = None
+    return trace
+
+
+def write_chrome_trace(events: List[Event], path: str, name: str = 'serial') -> None:
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': chrome_trace_events(events, name), 'displayTimeUnit': 'ms'}, f)
+
+
+def _command_name(fields: Dict[str, Any]) -> str:
+    if 'command' in fields:
+        return str(fields['command'])
+    if 'code' in fields:
+        return '0x%02X' % (fields['code'])
+    return 'command'
+
+
+def _json_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: (value if isinstance(value, (int, float, str, bool)) or value is None else str(value))
+            for (key, value) in fields.items()}
@@ -0,0 +1,54 @@
+""" Serial transport shared by the radio drivers.
+
+open() returns a Transport for a serial device, a pty (e.g. of the
+simulators) or an in-process loopback port. cSer (BC66, RN2483) reads
+lines and Mipot32001353 reads binary frames from its receive buffer, so
+read and write improvements apply to all three.
+
+usage:
+    with transport.open('/dev/ttyS0', baudrate=115200) as port:
+        port.write(b'AT\\r\\n')
+        line = port.read_line(time.monotonic() + 1)
+
+    port = transport.open('loop://')            # reads back what is written
+    (driver_end, sim_end) = transport.loopback_pair()
+"""
+
+import os
+from typing import Optional, Tuple
+
+import serial
+
+from .core import DEVICE, LOOPBACK, PTY, RX, TX, Transport
+from .loopback import LoopbackPort, echo_port, loopback_pair as _loopback_pair
+
+__all__ = ['open', 'loopback_pair', 'Transport', 'LoopbackPort', 'DEVICE', 'PTY', 'LOOPBACK', 'TX', 'RX']
+
+LOOPBACK_URL = 'loop://'
+
+
+def _is_pty(path: str) -> bool:
+    path = os.path.realpath(path)
+    return path.startswith('/dev/pts/') or path == '/dev/ptmx'
+
+
+def open(path: str, baudrate: int = 9600, bytesize: int = serial.EIGHTBITS, parity: str = serial.PARITY_NONE,
+         stopbits: float = serial.STOPBITS_ONE, timeout: Optional[float] = None,
+         write_timeout: Optional[float] = None, rtscts: bool = False, dsrdtr: bool = False) -> Transport:
+    """ Open a serial device, a pty or with 'loop://' an echoing loopback port
+    raises:
+    - serial.SerialException if the port can't be opened
+    - ValueError for a bad configuration
+    """
+    if path == LOOPBACK_URL:
+        return Transport(echo_port(timeout), path, LOOPBACK)
+
+    port = serial.Serial(port=path, baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits,
+                         timeout=timeout, write_timeout=write_timeout, rtscts=rtscts, dsrdtr=dsrdtr)
+    return Transport(port, path, PTY if _is_pty(path) else DEVICE)
+
+
+def loopback_pair(timeout: Optional[float] = None) -> Tuple[Transport, Transport]:
+    """ Two connected in-process transports, e.g. for a driver and a simulator """
+    (a, b) = _loopback_pair(timeout)
+    return (Transport(a, LOOPBACK_URL, LOOPBACK), Transport(b, LOOPBACK_URL, LOOPBACK))
@@ -0,0 +1,288 @@
+import time
+from typing import Callable, List, Optional
+
+# Direction passed to hooks, same values as in capture.py
+TX = 0
+RX = 1
+
+# Kind of port behind a transport
+DEVICE = 'device'
+PTY = 'pty'
+LOOPBACK = 'loopback'
+
+Hook = Callable[[int, bytes], None]
+
+
+class Transport:
+    """ Buffered byte stream over a serial port.
+
+    Received bytes are collected in one buffer, which read_line() (AT
+    protocols) and read_chunk() (binary protocols) both take from. Each
+    refill pulls everything the port has waiting and blocks only while
+    nothing is, so a burst of lines or frames costs one read.
+
+    write(data, more=True) keeps data back until a write without more or
+    flush(), so commands queued in a row go out in one system call.
+
+    Hooks are called as hook(direction, data) for every chunk written (TX)
+    and read from the port (RX), RX before the chunk is added to the buffer.
+    """
+
+    # Upper bound for a single read from the port
+    read_chunk_size = 4096
+    # Coalesced bytes which trigger a write on their own
+    coalesce_limit = 4096
+    # Longest single blocking read. Waits are made of reads with this port
+    # timeout, halved down to 1 ms for the rest of the wait, so the port is
+    # only reconfigured when the step changes, not for every remaining time.
+    read_step = 0.05
+
+    def __init__(self, port, name: str = '', kind: str = DEVICE):
+        """ args:
+        - port: opened pyserial Serial or any object with its read, write,
+          in_waiting, timeout, reset_input_buffer and close
+        - name (str): what was opened, for messages
+        - kind (str): DEVICE, PTY or LOOPBACK
+        """
+        self.port = port
+        self.name = name
+        self.kind = kind
+        # Read timeout used when the caller gives none
+        self.default_timeout = port.timeout
+        self._rx = bytearray()
+        self._rx_start = 0
+        self._rx_scan = 0
+        self._tx = bytearray()
+        self._hooks: List[Hook] = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.writes = 0
+
+    def __len__(self) -> int:
+        """ Bytes received and not taken yet """
+        return len(self._rx) - self._rx_start
+
+    @property
+    def closed(self) -> bool:
+        return self.port is None
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self) + self.port.in_waiting
+
+    @property
+    def timeout(self) -> Optional[float]:
+        """ Read timeout used when the caller gives none """
+        return self.default_timeout
+
+    @timeout.setter
+    def timeout(self, value: Optional[float]) -> None:
+        self.default_timeout = value
+        self.port.timeout = value
+
+    def add_hook(self, hook: Hook) -> None:
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Hook) -> None:
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
+    def replace_port(self, port):
+        """ Continue on another port, e.g. a capture replay. Returns the previous one, buffers are dropped """
+        previous = self.port
+        self.port = port
+        self.default_timeout = port.timeout
+        self._clear_rx()
+        del self._tx[:]
+        return previous
+
+    def write(self, data, more: bool = False) -> int:
+        """ Write data, with more it may be kept back and sent with the next write.
+        returns:
+        - number of bytes of data written or queued, less than len(data) when the port timed out
+        """
+        if more:
+            self._tx += data
+            if len(self._tx) >= self.coalesce_limit:
+                self.flush()
+            return len(data)
+        if not self._tx:
+            return self._write(data)
+        # The bytes kept back go first
+        queued = len(self._tx)
+        self._tx += data
+        pending = bytes(self._tx)
+        del self._tx[:]
+        return max(0, self._write(pending) - queued)
+
+    def flush(self) -> int:
+        """ Write the bytes kept back, returns how many were written """
+        if not self._tx:
+            return 0
+        data = bytes(self._tx)
+        del self._tx[:]
+        return self._write(data)
+
+    def _write(self, data: bytes) -> int:
+        for hook in self._hooks:
+            hook(TX, data)
+        written = self.port.write(data)
+        self.writes += 1
+        if written:
+            self.bytes_written += written
+        return written or 0
+
+    def _fill(self, timeout: Optional[float]) -> bool:
+        """ Read what the port has waiting, else block for one byte up to timeout
+        (None: the default timeout). Returns False if nothing arrived.
+        """
+        port = self.port
+        waiting = port.in_waiting
+        if waiting > 0:
+            data = port.read(min(waiting, self.read_chunk_size))
+        else:
+            if timeout is None:
+                timeout = self.default_timeout
+            data = self._read_first(timeout)
+        self.reads += 1
+        if not data:
+            return False
+        for hook in self._hooks:
+            hook(RX, data)
+        self.bytes_read += len(data)
+        if self._rx_start == len(self._rx):
+            self._clear_rx()
+        elif self._rx_start >= self.read_chunk_size:
+            # drop consumed bytes before the buffer grows
+            del self._rx[:self._rx_start]
+            self._rx_scan -= self._rx_start
+            self._rx_start = 0
+        self._rx += data
+        return True
+
+    def _read_first(self, timeout: Optional[float]) -> bytes:
+        """ Block for one byte up to timeout seconds, None for no limit """
+        port = self.port
+        if timeout is None or timeout <= 0:
+            timeout = None if timeout is None else 0
+            # Changing the timeout reconfigures a real port, skip it when possible
+            if port.timeout != timeout:
+                port.timeout = timeout
+            return port.read(1)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining < 0.001:
+                step = 0
+            else:
+                step = self.read_step
+                while step > remaining:
+                    step /= 2
+            if port.timeout != step:
+                port.timeout = step
+            data = port.read(1)
+            if data or step == 0:
+                return data
+
+    def _clear_rx(self) -> None:
+        del self._rx[:]
+        self._rx_start = 0
+        self._rx_scan = 0
+
+    def read_chunk(self, timeout: Optional[float], max_size: Optional[int] = None) -> bytes:
+        """ Return buffered or waiting bytes, at most max_size, blocking up to
+        timeout seconds (None: the default timeout) for the first one. Returns b'' on timeout.
+        """
+        if len(self) == 0 and not self._fill(timeout):
+            return b''
+        end = len(self._rx) if max_size is None else min(len(self._rx), self._rx_start + max_size)
+        data = bytes(self._rx[self._rx_start:end])
+        if end == len(self._rx):
+            self._clear_rx()
+        else:
+            self._rx_start = end
+            self._rx_scan = max(self._rx_scan, end)
+        return data
+
+    def read(self, size: int = 1) -> bytes:
+        """ Read like pyserial, up to size bytes within the default timeout """
+        deadline = None if self.default_timeout is None else time.monotonic() + self.default_timeout
+        while len(self) < size:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            if not self._fill(remaining):
+                break
+        return self.read_chunk(0, size) if len(self) else b''
+
+    def read_line(self, deadline: Optional[float] = None) -> bytes:
+        """ Return the next line including its line end.
+        args:
+        - deadline (float): time.monotonic() by which the line must be complete,
+          None to wait up to the default timeout for each byte
+        raises:
+        - TimeoutError
+        """
+        while True:
+            end = self._rx.find(b"\n", self._rx_scan)
+            if end >= 0:
+                line = bytes(self._rx[self._rx_start:end + 1])
+                self._rx_start = end + 1
+                self._rx_scan = end + 1
+                if self._rx_start == len(self._rx):
+                    self._clear_rx()
+                return line
+            self._rx_scan = len(self._rx)
+
+            # drop consumed bytes before the buffer grows
+            if self._rx_start > 0:
+                del self._rx[:self._rx_start]
+                self._rx_scan -= self._rx_start
+                self._rx_start = 0
+
+            if deadline is None:
+                if not self._fill(None):
+                    raise TimeoutError("Timeout occurred during reception.")
+                continue
+            # A quiet port only ends the wait once the deadline has passed
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Timeout occurred during reception.")
+                if self._fill(remaining):
+                    break
+
+    def reset_input_buffer(self) -> None:
+        """ Drop everything received so far """
+        self.port.reset_input_buffer()
+        self._clear_rx()
+
+    def send_break(self, duration: float = 0.25) -> None:
+        self.flush()
+        self.port.send_break(duration)
+
+    def fileno(self) -> int:
+        return self.port.fileno()
+
+    def close(self) -> None:
+        """ Send what was kept back and close the port, closing twice is harmless """
+        if self.port is None:
+            return
+        port = self.port
+        try:
+            if self._tx:
+                self.flush()
+        finally:
+            self.port = None
+            port.close()
+
+    def __enter__(self) -> 'Transport':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return '%s(%r, %s%s)' % (type(self).__name__, self.name, self.kind, ', closed' if self.closed else '')
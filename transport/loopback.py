@@ -0,0 +1,86 @@
+""" In-process serial port stand-ins.
+
+LoopbackPort has the part of the pyserial interface the drivers use. Two
+ports created by loopback_pair() are connected like a null modem cable,
+a single port from echo_port() returns what was written to it.
+"""
+
+import threading
+import time
+from typing import Optional, Tuple
+
+
+class _Pipe:
+    """ One direction: bytes written by one end, read by the other """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.condition = threading.Condition()
+        self.closed = False
+
+
+class LoopbackPort:
+
+    def __init__(self, rx: _Pipe, tx: _Pipe, timeout: Optional[float] = None, name: str = 'loop://'):
+        self._rx = rx
+        self._tx = tx
+        self.timeout = timeout
+        self.name = name
+        self.is_open = True
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx.data)
+
+    def read(self, size: int = 1) -> bytes:
+        """ Wait for size bytes like pyserial, return what arrived by the timeout """
+        rx = self._rx
+        with rx.condition:
+            if len(rx.data) < size and not rx.closed:
+                deadline = None if self.timeout is None else time.monotonic() + self.timeout
+                while len(rx.data) < size and not rx.closed and self.is_open:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    rx.condition.wait(remaining)
+            data = bytes(rx.data[:size])
+            del rx.data[:size]
+        return data
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise ValueError('Port closed')
+        tx = self._tx
+        with tx.condition:
+            tx.data += data
+            tx.condition.notify_all()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def reset_input_buffer(self) -> None:
+        with self._rx.condition:
+            del self._rx.data[:]
+
+    def send_break(self, duration: float = 0.25) -> None:
+        pass
+
+    def close(self) -> None:
+        self.is_open = False
+        for pipe in (self._rx, self._tx):
+            with pipe.condition:
+                pipe.closed = True
+                pipe.condition.notify_all()
+
+
+def loopback_pair(timeout: Optional[float] = None) -> Tuple[LoopbackPort, LoopbackPort]:
+    """ Two connected ports, e.g. driver and simulator in one process """
+    (a_to_b, b_to_a) = (_Pipe(), _Pipe())
+    return (LoopbackPort(b_to_a, a_to_b, timeout), LoopbackPort(a_to_b, b_to_a, timeout))
+
+
+def echo_port(timeout: Optional[float] = None) -> LoopbackPort:
+    """ A port reading back what was written to it, like pyserial's loop:// """
+    pipe = _Pipe()
+    return LoopbackPort(pipe, pipe, timeout)
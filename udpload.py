@@ -0,0 +1,98 @@
+""" Load generator for udpserver.py.
+
+Sends datagrams from several sockets, as many devices would, either as fast
+as possible or at a target rate. With --spawn a udpserver.py is started on
+the port first and its summary is printed after the run.
+
+usage: python udpload.py [--count 100000] [--rate 0] [--size 16] [--spawn]
+"""
+
+import argparse
+import glob
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+
+def send(host: str, port: int, count: int, rate: float, size: int, sockets: int) -> float:
+    """ Send count datagrams, returns the achieved rate in packets/sec """
+    senders = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(sockets)]
+    payload = bytes(range(256)) * (size // 256 + 1)
+    payload = payload[:size]
+    address = (host, port)
+    interval = 1.0 / rate if rate > 0 else 0.0
+    start = time.perf_counter()
+    next_time = start
+    for i in range(count):
+        if interval:
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            senders[i % sockets].sendto(payload, address)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+    elapsed = time.perf_counter() - start
+    for sender in senders:
+        sender.close()
+    return count / elapsed
+
+
+def spawn_server(port: int, server_args: List[str]) -> Tuple[subprocess.Popen, str]:
+    """ Start udpserver.py writing to a temporary file, returns once it listens """
+    (fd, output) = tempfile.mkstemp(suffix='.bin')
+    os.close(fd)
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'udpserver.py'),
+               '--port', str(port), '--output', output, '--report-interval', '1'] + server_args
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # Wait until the socket is bound
+    while 'listening' not in server.stdout.readline():
+        if server.poll() is not None:
+            sys.exit('udpserver.py failed to start')
+    return (server, output)
+
+
+def stop_server(server: subprocess.Popen, output: str) -> List[str]:
+    """ Stop a spawned server like Ctrl-C would, returns its output lines """
+    server.send_signal(signal.SIGINT)
+    (out, _) = server.communicate()
+    for path in glob.glob(output + '*'):
+        os.remove(path)
+    return out.splitlines()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='UDP load generator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--rate', type=float, default=0, help='packets/sec, 0 sends as fast as possible')
+    parser.add_argument('--size', type=int, default=16, help='payload bytes')
+    parser.add_argument('--sockets', type=int, default=64, help='number of simulated devices')
+    parser.add_argument('--spawn', action='store_true', help='run udpserver.py for the benchmark')
+    parser.add_argument('--server-args', default='', help='extra udpserver.py arguments with --spawn')
+    args = parser.parse_args()
+
+    server = None
+    output = ''
+    if args.spawn:
+        (server, output) = spawn_server(args.port, args.server_args.split())
+
+    try:
+        achieved = send(args.host, args.port, args.count, args.rate, args.size, args.sockets)
+        print('sent %d datagrams of %d bytes at %.0f pkt/s' % (args.count, args.size, achieved))
+    finally:
+        if server is not None:
+            time.sleep(1.0)
+            for line in stop_server(server, output):
+                print('server: ' + line)
+
+
+if __name__ == '__main__':
+    main()
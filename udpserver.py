@@ -1,30 +1,382 @@
+""" UDP ingest server for the datagrams sent by the devices.
 
+Datagrams are received with an asyncio DatagramProtocol and recorded with
+their arrival time and source into a preallocated ring buffer. The ring is
+written to the output file in batches from a worker thread, so a slow disk
+makes the ring overrun instead of stalling the receive path. Every few
+seconds a line with packets/sec, ring drops and socket buffer overruns is
+printed.
+
+With --workers N, N processes bind the port with SO_REUSEPORT and the kernel
+spreads the datagrams between them. Each worker writes its own output file
+(<output>.<n>) and publishes its counters in shared memory, the parent
+prints the aggregated statistics and stops the workers on Ctrl-C.
+
+Probe datagrams of the devices (see uplinkstats.py) are accounted per device
+for loss, reordering, duplicates and one-way latency. The table is written
+to --stats-output every report interval.
+
+Output records: <ts_ns:u64><ipv4:u32><port:u16><length:u16><payload>, little
+endian, read back with read_records().
+
+usage: python udpserver.py [--port 5005] [--output udp_ingest.bin] [--workers N] [--echo]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
 import socket
-import requests
+import struct
 import time
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from uplinkstats import DeviceTable
 
 localIP     = ""
 localPort   = 5005
 bufferSize  = 1024
 
+RECORD_HEADER = struct.Struct('<QIHH')
+# Counters each worker publishes in its slot of the shared array
+COUNTERS = ('packets', 'bytes', 'ring_drops', 'socket_drops', 'high_water')
+# Seconds the workers get to bind their sockets, and to write their output after a stop
+WORKER_START_TIMEOUT = 10.0
+WORKER_STOP_TIMEOUT = 5.0
+
+
+class IngestRing:
+    """ Fixed number of preallocated record slots """
+
+    def __init__(self, slots: int = 8192, max_payload: int = bufferSize):
+        self.slots = slots
+        self.slot_size = RECORD_HEADER.size + max_payload
+        self.max_payload = max_payload
+        self._buffer = bytearray(slots * self.slot_size)
+        self._view = memoryview(self._buffer)
+        self._lengths = [0] * slots
+        self._head = 0
+        self.pending = 0
+        self.high_water = 0
+        self.drops = 0
+        self.truncated = 0
+
+    def append(self, ts_ns: int, address: Tuple[str, int], data: bytes) -> bool:
+        """ Record a datagram, returns False if the ring is full """
+        if self.pending == self.slots:
+            self.drops += 1
+            return False
+        length = len(data)
+        if length > self.max_payload:
+            self.truncated += 1
+            length = self.max_payload
+        index = (self._head + self.pending) % self.slots
+        offset = index * self.slot_size
+        RECORD_HEADER.pack_into(self._buffer, offset, ts_ns, _ipv4(address[0]), address[1], length)
+        offset += RECORD_HEADER.size
+        self._view[offset:offset + length] = data[:length]
+        self._lengths[index] = RECORD_HEADER.size + length
+        self.pending += 1
+        if self.pending > self.high_water:
+            self.high_water = self.pending
+        return True
+
+    def take(self) -> bytes:
+        """ Remove all pending records, returns them in output format """
+        chunks = []
+        for _ in range(self.pending):
+            offset = self._head * self.slot_size
+            chunks.append(self._view[offset:offset + self._lengths[self._head]])
+            self._head = (self._head + 1) % self.slots
+        self.pending = 0
+        return b''.join(chunks)
+
+
+class IngestProtocol(asyncio.DatagramProtocol):
+    """ Records datagrams and writes the ring to output in batches """
+
+    def __init__(self, output: BinaryIO, ring: IngestRing, flush_batch: int = 1024, echo: bool = False,
+                 table: Optional[DeviceTable] = None):
+        self.output = output
+        self.ring = ring
+        self.table = table
+        self.flush_batch = flush_batch
+        self.echo = echo
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+        self.written = 0
+        self._writing: Optional[asyncio.Future] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        ts_ns = time.time_ns()
+        self.packets += 1
+        self.bytes += len(data)
+        self.ring.append(ts_ns, addr, data)
+        if self.table is not None:
+            self.table.record(ts_ns, data)
+        if self.echo:
+            print(str(time.asctime(time.localtime(ts_ns / 1e9))) + "\t" + str(self.packets) + ":\t" + str(data))
+        if self.ring.pending >= self.flush_batch:
+            self.flush()
+
+    def error_received(self, exc: Exception) -> None:
+        self.errors += 1
+
+    def flush(self) -> None:
+        """ Start writing the pending records unless a write is still running """
+        if self._writing is not None or self.ring.pending == 0:
+            return
+        chunk = self.ring.take()
+        self._writing = asyncio.get_running_loop().run_in_executor(None, self.output.write, chunk)
+        self._writing.add_done_callback(self._write_done)
+
+    def _write_done(self, future: asyncio.Future) -> None:
+        self._writing = None
+        self.written += future.result()
+        if self.ring.pending >= self.flush_batch:
+            self.flush()
+
+    async def drain(self) -> None:
+        """ Write everything recorded so far """
+        while self._writing is not None or self.ring.pending:
+            if self._writing is not None:
+                await asyncio.wait([self._writing])
+            self.flush()
+
+
+def socket_drops(sock: socket.socket) -> Optional[int]:
+    """ Datagrams the kernel dropped for sock (receive buffer overruns), None if unknown """
+    try:
+        inode = os.fstat(sock.fileno()).st_ino
+        with open('/proc/net/udp') as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if int(fields[9]) == inode:
+                    return int(fields[-1])
+    except (OSError, ValueError, IndexError, StopIteration):
+        pass
+    return None
+
+
+def open_socket(host: str, port: int, rcvbuf: int, reuse_port: bool = False) -> socket.socket:
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if rcvbuf > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.bind((host, port))
+    return sock
+
+
+def read_records(path: str) -> Iterator[Tuple[int, str, int, bytes]]:
+    """ Yield (ts_ns, ip, port, payload) for each record of an output file """
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        (ts_ns, ip, port, length) = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        yield (ts_ns, socket.inet_ntoa(struct.pack('!I', ip)), port, data[offset:offset + length])
+        offset += length
+
+
+async def serve(args: argparse.Namespace, index: Optional[int] = None, counters=None, stop=None) -> None:
+    """ Receive until cancelled, or until stop is set when running as worker index """
+    loop = asyncio.get_running_loop()
+    sock = open_socket(args.host, args.port, args.rcvbuf, reuse_port=index is not None)
+    output_path = args.output if index is None else '%s.%d' % (args.output, index)
+    table = DeviceTable() if args.stats_output else None
+    with open(output_path, 'ab') as output:
+        (transport, protocol) = await loop.create_datagram_endpoint(
+                lambda: IngestProtocol(output, IngestRing(args.ring), args.flush_batch, args.echo, table), sock=sock)
+        exporter = None
+        if table is not None:
+            stats_path = args.stats_output if index is None else '%s.%d' % (args.stats_output, index)
+            exporter = asyncio.ensure_future(_export_periodically(table, stats_path, args.report_interval))
+        drops_at_start = socket_drops(sock) or 0
+        if index is None:
+            print("UDP server up and listening", flush=True)
+        else:
+            stop.wait_ready()
+        last_time = time.monotonic()
+        last_packets = 0
+        try:
+            while index is None or not stop.is_set():
+                await asyncio.sleep(args.report_interval if index is None else 0.1)
+                protocol.flush()
+                drops = socket_drops(sock)
+                if index is not None:
+                    _publish(counters, index, protocol, (drops or drops_at_start) - drops_at_start)
+                    continue
+                now = time.monotonic()
+                print("%8.0f pkt/s  total %d  ring drops %d  socket drops %s" % (
+                        (protocol.packets - last_packets) / (now - last_time), protocol.packets, protocol.ring.drops,
+                        '-' if drops is None else str(drops - drops_at_start)), flush=True)
+                last_time = now
+                last_packets = protocol.packets
+        finally:
+            drops = socket_drops(sock)
+            transport.close()
+            await protocol.drain()
+            if exporter is not None:
+                exporter.cancel()
+                table.export(stats_path)
+            if index is not None:
+                _publish(counters, index, protocol, (drops or drops_at_start) - drops_at_start)
+            else:
+                print("total %d packets, %d bytes, ring drops %d, high water %d, socket drops %s" % (
+                        protocol.packets, protocol.bytes, protocol.ring.drops, protocol.ring.high_water,
+                        '-' if drops is None else str(drops - drops_at_start)), flush=True)
+
+
+async def _export_periodically(table: DeviceTable, path: str, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        if len(table):
+            table.export(path)
+
+
+class WorkerControl:
+    """ Start and stop signalling between the parent and the workers """
+
+    # How often waiting workers and the waiting parent check for a stop or a dead worker
+    poll_interval = 0.1
+
+    def __init__(self, workers: int):
+        self._workers = workers
+        self._ready = multiprocessing.Semaphore(0)
+        self._started = multiprocessing.Event()
+        self._stop = multiprocessing.Event()
+
+    def wait_ready(self) -> None:
+        """ In a worker: report its socket bound, then wait until all workers are or a stop """
+        self._ready.release()
+        while not self._started.wait(self.poll_interval):
+            if self._stop.is_set():
+                return
+
+    def wait_workers(self, processes: List[multiprocessing.Process], timeout: float) -> None:
+        """ In the parent: wait until every worker reported ready
+        raises:
+        - RuntimeError if a worker exited or timeout seconds passed
+        """
+        deadline = time.monotonic() + timeout
+        for _ in range(self._workers):
+            while not self._ready.acquire(timeout=self.poll_interval):
+                _check_alive(processes)
+                if time.monotonic() > deadline:
+                    raise RuntimeError('Workers not ready after %.1f s' % (timeout))
+        self._started.set()
+
+    def is_set(self) -> bool:
+        return self._stop.is_set()
+
+    def set(self) -> None:
+        self._stop.set()
+
+
+def _publish(counters, index: int, protocol: IngestProtocol, drops: int) -> None:
+    base = index * len(COUNTERS)
+    counters[base:base + len(COUNTERS)] = [
+            protocol.packets, protocol.bytes, protocol.ring.drops, drops, protocol.ring.high_water]
+
+
+def _run_worker(args: argparse.Namespace, index: int, counters, control: WorkerControl) -> None:
+    # The parent handles Ctrl-C and sets control
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve(args, index, counters, control))
+
+
+def _check_alive(processes: List[multiprocessing.Process]) -> None:
+    for (index, process) in enumerate(processes):
+        if not process.is_alive():
+            raise RuntimeError('Worker %d exited with code %s' % (index, process.exitcode))
+
+
+def _totals(counters, workers: int) -> List[List[int]]:
+    values = counters[:]
+    return [values[i * len(COUNTERS):(i + 1) * len(COUNTERS)] for i in range(workers)]
+
+
+def serve_workers(args: argparse.Namespace) -> None:
+    """ Run args.workers SO_REUSEPORT workers and print their aggregated statistics """
+    counters = multiprocessing.Array('q', args.workers * len(COUNTERS), lock=False)
+    control = WorkerControl(args.workers)
+    processes = [multiprocessing.Process(target=_run_worker, args=(args, index, counters, control), daemon=True)
+                 for index in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        control.wait_workers(processes, WORKER_START_TIMEOUT)
+        print("UDP server up and listening with %d workers" % (args.workers), flush=True)
+        last_time = time.monotonic()
+        last_packets = 0
+        while True:
+            time.sleep(args.report_interval)
+            _check_alive(processes)
+            now = time.monotonic()
+            per_worker = _totals(counters, args.workers)
+            packets = sum(worker[0] for worker in per_worker)
+            print("%8.0f pkt/s  total %d  ring drops %d  socket drops %d  per worker %s" % (
+                    (packets - last_packets) / (now - last_time), packets, sum(worker[2] for worker in per_worker),
+                    sum(worker[3] for worker in per_worker), '/'.join(str(worker[0]) for worker in per_worker)),
+                  flush=True)
+            last_time = now
+            last_packets = packets
+    finally:
+        control.set()
+        for process in processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        per_worker = _totals(counters, args.workers)
+        print("total %d packets, %d bytes, ring drops %d, high water %d, socket drops %d" % (
+                sum(worker[0] for worker in per_worker), sum(worker[1] for worker in per_worker),
+                sum(worker[2] for worker in per_worker), max(worker[4] for worker in per_worker),
+                sum(worker[3] for worker in per_worker)), flush=True)
+
+
+def _ipv4(address: str) -> int:
+    try:
+        return struct.unpack('!I', socket.inet_aton(address))[0]
+    except OSError:
+        return 0
 
-# Create a datagram socket
-UDPServerSocket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
 
-# Bind to address and ip
-UDPServerSocket.bind((localIP, localPort))
+def main() -> None:
+    parser = argparse.ArgumentParser(description='UDP ingest server')
+    parser.add_argument('--host', default=localIP)
+    parser.add_argument('--port', type=int, default=localPort)
+    parser.add_argument('--output', default='udp_ingest.bin', help='binary record file, appended to')
+    parser.add_argument('--ring', type=int, default=8192, help='ring buffer slots')
+    parser.add_argument('--flush-batch', type=int, default=1024, help='records per disk write')
+    parser.add_argument('--rcvbuf', type=int, default=4 * 1024 * 1024, help='socket receive buffer size')
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    parser.add_argument('--echo', action='store_true', help='print every datagram')
+    parser.add_argument('--stats-output', default='uplink_stats.csv',
+                        help='per device uplink statistics, empty to disable')
+    parser.add_argument('--workers', type=int, default=1, help='processes sharing the port with SO_REUSEPORT')
+    args = parser.parse_args()
 
-print("UDP server up and listening")
+    try:
+        if args.workers > 1:
+            serve_workers(args)
+        else:
+            asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("Adios")
+    except RuntimeError as e:
+        print(e)
+        raise SystemExit(1)
 
-# Listen for incoming datagrams
-counter = 1
-try:
-    while(True):
-        bytesAddressPair = UDPServerSocket.recvfrom(bufferSize)
-        message = bytesAddressPair[0]
-        address = bytesAddressPair[1]
-        print(str(time.asctime(time.localtime())) + "\t" + str(counter) + ":\t" + str(message))
-        counter = counter+1
 
-except KeyboardInterrupt:
-    print("Adios")
+if __name__ == "__main__":
+    main()
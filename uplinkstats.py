@@ -0,0 +1,153 @@
+""" Per-device uplink statistics from probe datagrams.
+
+A probe payload is <device id:u16><sequence number:u32><send time ns:u64>,
+big endian, as sent by test_bc66.py. The send time is wall clock time
+(time.time_ns()) since it is compared with the arrival time taken on another
+host; keep device and server NTP synchronised.
+
+DeviceTable keeps one row per device in flat arrays: counters for received,
+duplicate, reordered and lost datagrams and a one-way latency histogram.
+
+usage:
+    table = DeviceTable()
+    table.record(arrival_ns, payload)
+    table.export('uplink_stats.csv')
+"""
+
+import os
+import struct
+from array import array
+from typing import List, Optional, Tuple
+
+PROBE = struct.Struct('>HIQ')
+# Upper bucket edges of the latency histogram in ms, the last bucket is open
+LATENCY_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+NUM_BUCKETS = len(LATENCY_EDGES_MS) + 1
+# Sequence numbers behind the newest one for which duplicates are detected
+SEQ_WINDOW = 64
+
+_NO_ROW = -1
+
+
+def pack_probe(device_id: int, seq: int, send_ns: int) -> bytes:
+    return PROBE.pack(device_id, seq & 0xFFFFFFFF, send_ns)
+
+
+class DeviceTable:
+    """ Uplink counters and latency histogram per device id """
+
+    def __init__(self):
+        # device id -> row, rows are allocated on first sight
+        self._rows = array('i', [_NO_ROW]) * 0x10000
+        self.device_ids = array('H')
+        self.first_seq = array('q')
+        self.max_seq = array('q')
+        self.seen = array('Q')
+        self.received = array('Q')
+        self.duplicates = array('Q')
+        self.reordered = array('Q')
+        self.clock_skewed = array('Q')
+        self.latency_sum_ms = array('d')
+        self.histogram = array('Q')
+        self.malformed = 0
+
+    def __len__(self) -> int:
+        return len(self.device_ids)
+
+    def record(self, arrival_ns: int, payload: bytes) -> bool:
+        """ Account a probe payload, returns False if it is no probe """
+        if len(payload) != PROBE.size:
+            self.malformed += 1
+            return False
+        (device_id, seq, send_ns) = PROBE.unpack(payload)
+        row = self._row(device_id, seq)
+        self.received[row] += 1
+
+        newest = self.max_seq[row]
+        if seq > newest:
+            shift = seq - newest
+            self.seen[row] = ((self.seen[row] << shift) | 1) & 0xFFFFFFFFFFFFFFFF if shift < SEQ_WINDOW else 1
+            self.max_seq[row] = seq
+        else:
+            offset = newest - seq
+            if offset < SEQ_WINDOW and self.seen[row] >> offset & 1:
+                self.duplicates[row] += 1
+                return True
+            if offset < SEQ_WINDOW:
+                self.seen[row] |= 1 << offset
+            self.reordered[row] += 1
+            if seq < self.first_seq[row]:
+                self.first_seq[row] = seq
+
+        latency_ms = (arrival_ns - send_ns) / 1e6
+        if latency_ms < 0:
+            self.clock_skewed[row] += 1
+            latency_ms = 0.0
+        self.latency_sum_ms[row] += latency_ms
+        bucket = 0
+        while bucket < len(LATENCY_EDGES_MS) and latency_ms > LATENCY_EDGES_MS[bucket]:
+            bucket += 1
+        self.histogram[row * NUM_BUCKETS + bucket] += 1
+        return True
+
+    def lost(self, row: int) -> int:
+        """ Sequence numbers between the first and newest one never received """
+        unique = self.received[row] - self.duplicates[row]
+        return max(0, self.max_seq[row] - self.first_seq[row] + 1 - unique)
+
+    def latency_percentile(self, row: int, percentile: float) -> Optional[float]:
+        """ Upper bucket edge in ms holding the percentile, inf for the open bucket """
+        counts = self.histogram[row * NUM_BUCKETS:(row + 1) * NUM_BUCKETS]
+        total = sum(counts)
+        if total == 0:
+            return None
+        threshold = total * percentile / 100.0
+        cumulative = 0
+        for (bucket, count) in enumerate(counts):
+            cumulative += count
+            if cumulative >= threshold:
+                break
+        return LATENCY_EDGES_MS[bucket] if bucket < len(LATENCY_EDGES_MS) else float('inf')
+
+    def rows(self) -> List[Tuple]:
+        """ (device, received, duplicates, reordered, lost, mean ms, p50 ms, p99 ms) per device """
+        result = []
+        for row in range(len(self)):
+            unique = self.received[row] - self.duplicates[row]
+            result.append((self.device_ids[row], self.received[row], self.duplicates[row], self.reordered[row],
+                           self.lost(row), self.latency_sum_ms[row] / unique if unique else None,
+                           self.latency_percentile(row, 50), self.latency_percentile(row, 99)))
+        return result
+
+    def export(self, path: str) -> None:
+        """ Replace path with a CSV snapshot of the table """
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write('device,received,duplicates,reordered,lost,clock_skewed,mean_ms,p50_ms,p99_ms,'
+                    + ','.join('le_%d_ms' % (edge) for edge in LATENCY_EDGES_MS) + ',gt_%d_ms\n' % (LATENCY_EDGES_MS[-1]))
+            for (row, values) in enumerate(self.rows()):
+                (device_id, received, duplicates, reordered, lost, mean_ms, p50_ms, p99_ms) = values
+                f.write('%d,%d,%d,%d,%d,%d,%s,%s,%s,%s\n' % (
+                        device_id, received, duplicates, reordered, lost, self.clock_skewed[row],
+                        '' if mean_ms is None else '%.1f' % (mean_ms), '' if p50_ms is None else p50_ms,
+                        '' if p99_ms is None else p99_ms,
+                        ','.join(str(count) for count in self.histogram[row * NUM_BUCKETS:(row + 1) * NUM_BUCKETS])))
+        os.replace(temporary, path)
+
+    def _row(self, device_id: int, seq: int) -> int:
+        row = self._rows[device_id]
+        if row != _NO_ROW:
+            return row
+        row = len(self.device_ids)
+        self._rows[device_id] = row
+        self.device_ids.append(device_id)
+        self.first_seq.append(seq)
+        self.max_seq.append(seq - 1)
+        self.seen.append(0)
+        self.received.append(0)
+        self.duplicates.append(0)
+        self.reordered.append(0)
+        self.clock_skewed.append(0)
+        self.latency_sum_ms.append(0.0)
+        self.histogram.extend(array('Q', [0]) * NUM_BUCKETS)
+        return row